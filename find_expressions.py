@@ -3,94 +3,1348 @@
 """
 Print all expressions with `nums` evaluating to `n` and return their count.
 
-Usage: `./prog.py n num1 num2 ...`
+The expressions use each of the numbers at most once (the numbers are told
+apart by their positions, so equal numbers give separate expressions), and
+they are evaluated exactly, with rational arithmetic.
+
+With `--canonical`, only the canonical forms of the expressions are printed,
+i.e., those that are the same up to the order of the operands of `+` and `*`
+and the parentheses between them are printed only once.
+
+To query the same numbers for many targets, `ExpressionTable` holds the values
+of all their expressions (and can be saved to a file and loaded back), and
+answers exact and nearest-value queries without searching again.
+
+With `--procs`, the search runs in parallel processes.
+
+Usage: `./prog.py n num1 num2 ... [--canonical [--raw-count]] [--procs N]`
 """
 
-import sys
-from typing import TypeAlias, Literal, get_args, Optional
+import argparse
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+from functools import partial
+from math import gcd
+from multiprocessing import Pool
+import pickle
+from typing import (
+    Any, Callable, Iterator, TypeAlias, TypeVar, Literal, get_args,
+    Optional,
+)
 
 
 T_ops = Literal["+", "-", "/", "*"]
 ops = get_args(T_ops)
-T_postfix: TypeAlias = tuple[int | T_ops, ...]
-
-
-def postfix(expr: T_postfix) -> tuple[Optional[str], Optional[int | float]]:
-    """
-    Return infix version and value of the given expression.
-    """
-    stack: list[str | float | int]
-    infix: str = ""
-    result: int | float = 0
-    for run_eval in (False, True):
-        stack = list()
-        for token in expr:
-            if isinstance(token, str):
-                try:
-                    value2 = stack.pop()
-                    value1 = stack.pop()
-                except IndexError:
-                    raise ValueError(
-                        f"invalid postfix expression: {repr(expr)}",
-                    )
-                sub_expr = f"({value1}{token}{value2})"
-                if run_eval:
-                    try:
-                        stack.append(eval(sub_expr))
-                    except ZeroDivisionError:
-                        return None, None
+# The values are kept exact, as `int` if they are whole, and otherwise as
+# `(numerator, denominator)` in the lowest terms (with `denominator > 1`), as
+# they are mostly used as keys of dictionaries, and `Fraction` is slow both to
+# compute with and to hash.
+T_value: TypeAlias = int | tuple[int, int]
+
+
+class _Wildcard:
+    """
+    The type of `_ANY` and `_NONZERO`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+# A value, or one of `_ANY` and `_NONZERO`.
+T_operand: TypeAlias = T_value | _Wildcard
+# A match of `_ExpressionSearch._matches`: operator, and the mask and the value
+# of its left and right operand.
+T_match: TypeAlias = tuple[T_ops, int, T_operand, int, T_operand]
+# The counts of `_CanonicalSearch.kinds` for a value that no form has.
+_NO_FORMS = (0, 0, 0, 0)
+# Splits of a mask into two subsets (see `_ExpressionSearch.splits`).
+T_splits: TypeAlias = list[tuple[int, int]]
+# A part of the search of `_parallel`: `(mask, index, value)`, for the
+# expressions over `mask` evaluating to `value` that split it (at the top
+# level) in the `index`-th way (see `_ExpressionSearch.splits`), or, if
+# `index` is `None`, all of them.
+T_task: TypeAlias = tuple[int, Optional[int], T_value]
+# The result of a part of the search of `_parallel`.
+T_result = TypeVar("T_result")
+
+# Values of the operands in `_ExpressionSearch._matches` that stand for any
+# value, and for any non-zero value.
+_ANY = _Wildcard("_ANY")
+_NONZERO = _Wildcard("_NONZERO")
+
+
+def _ratio(numerator: int, denominator: int) -> T_value:
+    """
+    Return the value `numerator / denominator` (with `denominator != 0`).
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    divisor = gcd(numerator, denominator)
+    if divisor != 1:
+        numerator //= divisor
+        denominator //= divisor
+    return numerator if denominator == 1 else (numerator, denominator)
+
+
+def _add(value1: T_value, value2: T_value) -> T_value:
+    """
+    Return `value1 + value2`.
+    """
+    if isinstance(value1, int) and isinstance(value2, int):
+        return value1 + value2
+    numerator1, denominator1 = (
+        (value1, 1) if isinstance(value1, int) else value1
+    )
+    numerator2, denominator2 = (
+        (value2, 1) if isinstance(value2, int) else value2
+    )
+    return _ratio(
+        numerator1 * denominator2 + numerator2 * denominator1,
+        denominator1 * denominator2,
+    )
+
+
+def _sub(value1: T_value, value2: T_value) -> T_value:
+    """
+    Return `value1 - value2`.
+    """
+    if isinstance(value1, int) and isinstance(value2, int):
+        return value1 - value2
+    numerator1, denominator1 = (
+        (value1, 1) if isinstance(value1, int) else value1
+    )
+    numerator2, denominator2 = (
+        (value2, 1) if isinstance(value2, int) else value2
+    )
+    return _ratio(
+        numerator1 * denominator2 - numerator2 * denominator1,
+        denominator1 * denominator2,
+    )
+
+
+def _neg(value: T_value) -> T_value:
+    """
+    Return `-value`.
+    """
+    return -value if isinstance(value, int) else (-value[0], value[1])
+
+
+def _mul(value1: T_value, value2: T_value) -> T_value:
+    """
+    Return `value1 * value2`.
+    """
+    if isinstance(value1, int) and isinstance(value2, int):
+        return value1 * value2
+    numerator1, denominator1 = (
+        (value1, 1) if isinstance(value1, int) else value1
+    )
+    numerator2, denominator2 = (
+        (value2, 1) if isinstance(value2, int) else value2
+    )
+    return _ratio(numerator1 * numerator2, denominator1 * denominator2)
+
+
+def _div(value1: T_value, value2: T_value) -> T_value:
+    """
+    Return `value1 / value2` (with `value2 != 0`).
+    """
+    if isinstance(value1, int) and isinstance(value2, int):
+        if value1 % value2:
+            return _ratio(value1, value2)
+        return value1 // value2
+    numerator1, denominator1 = (
+        (value1, 1) if isinstance(value1, int) else value1
+    )
+    numerator2, denominator2 = (
+        (value2, 1) if isinstance(value2, int) else value2
+    )
+    return _ratio(numerator1 * denominator2, denominator1 * numerator2)
+
+
+def _value(number: int | Fraction) -> T_value:
+    """
+    Return the value of `number`.
+    """
+    return _ratio(number.numerator, number.denominator)
+
+
+def _number(value: T_value) -> int | Fraction:
+    """
+    Return `value` as a number.
+    """
+    return value if isinstance(value, int) else Fraction(*value)
+
+
+class _ExpressionSearch:
+    """
+    Exact search for the expressions over the subsets of numbers.
+
+    The subsets of `nums` are represented by bit masks (bit `i` is set if the
+    subset contains `nums[i]`). An expression over a subset is either its
+    only number, or an operator applied to the expressions over two disjoint
+    subsets that make it up.
+
+    For the smaller subsets (see `__init__`), all the values that their
+    expressions can have are tabulated, with the number of expressions giving
+    each of them, from the smaller subsets up. For a bigger subset, the
+    number of expressions with some particular value is computed when needed
+    (and memoized): for each of its splits into two subsets, the values of the
+    smaller one are taken from its table and, for each operator, the value
+    that the other one needs for the result to come out right is looked up
+    (in the table or, recursively, in the same way). The text of the
+    expressions is only built for those that are found.
+    """
+
+    # What is counted for a single number (see `counts`).
+    _SINGLE: Any = 1
+
+    def __init__(
+        self, nums: tuple[int, ...], table_size: Optional[int] = None,
+    ) -> None:
+        self.nums = tuple(nums)
+        self.full = (1 << len(self.nums)) - 1
+        # Mask -> value -> the number of expressions with it. For the masks in
+        # `self.complete`, these are all the values that the expressions can
+        # have, and for the others, these are the values asked for so far.
+        self.counts: dict[int, dict[T_value, Any]] = {
+            1 << i: {num: self._SINGLE} for i, num in enumerate(self.nums)
+        }
+        self.complete = set(self.counts)
+        # Mask -> the number of its expressions without division by zero.
+        self.totals: dict[int, Any] = dict.fromkeys(self.counts, self._SINGLE)
+        self._splits: dict[int, list[tuple[int, int]]] = dict()
+        # Unless `table_size` is given, the tables are made for the subsets of
+        # up to half of the numbers (rounded up; needed for the splits of the
+        # bigger subsets), and up to four of them if there are at least six
+        # numbers (the tables of the bigger subsets take longer to make than
+        # the searches in them).
+        if table_size is None:
+            table_size = max(
+                (len(self.nums) + 1) // 2, min(len(self.nums) - 2, 4),
+            )
+        for mask in range(1, self.full + 1):
+            if 1 < mask.bit_count() <= table_size:
+                self.values(mask)
+
+    def splits(self, mask: int) -> list[tuple[int, int]]:
+        """
+        Return all the ways to split `mask` into two non-empty subsets, as
+        `(smaller, bigger)` pairs.
+
+        Each split is given once, with the subset with fewer numbers first
+        (or, if they have the same number of them, the one with the smaller
+        mask).
+        """
+        try:
+            return self._splits[mask]
+        except KeyError:
+            pass
+        result = list()
+        part = (mask - 1) & mask
+        while part:
+            other = mask ^ part
+            if (part.bit_count(), part) < (other.bit_count(), other):
+                result.append((part, other))
+            part = (part - 1) & mask
+        result.reverse()
+        self._splits[mask] = result
+        return result
+
+    def values(self, mask: int) -> dict[T_value, int]:
+        """
+        Return the table of all the values of the expressions over `mask`
+        (value -> the number of expressions with it).
+        """
+        if mask in self.complete:
+            return self.counts[mask]
+        result: dict[T_value, int] = dict()
+        get = result.get
+        for part1, part2 in self.splits(mask):
+            values2 = self.values(part2)
+            for value1, count1 in self.values(part1).items():
+                for value2, count2 in values2.items():
+                    count = count1 * count2
+                    value = _add(value1, value2)
+                    result[value] = get(value, 0) + 2 * count
+                    value = _sub(value1, value2)
+                    result[value] = get(value, 0) + count
+                    value = _sub(value2, value1)
+                    result[value] = get(value, 0) + count
+                    value = _mul(value1, value2)
+                    result[value] = get(value, 0) + 2 * count
+                    if value2:
+                        value = _div(value1, value2)
+                        result[value] = get(value, 0) + count
+                    if value1:
+                        value = _div(value2, value1)
+                        result[value] = get(value, 0) + count
+        self.counts[mask] = result
+        self.complete.add(mask)
+        self.totals[mask] = sum(result.values())
+        return result
+
+    def count(self, mask: int, value: T_operand) -> int:
+        """
+        Return the number of expressions over `mask` that evaluate to `value`
+        (which can also be `_ANY` or `_NONZERO`).
+        """
+        if isinstance(value, _Wildcard):
+            if value is _ANY:
+                return self.total(mask)
+            return self.total(mask) - self.count(mask, 0)
+        counts = self.counts.setdefault(mask, dict())
+        try:
+            return counts[value]
+        except KeyError:
+            if mask in self.complete:
+                return 0
+        result = counts[value] = self._count_at(mask, value)
+        return result
+
+    def _count_at(
+        self, mask: int, value: T_value, splits: Optional[T_splits] = None,
+    ) -> int:
+        """
+        Return the number of expressions over `mask` that evaluate to `value`
+        (with the operands over `splits`, if given, see `_matches`).
+        """
+        return sum(
+            self.count(mask1, value1) * self.count(mask2, value2)
+            for _, mask1, value1, mask2, value2 in self._matches(
+                mask, value, splits,
+            )
+        )
+
+    def total(self, mask: int) -> int:
+        """
+        Return the number of expressions over `mask` (leaving out those with
+        division by zero).
+        """
+        try:
+            return self.totals[mask]
+        except KeyError:
+            pass
+        result = 0
+        for part1, part2 in self.splits(mask):
+            total1 = self.total(part1)
+            total2 = self.total(part2)
+            result += (
+                6 * total1 * total2
+                + total1 * (total2 - self.count(part2, 0))
+                + total2 * (total1 - self.count(part1, 0))
+            )
+        self.totals[mask] = result
+        return result
+
+    def _matches(
+        self, mask: int, value: T_value, splits: Optional[T_splits] = None,
+    ) -> Iterator[T_match]:
+        """
+        Yield `(op, mask1, value1, mask2, value2)` for the expressions over
+        `mask` evaluating to `value` as `(expr1 op expr2)`, where `expr1` is an
+        expression over `mask1` evaluating to `value1`, and `expr2` over
+        `mask2` evaluating to `value2`, for which such expressions exist.
+
+        The operand values can be `_ANY` (meaning all the expressions) or
+        `_NONZERO` (all those that don't evaluate to zero), when the result
+        doesn't depend on the value (e.g., `0 * x`).
+
+        If `splits` are given, only the expressions with the operands over
+        them (a part of `self.splits(mask)`) are matched.
+        """
+        for small, big in self.splits(mask) if splits is None else splits:
+            if big in self.complete:
+                count = self.counts[big].get
+            else:
+                count = partial(self.count, big)
+            for small_value in self.values(small):
+                difference: T_value
+                total: T_value
+                product: T_value
+                if isinstance(value, int) and isinstance(small_value, int):
+                    difference = value - small_value
+                    total = value + small_value
+                    product = value * small_value
                 else:
-                    stack.append(sub_expr)
+                    difference = _sub(value, small_value)
+                    total = _add(value, small_value)
+                    product = _mul(value, small_value)
+                # op = "+"
+                if count(difference):
+                    yield "+", small, small_value, big, difference
+                    yield "+", big, difference, small, small_value
+                # op = "-"
+                big_value = _neg(difference)
+                if count(big_value):
+                    yield "-", small, small_value, big, big_value
+                if count(total):
+                    yield "-", big, total, small, small_value
+                # op = "/"
+                if value:
+                    if small_value:
+                        big_value = _div(small_value, value)
+                        if count(big_value):
+                            yield "/", small, small_value, big, big_value
+                elif not small_value and self.count(big, _NONZERO):
+                    yield "/", small, small_value, big, _NONZERO
+                if small_value and count(product):
+                    yield "/", big, product, small, small_value
+                # op = "*"
+                if small_value:
+                    big_value = _div(value, small_value)
+                    if count(big_value):
+                        yield "*", small, small_value, big, big_value
+                        yield "*", big, big_value, small, small_value
+                elif not value and self.count(big, _ANY):
+                    yield "*", small, small_value, big, _ANY
+                    yield "*", big, _ANY, small, small_value
+
+    def expressions(
+        self, mask: int, value: T_operand, splits: Optional[T_splits] = None,
+    ) -> Iterator[str]:
+        """
+        Yield all the expressions over `mask` that evaluate to `value` (which
+        can also be `_ANY` or `_NONZERO`), each in parentheses (except for
+        the single numbers).
+
+        If `splits` are given, only the expressions with the operands over
+        them are given (see `_matches`).
+        """
+        if isinstance(value, _Wildcard):
+            for real_value in self.values(mask):
+                if real_value or value is _ANY:
+                    yield from self.expressions(mask, real_value, splits)
+        elif mask & (mask - 1) == 0:
+            if self.count(mask, value):
+                yield str(self.nums[mask.bit_length() - 1])
+        else:
+            for op, mask1, value1, mask2, value2 in self._matches(
+                mask, value, splits,
+            ):
+                for expr1 in self.expressions(mask1, value1):
+                    for expr2 in self.expressions(mask2, value2):
+                        yield f"({expr1}{op}{expr2})"
+
+
+class _CanonicalSearch(_ExpressionSearch):
+    """
+    Exact search for the canonical forms of the expressions over the subsets
+    of numbers.
+
+    In the canonical forms, sums and products are not binary, but they have
+    any number (at least two) of operands, none of which is itself a sum
+    (resp. a product), ordered by the lowest positions of the numbers in them.
+    So, `a+b`, `b+a`, `(a+b)+c`, and `a+(b+c)` all have the same canonical
+    form (`a+b`, resp. `a+b+c`), while `a-(b-c)` and `(a-b)+c` are still told
+    apart, as are the equal numbers in different positions.
+
+    The search works just like `_ExpressionSearch`, except that the numbers of
+    the sums and the products are counted separately, as `(all, sums,
+    products, raw)`, where `raw` is the number of all the expressions (so
+    both can be had from one search). A sum is matched as its first operand
+    (one that isn't a sum, over the subset with the lowest position) plus the
+    sum of the others (or the only other one), which is any canonical form
+    over the rest of the subset, and the same goes for the products.
+
+    The search goes through the same values of the same subsets as
+    `_ExpressionSearch`, so counting the canonical forms takes a bit longer
+    than counting all the expressions. It is listing them that is faster, as
+    there are fewer of them to build.
+    """
+
+    _SINGLE = (1, 0, 0, 1)
+
+    def values(self, mask: int) -> dict[T_value, Any]:
+        """
+        Return the table of all the values of the canonical forms over `mask`
+        (value -> `(all, sums, products, raw)`, see `kinds`).
+        """
+        if mask in self.complete:
+            return self.counts[mask]
+        result: dict[T_value, list[int]] = dict()
+
+        def add(
+            value: T_value, count: int, sums: int, products: int, raw: int,
+        ) -> None:
+            try:
+                counts = result[value]
+            except KeyError:
+                result[value] = [count, sums, products, raw]
             else:
-                stack.append(token)
-        if len(stack) != 1:
-            raise ValueError(f"invalid postfix expression: {repr(expr)}")
-        r = stack.pop()
-        if run_eval and isinstance(r, (float, int)):
-            result = int(r) if isinstance(r, float) and r.is_integer() else r
-        elif not run_eval and isinstance(r, str):
-            infix = str(r)
+                counts[0] += count
+                counts[1] += sums
+                counts[2] += products
+                counts[3] += raw
+
+        low = mask & -mask
+        for part1, part2 in self.splits(mask):
+            values2 = self.values(part2)
+            for value1, counts1 in self.values(part1).items():
+                for value2, counts2 in values2.items():
+                    count = counts1[0] * counts2[0]
+                    raw = counts1[3] * counts2[3]
+                    # The first operand of the sums and the products is the
+                    # one with the lowest position.
+                    if part1 & low:
+                        first, rest = counts1, counts2
+                    else:
+                        first, rest = counts2, counts1
+                    sums = (first[0] - first[1]) * rest[0]
+                    products = (first[0] - first[2]) * rest[0]
+                    add(_add(value1, value2), sums, sums, 0, 2 * raw)
+                    add(_mul(value1, value2), products, 0, products, 2 * raw)
+                    add(_sub(value1, value2), count, 0, 0, raw)
+                    add(_sub(value2, value1), count, 0, 0, raw)
+                    if value2:
+                        add(_div(value1, value2), count, 0, 0, raw)
+                    if value1:
+                        add(_div(value2, value1), count, 0, 0, raw)
+        self.counts[mask] = {
+            value: tuple(counts) for value, counts in result.items()
+        }
+        self.complete.add(mask)
+        self.totals[mask] = tuple(
+            sum(counts[i] for counts in result.values()) for i in range(4)
+        )
+        return self.counts[mask]
+
+    def kinds(self, mask: int, value: T_operand) -> tuple[int, int, int, int]:
+        """
+        Return the numbers of the canonical forms over `mask` that evaluate to
+        `value` (which can also be `_ANY` or `_NONZERO`), as `(all, sums,
+        products, raw)`, where `raw` is the number of all the expressions
+        (as counted by `_ExpressionSearch`) with that value.
+        """
+        if isinstance(value, _Wildcard):
+            totals = self.kind_totals(mask)
+            if value is _ANY:
+                return totals
+            zero = self.kinds(mask, 0)
+            return (
+                totals[0] - zero[0],
+                totals[1] - zero[1],
+                totals[2] - zero[2],
+                totals[3] - zero[3],
+            )
+        counts = self.counts.setdefault(mask, dict())
+        try:
+            return counts[value]
+        except KeyError:
+            if mask in self.complete:
+                return _NO_FORMS
+        result = counts[value] = self._count_kinds(mask, value)
+        return result
 
-    return str(infix)[1:-1], result
+    def _kinds_of(
+        self, mask: int,
+    ) -> Callable[[T_value], tuple[int, int, int, int]]:
+        """
+        Return a function giving `kinds` of the canonical forms over `mask`
+        for a value (the fastest one for `mask`).
+        """
+        if mask not in self.complete:
+            return partial(self.kinds, mask)
+        get = self.counts[mask].get
+        return lambda value: get(value, _NO_FORMS)
+
+    def count(self, mask: int, value: T_operand) -> int:
+        """
+        Return the number of canonical forms over `mask` that evaluate to
+        `value` (which can also be `_ANY` or `_NONZERO`).
+        """
+        return self.kinds(mask, value)[0]
+
+    def raw_count(self, mask: int, value: T_operand) -> int:
+        """
+        Return the number of all the expressions over `mask` that evaluate to
+        `value` (not just of their canonical forms).
+        """
+        return self.kinds(mask, value)[3]
+
+    def _count_at(
+        self, mask: int, value: T_value, splits: Optional[T_splits] = None,
+    ) -> int:
+        """
+        Return the number of canonical forms over `mask` that evaluate to
+        `value` (with the operands over `splits`, if given).
+        """
+        return self._count_kinds(mask, value, splits)[0]
+
+    def _count_kinds(
+        self, mask: int, value: T_value, splits: Optional[T_splits] = None,
+    ) -> tuple[int, int, int, int]:
+        """
+        Return `kinds` of the canonical forms over `mask` that evaluate to
+        `value` (with the operands over `splits`, if given), counted from
+        their operands.
+
+        This goes through the same operands as `_matches`, but it only looks
+        up the counts of each of them once, and it also counts the forms that
+        `_matches` leaves out (as they are not canonical) in `raw`.
+        """
+        sums = products = others = raw = 0
+        low = mask & -mask
+        for small, big in self.splits(mask) if splits is None else splits:
+            small_first = bool(small & low)
+            kinds = self._kinds_of(big)
+            for small_value, small_counts in self.values(small).items():
+                small_all, small_sums, small_products, small_raw = (
+                    small_counts
+                )
+                difference: T_value
+                total: T_value
+                product: T_value
+                if isinstance(value, int) and isinstance(small_value, int):
+                    difference = value - small_value
+                    total = value + small_value
+                    product = value * small_value
+                else:
+                    difference = _sub(value, small_value)
+                    total = _add(value, small_value)
+                    product = _mul(value, small_value)
+                # op = "+"
+                big_kinds = kinds(difference)
+                if small_first:
+                    sums += (small_all - small_sums) * big_kinds[0]
+                else:
+                    sums += (big_kinds[0] - big_kinds[1]) * small_all
+                raw += 2 * small_raw * big_kinds[3]
+                # op = "-"
+                big_kinds = kinds(_neg(difference))
+                others += small_all * big_kinds[0]
+                raw += small_raw * big_kinds[3]
+                big_kinds = kinds(total)
+                others += small_all * big_kinds[0]
+                raw += small_raw * big_kinds[3]
+                # op = "/"
+                if value:
+                    if small_value:
+                        big_kinds = kinds(_div(small_value, value))
+                        others += small_all * big_kinds[0]
+                        raw += small_raw * big_kinds[3]
+                elif not small_value:
+                    big_kinds = self.kinds(big, _NONZERO)
+                    others += small_all * big_kinds[0]
+                    raw += small_raw * big_kinds[3]
+                if small_value:
+                    big_kinds = kinds(product)
+                    others += small_all * big_kinds[0]
+                    raw += small_raw * big_kinds[3]
+                # op = "*"
+                if small_value:
+                    big_kinds = kinds(_div(value, small_value))
+                elif value:
+                    continue
+                else:
+                    big_kinds = self.kinds(big, _ANY)
+                if small_first:
+                    products += (small_all - small_products) * big_kinds[0]
+                else:
+                    products += (big_kinds[0] - big_kinds[2]) * small_all
+                raw += 2 * small_raw * big_kinds[3]
+        return sums + products + others, sums, products, raw
+
+    def total(self, mask: int) -> int:
+        """
+        Return the number of canonical forms over `mask` (leaving out those
+        with division by zero).
+        """
+        return self.kind_totals(mask)[0]
+
+    def kind_totals(self, mask: int) -> tuple[int, int, int, int]:
+        """
+        Return `kinds` of all the canonical forms over `mask` (leaving out
+        those with division by zero).
+        """
+        try:
+            return self.totals[mask]
+        except KeyError:
+            pass
+        sums = products = others = raw = 0
+        low = mask & -mask
+        for part1, part2 in self.splits(mask):
+            first, rest = (part1, part2) if part1 & low else (part2, part1)
+            total1, first_sums, first_products, raw1 = self.kind_totals(first)
+            total2, _, _, raw2 = self.kind_totals(rest)
+            zero1 = self.kinds(first, 0)
+            zero2 = self.kinds(rest, 0)
+            sums += (total1 - first_sums) * total2
+            products += (total1 - first_products) * total2
+            others += (
+                2 * total1 * total2
+                + total1 * (total2 - zero2[0])
+                + total2 * (total1 - zero1[0])
+            )
+            raw += (
+                6 * raw1 * raw2
+                + raw1 * (raw2 - zero2[3])
+                + raw2 * (raw1 - zero1[3])
+            )
+        self.totals[mask] = (sums + products + others, sums, products, raw)
+        return self.totals[mask]
+
+    def _matches(
+        self, mask: int, value: T_value, splits: Optional[T_splits] = None,
+    ) -> Iterator[T_match]:
+        """
+        Yield `(op, mask1, value1, mask2, value2)` as in
+        `_ExpressionSearch._matches`, except that, for sums and products,
+        `mask1` and `value1` are those of the first operand (which is not of
+        the same kind), and `mask2` and `value2` those of the others.
+        """
+        low = mask & -mask
+        for small, big in self.splits(mask) if splits is None else splits:
+            small_first = bool(small & low)
+            kinds = self._kinds_of(big)
+            for small_value, small_counts in self.values(small).items():
+                difference: T_value
+                total: T_value
+                product: T_value
+                if isinstance(value, int) and isinstance(small_value, int):
+                    difference = value - small_value
+                    total = value + small_value
+                    product = value * small_value
+                else:
+                    difference = _sub(value, small_value)
+                    total = _add(value, small_value)
+                    product = _mul(value, small_value)
+                # op = "+"
+                big_kinds = kinds(difference)
+                if small_first:
+                    if small_counts[0] > small_counts[1] and big_kinds[0]:
+                        yield "+", small, small_value, big, difference
+                elif big_kinds[0] > big_kinds[1]:
+                    yield "+", big, difference, small, small_value
+                # op = "-"
+                big_value = _neg(difference)
+                if kinds(big_value)[0]:
+                    yield "-", small, small_value, big, big_value
+                if kinds(total)[0]:
+                    yield "-", big, total, small, small_value
+                # op = "/"
+                if value:
+                    if small_value:
+                        big_value = _div(small_value, value)
+                        if kinds(big_value)[0]:
+                            yield "/", small, small_value, big, big_value
+                elif not small_value and self.count(big, _NONZERO):
+                    yield "/", small, small_value, big, _NONZERO
+                if small_value and kinds(product)[0]:
+                    yield "/", big, product, small, small_value
+                # op = "*"
+                big_operand: T_operand
+                if small_value:
+                    big_operand = _div(value, small_value)
+                elif value:
+                    continue
+                else:
+                    big_operand = _ANY
+                if isinstance(big_operand, _Wildcard):
+                    big_kinds = self.kinds(big, big_operand)
+                else:
+                    big_kinds = kinds(big_operand)
+                if small_first:
+                    if small_counts[0] > small_counts[2] and big_kinds[0]:
+                        yield "*", small, small_value, big, big_operand
+                elif big_kinds[0] > big_kinds[2]:
+                    yield "*", big, big_operand, small, small_value
+
+    def _forms(
+        self,
+        mask: int,
+        value: T_operand,
+        splits: Optional[T_splits] = None,
+        *,
+        exclude: Optional[T_ops] = None,
+    ) -> Iterator[tuple[Optional[T_ops], list[str]]]:
+        """
+        Yield `(op, operands)` for the canonical forms over `mask` that
+        evaluate to `value` (which can also be `_ANY` or `_NONZERO`), except
+        for those with the operator `exclude` (and, if `splits` are given,
+        only those with the operands over them, see `_matches`).
+
+        `op` is `None` for the single numbers, with `operands` holding just
+        the number.
+        """
+        if isinstance(value, _Wildcard):
+            for real_value in self.values(mask):
+                if real_value or value is _ANY:
+                    yield from self._forms(
+                        mask, real_value, splits, exclude=exclude,
+                    )
+        elif mask & (mask - 1) == 0:
+            if self.count(mask, value):
+                yield None, [str(self.nums[mask.bit_length() - 1])]
+        else:
+            for op, mask1, value1, mask2, value2 in self._matches(
+                mask, value, splits,
+            ):
+                if op == exclude:
+                    continue
+                elif op == "+" or op == "*":
+                    for expr1 in self.expressions(
+                        mask1, value1, exclude=op,
+                    ):
+                        for op2, operands in self._forms(mask2, value2):
+                            if op2 == op:
+                                yield op, [expr1] + operands
+                            else:
+                                yield op, [expr1, _infix(op2, operands)]
+                else:
+                    for expr1 in self.expressions(mask1, value1):
+                        for expr2 in self.expressions(mask2, value2):
+                            yield op, [expr1, expr2]
+
+    def expressions(
+        self,
+        mask: int,
+        value: T_operand,
+        splits: Optional[T_splits] = None,
+        *,
+        exclude: Optional[T_ops] = None,
+    ) -> Iterator[str]:
+        """
+        Yield the canonical forms over `mask` that evaluate to `value` (which
+        can also be `_ANY` or `_NONZERO`), except for those with the operator
+        `exclude` (and, if `splits` are given, only those with the operands
+        over them, see `_matches`), each in parentheses (except for the single
+        numbers).
+        """
+        for op, operands in self._forms(
+            mask, value, splits, exclude=exclude,
+        ):
+            yield _infix(op, operands)
+
+
+class _TracedSearch(_ExpressionSearch):
+    """
+    `_ExpressionSearch` that also keeps a back-pointer for each value in its
+    tables, from which one expression with that value can be rebuilt without
+    searching.
+
+    The back-pointer of the value of `(expr1 op expr2)` is `(code, value1)`,
+    where `code` is `mask1 << 2 | ops.index(op)`, with `mask1` and `value1`
+    the mask and the value of `expr1` (the mask and the value of `expr2`
+    follow from these).
+    """
+
+    def __init__(
+        self, nums: tuple[int, ...], table_size: Optional[int] = None,
+    ) -> None:
+        # Mask -> value -> back-pointer, for the masks in `self.complete`.
+        self.pointers: dict[int, dict[T_value, tuple[int, T_value]]] = dict()
+        super().__init__(nums, table_size)
+
+    def values(self, mask: int) -> dict[T_value, int]:
+        """
+        Return the table of all the values of the expressions over `mask`
+        (value -> the number of expressions with it), and make the
+        back-pointers for them.
+        """
+        if mask in self.complete:
+            return self.counts[mask]
+        result: dict[T_value, int] = dict()
+        pointers = self.pointers[mask] = dict()
+
+        def add(
+            value: T_value, count: int, code: int, value1: T_value,
+        ) -> None:
+            try:
+                result[value] += count
+            except KeyError:
+                result[value] = count
+                pointers[value] = (code, value1)
+
+        for part1, part2 in self.splits(mask):
+            codes1 = [part1 << 2 | index for index in range(len(ops))]
+            codes2 = [part2 << 2 | index for index in range(len(ops))]
+            values2 = self.values(part2)
+            for value1, count1 in self.values(part1).items():
+                for value2, count2 in values2.items():
+                    count = count1 * count2
+                    add(_add(value1, value2), 2 * count, codes1[0], value1)
+                    add(_sub(value1, value2), count, codes1[1], value1)
+                    add(_sub(value2, value1), count, codes2[1], value2)
+                    add(_mul(value1, value2), 2 * count, codes1[3], value1)
+                    if value2:
+                        add(_div(value1, value2), count, codes1[2], value1)
+                    if value1:
+                        add(_div(value2, value1), count, codes2[2], value2)
+        self.counts[mask] = result
+        self.complete.add(mask)
+        self.totals[mask] = sum(result.values())
+        return result
+
+    def expression(self, mask: int, value: T_value) -> Optional[str]:
+        """
+        Return an expression over `mask` that evaluates to `value` (in
+        parentheses, except for the single numbers), or `None` if there are
+        none, rebuilt from the back-pointers.
+        """
+        if value not in self.values(mask):
+            return None
+        elif mask & (mask - 1) == 0:
+            return str(self.nums[mask.bit_length() - 1])
+        code, value1 = self.pointers[mask][value]
+        mask1 = code >> 2
+        mask2 = mask ^ mask1
+        op = ops[code & 3]
+        if op == "+":
+            value2 = _sub(value, value1)
+        elif op == "-":
+            value2 = _sub(value1, value)
+        elif op == "/" and value:
+            value2 = _div(value1, value)
+        elif op == "*" and value1:
+            value2 = _div(value, value1)
+        else:
+            # `0 / x` or `0 * x`, for which any (resp. any non-zero) value of
+            # `x` will do.
+            value2 = next(
+                value2 for value2 in self.values(mask2) if value2 or op == "*"
+            )
+        expr1 = self.expression(mask1, value1)
+        expr2 = self.expression(mask2, value2)
+        return f"({expr1}{op}{expr2})"
+
+
+class ExpressionTable:
+    """
+    The values of all the expressions with (some of) `nums`, for answering
+    many queries about the same numbers without searching again.
+
+    The table holds, for each subset of `nums`, all the values that its
+    expressions can have (with the number of expressions giving each of
+    them, and a back-pointer to rebuild one of them), so it grows quickly
+    with the number of numbers: for six numbers, it takes a few seconds to
+    make and it holds up to a few hundred thousand values (a file of a few
+    megabytes), but for seven of them, it takes over a minute and millions
+    of values (a file of over 100 MB, which takes seconds to load). It can
+    be saved to a file with `save` and loaded back with `load`.
+    """
+
+    # The version of the format of the files written by `save`.
+    _FORMAT = 1
+
+    def __init__(self, nums: tuple[int, ...]) -> None:
+        self._init(_TracedSearch(nums, len(nums)))
+
+    def _init(self, search: _TracedSearch) -> None:
+        """
+        Initialize the table from the complete `search`.
+        """
+        self._search = search
+        # Value -> the number of all the expressions with it.
+        self._reachable: dict[T_value, int] = dict()
+        for mask in range(1, search.full + 1):
+            for value, count in search.values(mask).items():
+                self._reachable[value] = self._reachable.get(value, 0) + count
+        # The reachable values, sorted (lazily, see `nearest`).
+        self._sorted: Optional[list[T_value]] = None
+        self._floats: list[float] = list()
+
+    @property
+    def nums(self) -> tuple[int, ...]:
+        """
+        The numbers of the table.
+        """
+        return self._search.nums
+
+    def __contains__(self, n: int | Fraction) -> bool:
+        """
+        Return `True` if some expression with `nums` evaluates to `n`.
+        """
+        return _value(n) in self._reachable
+
+    def __len__(self) -> int:
+        """
+        Return the number of the reachable values.
+        """
+        return len(self._reachable)
+
+    def count(self, n: int | Fraction) -> int:
+        """
+        Return the number of expressions with `nums` evaluating to `n`.
+        """
+        return self._reachable.get(_value(n), 0)
+
+    def expressions(self, n: int | Fraction) -> Iterator[str]:
+        """
+        Yield all expressions with `nums` evaluating to `n` (in the same order
+        as `iter_expressions`).
+        """
+        search = self._search
+        value = _value(n)
+        if value not in self._reachable:
+            return
+        for mask in range(1, search.full + 1):
+            for expr in search.expressions(mask, value):
+                yield expr[1:-1] if mask & (mask - 1) else expr
+
+    def expression(self, n: int | Fraction) -> Optional[str]:
+        """
+        Return an expression with `nums` evaluating to `n`, or `None` if there
+        are none.
+
+        This uses the fewest numbers possible, and it is rebuilt from the
+        back-pointers, without searching.
+        """
+        search = self._search
+        value = _value(n)
+        if value not in self._reachable:
+            return None
+        for size in range(1, len(search.nums) + 1):
+            for mask in range(1, search.full + 1):
+                if mask.bit_count() == size and value in search.values(mask):
+                    expr = search.expression(mask, value)
+                    if expr is not None and size > 1:
+                        return expr[1:-1]
+                    return expr
+        return None
+
+    def nearest(self, n: int | Fraction) -> int | Fraction:
+        """
+        Return the reachable value nearest to `n` (the smaller one if there
+        are two of them).
+        """
+        if not self._reachable:
+            raise ValueError("no values are reachable without numbers")
+        value = _value(n)
+        if value in self._reachable:
+            return _number(value)
+        if self._sorted is None:
+            # Sorting by `float` is much faster than by `Fraction`, but it
+            # isn't exact, so the candidates found by it are compared
+            # exactly below.
+            self._sorted = sorted(self._reachable, key=self._float)
+            self._floats = [self._float(value) for value in self._sorted]
+        target = _number(value)
+        approx = self._float(value)
+        index = bisect_left(self._floats, approx)
+        distance = min(
+            abs(self._floats[i] - approx)
+            for i in (index - 1, index) if 0 <= i < len(self._floats)
+        )
+        margin = distance + abs(approx) * 1e-9
+        candidates = self._sorted[
+            bisect_left(self._floats, approx - margin):
+            bisect_right(self._floats, approx + margin)
+        ]
+        return min(
+            (_number(value) for value in candidates),
+            key=lambda number: (abs(number - target), number),
+        )
+
+    @staticmethod
+    def _float(value: T_value) -> float:
+        """
+        Return `value` as `float`.
+        """
+        return value if isinstance(value, int) else value[0] / value[1]
+
+    def save(self, path: str) -> None:
+        """
+        Save the table to the file `path`.
+
+        The file is pickled, so it must only be loaded (with `load`) if it
+        comes from a trusted source.
+        """
+        search = self._search
+        data = {
+            "format": self._FORMAT,
+            "nums": search.nums,
+            "counts": [
+                search.counts[mask] for mask in range(1, search.full + 1)
+            ],
+            "pointers": [
+                search.pointers.get(mask, dict())
+                for mask in range(1, search.full + 1)
+            ],
+        }
+        with open(path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "ExpressionTable":
+        """
+        Return the table saved to the file `path` by `save`.
+
+        The file is unpickled, so it must come from a trusted source.
+        """
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if not isinstance(data, dict) or data.get("format") != cls._FORMAT:
+            raise ValueError(f"not an expression table: {path}")
+        search = _TracedSearch(data["nums"], 1)
+        for mask, (counts, pointers) in enumerate(
+            zip(data["counts"], data["pointers"]), start=1,
+        ):
+            search.counts[mask] = counts
+            search.complete.add(mask)
+            search.totals[mask] = sum(counts.values())
+            if pointers:
+                search.pointers[mask] = pointers
+        result = cls.__new__(cls)
+        result._init(search)
+        return result
+
+
+def _infix(op: Optional[T_ops], operands: list[str]) -> str:
+    """
+    Return the infix form of `op` applied to `operands`, in parentheses (or,
+    if `op` is `None`, the only operand).
+    """
+    return operands[0] if op is None else f"({op.join(operands)})"
+
+
+def _new_search(nums: tuple[int, ...], canonical: bool) -> _ExpressionSearch:
+    """
+    Return a new search for the expressions (or, if `canonical` is set, their
+    canonical forms) with `nums`.
+    """
+    return (_CanonicalSearch if canonical else _ExpressionSearch)(nums)
+
+
+# The search of a worker process of `_parallel` (see `_init_worker`).
+_worker_search: Optional[_ExpressionSearch] = None
+
+
+def _init_worker(nums: tuple[int, ...], canonical: bool) -> None:
+    """
+    Initialize a worker process of `_parallel`.
+    """
+    global _worker_search
+    _worker_search = _new_search(nums, canonical)
+
+
+def _get_worker_search() -> _ExpressionSearch:
+    """
+    Return the search of the current worker process of `_parallel`.
+    """
+    if _worker_search is None:
+        raise RuntimeError("not in a worker process of _parallel")
+    return _worker_search
+
+
+def _task_splits(
+    search: _ExpressionSearch, mask: int, index: Optional[int],
+) -> Optional[T_splits]:
+    """
+    Return the splits of `mask` that the task with `index` takes (see
+    `T_task`), or `None` for all of them.
+    """
+    return None if index is None else search.splits(mask)[index:index + 1]
+
+
+def _list_task(task: T_task) -> list[str]:
+    """
+    Return the list of the expressions of `task` (see `T_task`), found in a
+    worker process of `_parallel`.
+    """
+    mask, index, value = task
+    search = _get_worker_search()
+    return [
+        expr[1:-1] if mask & (mask - 1) else expr
+        for expr in search.expressions(
+            mask, value, splits=_task_splits(search, mask, index),
+        )
+    ]
+
+
+def _count_task(task: T_task) -> int:
+    """
+    Return the number of the expressions of `task` (see `T_task`), counted in
+    a worker process of `_parallel`.
+    """
+    mask, index, value = task
+    search = _get_worker_search()
+    splits = _task_splits(search, mask, index)
+    if splits is None:
+        return search.count(mask, value)
+    return search._count_at(mask, value, splits)
+
+
+def _parallel(
+    run: Callable[[T_task], T_result],
+    n: int | Fraction,
+    nums: tuple[int, ...],
+    canonical: bool,
+    processes: int,
+    ordered: bool = True,
+) -> Iterator[T_result]:
+    """
+    Search for the expressions with `nums` evaluating to `n` in `processes`
+    worker processes and yield the results of `run` (`_count_task` or
+    `_list_task`) for each part of the search.
+
+    The search is split by the subsets of `nums` that the expressions use
+    and, for the subsets of two or more numbers, by the way they split them
+    into the operands of the top-level operator (which is why each part
+    takes all the operators, as otherwise the expressions couldn't be put
+    back in the order of the serial search). If `ordered` is set, the
+    results are yielded in the order of the serial search (so, put together,
+    they give exactly the same expressions in the same order), and otherwise
+    as soon as they are found.
+    """
+    value = _value(n)
+    tasks: list[T_task] = [
+        (mask, index, value)
+        for mask in range(1, 1 << len(nums))
+        for index in (
+            range((1 << (mask.bit_count() - 1)) - 1)
+            if mask & (mask - 1) else [None]
+        )
+    ]
+    with Pool(processes, _init_worker, (tuple(nums), canonical)) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(run, tasks)
+
+
+def iter_expressions(
+    n: int | Fraction,
+    nums: tuple[int, ...],
+    canonical: bool = False,
+    processes: int = 1,
+    ordered: bool = True,
+) -> Iterator[str]:
+    """
+    Yield all expressions with `nums` evaluating to `n`.
+
+    If `canonical` is set, only their canonical forms are given (see
+    `_CanonicalSearch`).
+
+    If `processes` is more than one, the search runs in that many processes
+    (see `_parallel`), giving the same expressions, and also in the same
+    order if `ordered` is set.
+    """
+    if processes > 1:
+        for exprs in _parallel(
+            _list_task, n, nums, canonical, processes, ordered,
+        ):
+            yield from exprs
+        return
+    yield from _iter_search(_new_search(nums, canonical), _value(n))
+
+
+def _iter_search(search: _ExpressionSearch, value: T_value) -> Iterator[str]:
+    """
+    Yield all the expressions (over all the subsets of the numbers) that
+    evaluate to `value`, found by `search`.
+    """
+    for mask in range(1, search.full + 1):
+        for expr in search.expressions(mask, value):
+            yield expr[1:-1] if mask & (mask - 1) else expr
+
+
+def count_expressions(
+    n: int | Fraction,
+    nums: tuple[int, ...],
+    canonical: bool = False,
+    processes: int = 1,
+) -> int:
+    """
+    Return the number of expressions with `nums` evaluating to `n` (or, if
+    `canonical` is set, of their canonical forms), counted in `processes`
+    processes.
+    """
+    if processes > 1:
+        return sum(
+            _parallel(_count_task, n, nums, canonical, processes, False),
+        )
+    search = _new_search(nums, canonical)
+    value = _value(n)
+    return sum(search.count(mask, value) for mask in range(1, search.full + 1))
 
 
 def solve(
     n: int,
     nums: tuple[int, ...],
-    expr: Optional[T_postfix] = None,
-    nums_cnt: int = 0,
-    ops_cnt: int = 0,
+    canonical: bool = False,
+    processes: int = 1,
+    ordered: bool = True,
 ) -> int:
     """
     Print all expressions with `nums` evaluating to `n` and return their count.
+
+    If `canonical` is set, only their canonical forms are printed and counted.
+    For `processes` and `ordered`, see `iter_expressions`.
     """
     result = 0
-    if expr is None:
-        expr = tuple()
-    if nums:
-        new_nc = nums_cnt + 1
-        for i, num in enumerate(nums):
-            result += solve(
-                n, nums[:i] + nums[i + 1:], expr + (num,), new_nc, ops_cnt,
-            )
-    new_oc = ops_cnt + 1
-    if nums_cnt > new_oc:
-        for op in ops:
-            result += solve(n, nums, expr + (op,), nums_cnt, new_oc)
-    elif nums_cnt == new_oc:
-        infix, value = postfix(expr)
-        if value == n:
-            print(infix)
-            result += 1
+    for expr in iter_expressions(n, nums, canonical, processes, ordered):
+        print(expr)
+        result += 1
     return result
 
 
+def solve_canonical(
+    n: int,
+    nums: tuple[int, ...],
+    processes: int = 1,
+    ordered: bool = True,
+) -> tuple[int, int]:
+    """
+    Print the canonical forms of all expressions with `nums` evaluating to
+    `n`, and return their count and the number of all the expressions.
+
+    Both numbers come from the same search (see `_CanonicalSearch.kinds`),
+    except when it runs in `processes` processes, where all the expressions
+    are counted separately. For `ordered`, see `iter_expressions`.
+    """
+    if processes > 1:
+        return (
+            solve(n, nums, True, processes, ordered),
+            count_expressions(n, nums, False, processes),
+        )
+    search = _CanonicalSearch(nums)
+    value = _value(n)
+    result = 0
+    for expr in _iter_search(search, value):
+        print(expr)
+        result += 1
+    raw_result = sum(
+        search.raw_count(mask, value) for mask in range(1, search.full + 1)
+    )
+    return result, raw_result
+
+
 if __name__ == "__main__":
-    try:
-        n = int(sys.argv[1])
-        nums = tuple(int(arg) for arg in sys.argv[2:])
-    except (IndexError, ValueError):
-        print("Usage: {sys.args[0]} target num1 num2 ...")
+    parser = argparse.ArgumentParser(
+        description="Print all expressions with the given numbers evaluating"
+        " to the target.",
+    )
+    parser.add_argument("n", type=int, help="the target")
+    parser.add_argument("nums", type=int, nargs="*", help="the numbers")
+    parser.add_argument(
+        "-c", "--canonical", action="store_true",
+        help="print only the canonical forms of the expressions (with the"
+        " operands of + and * ordered, and without their nested parentheses)",
+    )
+    parser.add_argument(
+        "-r", "--raw-count", action="store_true",
+        help="with --canonical, also print the number of all the expressions",
+    )
+    parser.add_argument(
+        "-p", "--procs", type=int, default=1,
+        help="the number of parallel processes to search in",
+    )
+    parser.add_argument(
+        "-u", "--unordered", action="store_true",
+        help="with --procs, print the expressions as soon as they are found,"
+        " instead of in the order of the serial search",
+    )
+    args = parser.parse_args()
+    if args.canonical and args.raw_count:
+        total, raw_total = solve_canonical(
+            args.n, tuple(args.nums), args.procs, not args.unordered,
+        )
+        print(f"Total solutions: {total} (all orderings: {raw_total})")
     else:
-        total = solve(n, nums)
+        total = solve(
+            args.n, tuple(args.nums), args.canonical, args.procs,
+            not args.unordered,
+        )
         print("Total solutions:", total)
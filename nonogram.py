@@ -15,19 +15,48 @@ The input is a list of strings:
   * empty tile: `.`,
   * unknown tile: ` `,
   * occupied tile: `@`.
+
+In batch mode (`--batch`), any number of files, directories or globs can be
+given, and each file can contain any number of puzzles written one after
+another. The results are printed as JSON lines, in the order in which the
+puzzles get solved, followed by a summary.
+
+Big collections of puzzles can be stored in a compact binary format (see
+`iter_puzzles`), made with `--pack`. It is accepted wherever the text format
+is.
 """
 
+import argparse
+import concurrent.futures
+import functools
+import glob
+import heapq
+import io
 import itertools
+import json
+import os
 import re
 import sys
 import time
-from typing import TypeAlias, Sequence, Self
+from typing import (
+    Any, BinaryIO, Callable, ClassVar, Iterable, Iterator, NamedTuple,
+    Protocol, TextIO, TypeAlias, Sequence, Self, cast,
+)
 
 
 T_definition: TypeAlias = Sequence[str]
 T_hints: TypeAlias = Sequence[int]
 T_line: TypeAlias = list[str]
 T_board: TypeAlias = list[T_line]
+T_progress_callback: TypeAlias = Callable[[T_board, dict[str, Any]], Any]
+T_packed_puzzle: TypeAlias = tuple[
+    list[list[int]], list[list[int]], tuple[int, int] | None,
+]
+# A puzzle in batch mode: `(source, index, puzzle)`, with the puzzle as given
+# by `_iter_raw_puzzles`, or the error that stopped reading its source.
+T_batch_item: TypeAlias = tuple[
+    str, int, list[str] | T_packed_puzzle | Exception,
+]
 
 
 class NonogramNoSolutionError(Exception):
@@ -36,15 +65,235 @@ class NonogramNoSolutionError(Exception):
     """
 
 
+class NonogramCancelledError(Exception):
+    """
+    Raised when solving is cancelled by the progress callback.
+    """
+
+
+class _LineContradiction:
+    """
+    The type of `_LINE_CONTRADICTION`.
+    """
+
+
+# Returned by `NonogramSolver._solve_line_engine` for contradictory lines.
+_LINE_CONTRADICTION = _LineContradiction()
+T_line_result: TypeAlias = tuple[int, int] | None | _LineContradiction
+
+
+class _LineTask(NamedTuple):
+    """
+    A line to solve in `NonogramSolver._propagate_parallel`.
+    """
+
+    idx: int
+    width: int
+    occupied: int
+    empty: int
+    hints: tuple[int, ...]
+
+
+class _LineCache(Protocol):
+    """
+    The type of `NonogramSolver._line_cache` (an LRU-cached
+    `NonogramSolver._solve_line_engine`).
+    """
+
+    def __call__(self, *args: Any) -> T_line_result:
+        ...
+
+    def cache_info(self) -> functools._CacheInfo:
+        ...
+
+    def cache_clear(self) -> None:
+        ...
+
+
+class NonogramBitBoard:
+    """
+    Nonogram board stored as bitmasks of occupied and empty tiles.
+
+    Each row and each column is kept as two `int` values: a mask of the tiles
+    known to be occupied and a mask of the tiles known to be empty. Bit `x` of
+    a row's masks describes the tile in column `x`, and bit `y` of a column's
+    masks describes the tile in row `y`. Both orientations are always kept in
+    sync, so that any line can be read in O(1).
+    """
+
+    __slots__ = (
+        "width", "height",
+        "rows_occupied", "rows_empty", "cols_occupied", "cols_empty",
+    )
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.rows_occupied = [0] * height
+        self.rows_empty = [0] * height
+        self.cols_occupied = [0] * width
+        self.cols_empty = [0] * width
+
+    @classmethod
+    def from_board(
+        cls, board: T_board, tile_empty: str, tile_occupied: str,
+    ) -> Self:
+        """
+        Return a new bit board with the same content as `board`.
+
+        All the tiles that are neither `tile_empty` nor `tile_occupied` are
+        considered unknown.
+        """
+        height = len(board)
+        width = len(board[0]) if board else 0
+        result = cls(width, height)
+        for y, line in enumerate(board):
+            occupied = empty = 0
+            for x, tile in enumerate(line):
+                if tile == tile_occupied:
+                    occupied |= 1 << x
+                elif tile == tile_empty:
+                    empty |= 1 << x
+            result.update_row(y, occupied, empty)
+        return result
+
+    def to_board(
+        self, tile_empty: str, tile_unknown: str, tile_occupied: str,
+    ) -> T_board:
+        """
+        Return the board as a list of lists of tiles.
+        """
+        return [
+            [
+                tile_occupied if occupied >> x & 1 else
+                tile_empty if empty >> x & 1 else
+                tile_unknown
+                for x in range(self.width)
+            ]
+            for occupied, empty in zip(self.rows_occupied, self.rows_empty)
+        ]
+
+    def copy(self) -> Self:
+        """
+        Return a copy of the board.
+        """
+        result = type(self).__new__(type(self))
+        result.width = self.width
+        result.height = self.height
+        result.rows_occupied = list(self.rows_occupied)
+        result.rows_empty = list(self.rows_empty)
+        result.cols_occupied = list(self.cols_occupied)
+        result.cols_empty = list(self.cols_empty)
+        return result
+
+    @classmethod
+    def from_masks(
+        cls, width: int, height: int, occupied: int, empty: int,
+    ) -> Self:
+        """
+        Return a new bit board from the whole-board masks (see `to_masks`).
+        """
+        if occupied & empty:
+            raise ValueError("a tile cannot be both occupied and empty")
+        if (occupied | empty) >> (width * height):
+            raise ValueError("the board's masks are bigger than the board")
+        result = cls(width, height)
+        full_row = (1 << width) - 1
+        for y in range(height):
+            shift = y * width
+            result.update_row(
+                y, occupied >> shift & full_row, empty >> shift & full_row,
+            )
+        return result
+
+    def to_masks(self) -> tuple[int, int]:
+        """
+        Return masks of occupied and empty tiles of the whole board.
+
+        Bit `y * width + x` of each mask describes the tile in column `x` and
+        row `y`.
+        """
+        occupied = empty = 0
+        for y in reversed(range(self.height)):
+            occupied = occupied << self.width | self.rows_occupied[y]
+            empty = empty << self.width | self.rows_empty[y]
+        return occupied, empty
+
+    def row(self, idx: int) -> tuple[int, int]:
+        """
+        Return masks of occupied and empty tiles in the row `idx`.
+        """
+        return self.rows_occupied[idx], self.rows_empty[idx]
+
+    def column(self, idx: int) -> tuple[int, int]:
+        """
+        Return masks of occupied and empty tiles in the column `idx`.
+        """
+        return self.cols_occupied[idx], self.cols_empty[idx]
+
+    def update_row(self, idx: int, occupied: int, empty: int) -> int:
+        """
+        Add the known tiles of the row `idx` and return the mask of changes.
+
+        The columns are updated accordingly.
+        """
+        new_occupied = occupied & ~self.rows_occupied[idx]
+        new_empty = empty & ~self.rows_empty[idx]
+        self.rows_occupied[idx] |= occupied
+        self.rows_empty[idx] |= empty
+        self._spread(new_occupied, self.cols_occupied, idx)
+        self._spread(new_empty, self.cols_empty, idx)
+        return new_occupied | new_empty
+
+    def update_column(self, idx: int, occupied: int, empty: int) -> int:
+        """
+        Add the known tiles of the column `idx` and return the mask of changes.
+
+        The rows are updated accordingly.
+        """
+        new_occupied = occupied & ~self.cols_occupied[idx]
+        new_empty = empty & ~self.cols_empty[idx]
+        self.cols_occupied[idx] |= occupied
+        self.cols_empty[idx] |= empty
+        self._spread(new_occupied, self.rows_occupied, idx)
+        self._spread(new_empty, self.rows_empty, idx)
+        return new_occupied | new_empty
+
+    @staticmethod
+    def _spread(mask: int, lines: list[int], bit_idx: int) -> None:
+        """
+        Set bit `bit_idx` in each of the `lines` whose bit is set in `mask`.
+        """
+        bit = 1 << bit_idx
+        while mask:
+            low = mask & -mask
+            lines[low.bit_length() - 1] |= bit
+            mask ^= low
+
+
 class NonogramSolver:
     """
     [Nonogram](https://en.wikipedia.org/wiki/Nonogram) solver.
+
+    The state of the board is kept in `grid` (a `NonogramBitBoard`), while
+    `board` offers the same state as a list of lists of tiles.
     """
 
     TILE_EMPTY = "."
     TILE_UNKNOWN = " "
     TILE_OCCUPIED = "@"
 
+    # The engine used by `_solve_line`: `"dp"` or `"enumerate"`.
+    LINE_SOLVER = "dp"
+    # The size limit of the line solutions cache. Change it with
+    # `set_line_cache_size`.
+    LINE_CACHE_SIZE: int | None = 2 ** 16
+    # Parallel line solving (see `solve`) is used only for the boards with at
+    # least this many tiles, and only in the sweeps with at least this many
+    # lines to solve.
+    PARALLEL_MIN_TILES = 100 * 100
+    PARALLEL_MIN_LINES = 32
+
     def __init__(self, definition: T_definition) -> None:
         try:
             self.width, self.height = self._line2list(definition[0])
@@ -55,9 +304,7 @@ class NonogramSolver:
             )
 
         if len(definition) == self.width + self.height + 1:
-            self.board = [
-                [self.TILE_UNKNOWN] * self.width for _ in range(self.height)
-            ]
+            self.grid = NonogramBitBoard(self.width, self.height)
         elif len(definition) == self.width + 2 * self.height + 1:
             f = self.width + self.height + 1
             t = self.width + 2 * self.height + 1
@@ -75,13 +322,84 @@ class NonogramSolver:
             self._line2list(line)
             for line in definition[self.width + 1:self.width + self.height + 1]
         ]
+        self._init_hints()
+
+    @classmethod
+    def from_hints(
+        cls,
+        vertical: Sequence[T_hints],
+        horizontal: Sequence[T_hints],
+        grid: NonogramBitBoard | None = None,
+    ) -> Self:
+        """
+        Create an instance of `NonogramSolver` from already parsed hints.
+
+        This skips the parsing of the text definition, which is what makes
+        loading big archives in the packed format (see `iter_puzzles`) fast.
+
+        :param vertical: The hints for the columns.
+        :param horizontal: The hints for the rows.
+        :param grid: The starting board (empty if not given).
+        """
+        self = cls.__new__(cls)
+        self.width = len(vertical)
+        self.height = len(horizontal)
+        if grid is None:
+            grid = NonogramBitBoard(self.width, self.height)
+        elif (grid.width, grid.height) != (self.width, self.height):
+            raise ValueError("invalid size of the board")
+        self.grid = grid
+        self.vertical = [list(hints) for hints in vertical]
+        self.horizontal = [list(hints) for hints in horizontal]
+        self._init_hints()
+        return self
+
+    def _init_hints(self) -> None:
+        """
+        Validate the hints and initialise everything that is derived from them.
+        """
         if self._sum_hints(self.vertical) != self._sum_hints(self.horizontal):
             raise ValueError(
                 "the sums of vertical and horizontal hints must match",
             )
 
+        self._line_hints = (
+            tuple(tuple(hints) for hints in self.horizontal),
+            tuple(tuple(hints) for hints in self.vertical),
+        )
+        self._slacks = (
+            [self._get_slack(self.width, hints) for hints in self.horizontal],
+            [self._get_slack(self.height, hints) for hints in self.vertical],
+        )
         self.iterations = 0
         self.time = 0.0
+        self.solutions: list[T_board] = list()
+        self.stats = self._new_stats()
+        self._profile = False
+        self._on_progress: T_progress_callback | None = None
+        self._progress_interval = 0
+        self._next_progress = 0
+
+    @property
+    def board(self) -> T_board:
+        """
+        The board as a list of lists of tiles.
+
+        *Note:* This is a fresh copy, so changing it doesn't change the board.
+        Assign a whole new board instead.
+        """
+        return self.grid.to_board(
+            self.TILE_EMPTY, self.TILE_UNKNOWN, self.TILE_OCCUPIED,
+        )
+
+    @board.setter
+    def board(self, board: T_board) -> None:
+        grid = NonogramBitBoard.from_board(
+            board, self.TILE_EMPTY, self.TILE_OCCUPIED,
+        )
+        if (grid.width, grid.height) != (self.width, self.height):
+            raise ValueError("invalid size of the board")
+        self.grid = grid
 
     @staticmethod
     def _line2list(line: str) -> list[int]:
@@ -101,10 +419,56 @@ class NonogramSolver:
     def from_file(cls, fname: str) -> Self:
         """
         Create an instance of `NonogramSolver` and populate it from a file.
+
+        Files in the packed format (see `iter_puzzles`) are also accepted, in
+        which case the first puzzle in the file is used.
         """
+        with open(fname, "rb") as f:
+            if f.read(len(PACKED_MAGIC)) == PACKED_MAGIC:
+                reader = _PackedReader(f)
+                if reader.at_eof():
+                    raise ValueError(f"no puzzles in {fname!r}")
+                return cls._from_packed(reader.read_puzzle())
         with open(fname) as f:
             return cls(list(f))
 
+    @classmethod
+    def _from_packed(cls, puzzle: T_packed_puzzle) -> Self:
+        """
+        Create an instance from a puzzle read by `_PackedReader.read_puzzle`.
+        """
+        vertical, horizontal, masks = puzzle
+        grid = None
+        if masks is not None:
+            grid = NonogramBitBoard.from_masks(
+                len(vertical), len(horizontal), *masks,
+            )
+        return cls.from_hints(vertical, horizontal, grid)
+
+    def to_packed(self) -> bytes:
+        """
+        Return the puzzle (hints and the current board) in the packed format.
+
+        The board is left out if none of its tiles are known. See
+        `iter_puzzles` for the description of the format.
+        """
+        result = bytearray()
+        _write_varint(result, self.width)
+        _write_varint(result, self.height)
+        for hints in itertools.chain(self.vertical, self.horizontal):
+            _write_varint(result, len(hints))
+            for hint in hints:
+                _write_varint(result, hint)
+        occupied, empty = self.grid.to_masks()
+        if occupied or empty:
+            size = (self.width * self.height + 7) // 8
+            result.append(1)
+            result += occupied.to_bytes(size, "little")
+            result += empty.to_bytes(size, "little")
+        else:
+            result.append(0)
+        return bytes(result)
+
     def _get_board(self, lines: T_definition) -> T_board:
         """
         Return a board (a list of lists of tiles) from given list of strings.
@@ -157,23 +521,171 @@ class NonogramSolver:
                 is_occupied = False
         return result
 
+    @staticmethod
+    def _mask2hint(occupied: int) -> list[int]:
+        """
+        Return the hints of a line, given as a mask of occupied tiles.
+        """
+        result: list[int] = list()
+        while occupied:
+            occupied >>= (occupied & -occupied).bit_length() - 1
+            block = (~occupied & (occupied + 1)).bit_length() - 1
+            result.append(block)
+            occupied >>= block
+        return result
+
+    @classmethod
+    def _mask2line(cls, width: int, occupied: int, empty: int) -> T_line:
+        """
+        Return a line as a list of tiles from its masks.
+        """
+        return [
+            cls.TILE_OCCUPIED if occupied >> idx & 1 else
+            cls.TILE_EMPTY if empty >> idx & 1 else
+            cls.TILE_UNKNOWN
+            for idx in range(width)
+        ]
+
+    @classmethod
+    def _line2mask(cls, line: Sequence[str]) -> tuple[int, int]:
+        """
+        Return masks of occupied and empty tiles in `line`.
+        """
+        occupied = empty = 0
+        for idx, tile in enumerate(line):
+            if tile == cls.TILE_OCCUPIED:
+                occupied |= 1 << idx
+            elif tile == cls.TILE_EMPTY:
+                empty |= 1 << idx
+        return occupied, empty
+
     @classmethod
     def _solve_line(cls, line: T_line, hints: T_hints) -> list[str] | None:
         """
         Solve one line as much as possible.
 
-        The algorithm tries all possible solution candidates that conform with
-        `hints`. Those tiles that get the same value (empty or occupied) for
-        all of the solution candidates are considered a part of the solution.
-        The `line` is then updated with these elements.
+        This is the list-of-tiles version of `_solve_line_bits`. If no new
+        elements are found, the method returns `None`. If the line cannot be
+        solved at all, `NonogramNoSolutionError` is raised.
+        """
+        occupied, empty = cls._line2mask(line)
+        line_try = cls._solve_line_bits(len(line), occupied, empty, hints)
+        if line_try is None:
+            return None
+        return cls._mask2line(len(line), *line_try)
+
+    @classmethod
+    def _solve_line_bits(
+        cls, width: int, occupied: int, empty: int, hints: T_hints,
+    ) -> tuple[int, int] | None:
+        """
+        Solve one line, given as masks of occupied and empty tiles.
+
+        Those tiles that get the same value (empty or occupied) in all of the
+        solution candidates that conform with `hints` are considered a part of
+        the solution. The method returns the new masks of occupied and empty
+        tiles.
+
+        The actual work is done by the engine selected with `LINE_SOLVER`:
+        `"dp"` (the default) or `"enumerate"` (a slow reference
+        implementation). Both produce exactly the same results (zero hints are
+        ignored by both of them, see `_solve_line_engine`).
+
+        The results are kept in a class-level LRU cache shared by all the
+        instances (see `set_line_cache_size`).
 
-        If no new elements are found, the method returns `None`.
+        If no new elements are found, the method returns `None`. If the line
+        cannot be solved at all, `NonogramNoSolutionError` is raised.
+        """
+        if sum(hints) == occupied.bit_count():
+            return None
+        result = NonogramSolver._line_cache(
+            cls, cls.LINE_SOLVER, width, occupied, empty, tuple(hints),
+        )
+        if isinstance(result, _LineContradiction):
+            raise NonogramNoSolutionError("the line contradicts its hints")
+        return result
+
+    @staticmethod
+    def _solve_line_engine(
+        solver_cls: type["NonogramSolver"],
+        engine: str,
+        width: int,
+        occupied: int,
+        empty: int,
+        hints: tuple[int, ...],
+    ) -> T_line_result:
+        """
+        Solve one line with `engine`, bypassing the cache.
+
+        Contradictions are returned as `_LINE_CONTRADICTION` instead of being
+        raised, so that they can be cached as well.
+
+        Zero hints (like the `0` of an empty line) are dropped here, so that
+        all the engines get the same, normalised hints.
+        """
+        hints = tuple(hint for hint in hints if hint)
+        try:
+            if engine == "enumerate":
+                line = solver_cls._mask2line(width, occupied, empty)
+                line_try = solver_cls._solve_line_enumerate(line, hints)
+                if line_try is None:
+                    return None
+                return solver_cls._line2mask(line_try)
+            elif engine == "dp":
+                return solver_cls._solve_line_dp(width, occupied, empty, hints)
+            else:
+                raise ValueError(f"unknown line solver: {engine!r}")
+        except NonogramNoSolutionError:
+            return _LINE_CONTRADICTION
+
+    # The line solutions cache, shared by all the instances. It is replaced
+    # by `set_line_cache_size`.
+    _line_cache: ClassVar[_LineCache] = functools.lru_cache(
+        maxsize=LINE_CACHE_SIZE,
+    )(_solve_line_engine)
+
+    @classmethod
+    def set_line_cache_size(cls, maxsize: int | None) -> None:
+        """
+        Set the size limit of the line solutions cache and clear the cache.
+
+        :param maxsize: The maximum number of the cached line solutions. Use
+            `0` to disable the cache and `None` for no limit.
+        """
+        NonogramSolver.LINE_CACHE_SIZE = maxsize
+        NonogramSolver._line_cache = functools.lru_cache(maxsize=maxsize)(
+            NonogramSolver._solve_line_engine,
+        )
+
+    @classmethod
+    def line_cache_info(cls) -> functools._CacheInfo:
+        """
+        Return hits, misses, size limit and current size of the line cache.
+        """
+        return NonogramSolver._line_cache.cache_info()
+
+    @classmethod
+    def line_cache_clear(cls) -> None:
+        """
+        Clear the line solutions cache and its statistics.
+        """
+        NonogramSolver._line_cache.cache_clear()
+
+    @classmethod
+    def _solve_line_enumerate(
+        cls, line: T_line, hints: T_hints,
+    ) -> list[str] | None:
+        """
+        Solve one line by trying all possible solution candidates.
+
+        This costs `2 ** k` for `k` unknown tiles, so it is only usable for
+        small boards. It is kept as a reference implementation.
         """
         line_try = list(line)
         occupied_cnt = sum(1 for tile in line if tile == cls.TILE_OCCUPIED)
+        hints = list(hints)
         hints_cnt = sum(hints)
-        if hints_cnt == occupied_cnt:
-            return None
         tries = {
             idx: (cls.TILE_EMPTY, cls.TILE_OCCUPIED)
             for idx, tile in enumerate(line)
@@ -195,7 +707,7 @@ class NonogramSolver:
                         for i_tile, t_tile in zip(intersection, one_try)
                     )
         if intersection is None:
-            return None
+            raise NonogramNoSolutionError("the line contradicts its hints")
         if all(tile == cls.TILE_UNKNOWN for tile in intersection):
             return None
         else:
@@ -204,7 +716,125 @@ class NonogramSolver:
             return line_try
 
     @classmethod
-    def _line_is_solved(cls, line: T_line, hints: T_hints) -> bool:
+    def _solve_line_dp(
+        cls, width: int, occupied: int, empty: int, hints: T_hints,
+    ) -> tuple[int, int] | None:
+        """
+        Solve one line using dynamic programming over (position, block).
+
+        `fwd[j][i]` tells if the first `i` tiles can hold exactly the first `j`
+        blocks, each of them followed by an empty tile, and `bwd[j][i]` tells
+        the same for the tiles from `i` onwards and the blocks from `j`
+        onwards. To avoid special-casing the last block, the line is extended
+        by one empty tile. A tile can then be empty (or occupied) if some
+        placement on its left and some placement on its right agree with it.
+
+        Since the `j`-th block can only start between its leftmost and its
+        rightmost possible position, the cost is `O(len(hints) * slack)`,
+        which is at most `O(width * len(hints))`.
+
+        `hints` must not contain zeros (see `_solve_line_engine`).
+        """
+        blocks = list(hints)
+        size = width + 1
+        blocks_cnt = len(blocks)
+        can_be_empty = [not occupied >> idx & 1 for idx in range(size)]
+        # runs[i] is the number of consecutive tiles starting with the i-th
+        # one that are not known to be empty, so that a block of length `b`
+        # fits at `i` iff `runs[i] >= b and can_be_empty[i + b]`.
+        runs = [0] * (size + 1)
+        for idx in range(width - 1, -1, -1):
+            if not empty >> idx & 1:
+                runs[idx] = runs[idx + 1] + 1
+        # The state `(j, i)` makes sense only for `lo[j] <= i <= hi[j]`.
+        lo = [0] * (blocks_cnt + 1)
+        for j, block in enumerate(blocks):
+            lo[j + 1] = lo[j] + block + 1
+        slack = size - lo[blocks_cnt]
+        if slack < 0:
+            raise NonogramNoSolutionError(
+                "the line is too short for its hints",
+            )
+        hi = [start + slack for start in lo]
+
+        fwd = [[False] * (size + 1) for _ in range(blocks_cnt + 1)]
+        for j in range(blocks_cnt + 1):
+            fwd_j = fwd[j]
+            if j:
+                fwd_prev = fwd[j - 1]
+                block = blocks[j - 1]
+            for i in range(lo[j], hi[j] + 1):
+                if i and fwd_j[i - 1] and can_be_empty[i - 1]:
+                    fwd_j[i] = True
+                elif j:
+                    start = i - block - 1
+                    fwd_j[i] = (
+                        fwd_prev[start]
+                        and runs[start] >= block
+                        and can_be_empty[start + block]
+                    )
+                else:
+                    fwd_j[i] = not i
+        if not fwd[blocks_cnt][size]:
+            raise NonogramNoSolutionError("the line contradicts its hints")
+
+        bwd = [[False] * (size + 1) for _ in range(blocks_cnt + 1)]
+        for j in range(blocks_cnt, -1, -1):
+            bwd_j = bwd[j]
+            if j < blocks_cnt:
+                bwd_next = bwd[j + 1]
+                block = blocks[j]
+            for i in range(hi[j], lo[j] - 1, -1):
+                if i < size and can_be_empty[i] and bwd_j[i + 1]:
+                    bwd_j[i] = True
+                elif j < blocks_cnt:
+                    bwd_j[i] = (
+                        runs[i] >= block
+                        and can_be_empty[i + block]
+                        and bwd_next[i + block + 1]
+                    )
+                else:
+                    bwd_j[i] = i == size
+
+        empty_ok = [False] * size
+        # Mark the tiles covered by any valid block placement, using a
+        # difference array to keep it linear in the number of placements.
+        # The empty tile following such a block is a valid empty tile too.
+        covered = [0] * (size + 1)
+        for j in range(blocks_cnt + 1):
+            fwd_j = fwd[j]
+            bwd_j = bwd[j]
+            for i in range(lo[j], min(hi[j], width - 1) + 1):
+                if fwd_j[i] and can_be_empty[i] and bwd_j[i + 1]:
+                    empty_ok[i] = True
+            if j == blocks_cnt:
+                continue
+            block = blocks[j]
+            bwd_next = bwd[j + 1]
+            for start in range(lo[j], hi[j] + 1):
+                if (
+                    fwd_j[start]
+                    and runs[start] >= block
+                    and can_be_empty[start + block]
+                    and bwd_next[start + block + 1]
+                ):
+                    covered[start] += 1
+                    covered[start + block] -= 1
+                    empty_ok[start + block] = True
+
+        new_occupied = occupied
+        new_empty = empty
+        for idx, cnt in enumerate(itertools.accumulate(covered[:width])):
+            if not cnt:
+                new_empty |= 1 << idx
+            elif not empty_ok[idx]:
+                new_occupied |= 1 << idx
+        if new_occupied == occupied and new_empty == empty:
+            return None
+        return new_occupied, new_empty
+
+    @staticmethod
+    def _line_is_solved(occupied: int, hints: T_hints) -> bool:
         """
         Return `True` if the line's number of occupied tiles matches `hints`.
 
@@ -213,114 +843,1081 @@ class NonogramSolver:
         is simplicity because it is used on (semi-)solved lines which are
         already guaranteed not to contradict `hints`.
         """
-        total_occupied = sum(1 for tile in line if tile == cls.TILE_OCCUPIED)
-        return total_occupied == sum(hints)
+        return occupied.bit_count() == sum(hints)
+
+    @staticmethod
+    def _fill_done_line(width: int, occupied: int) -> int:
+        """
+        Return the mask of empty tiles for a finished line.
+
+        All of the tiles that are not occupied are considered empty.
+        """
+        return ((1 << width) - 1) & ~occupied
 
     @classmethod
-    def _fill_done_line(cls, line: T_line) -> None:
+    def _check_line(cls, occupied: int, hints: T_hints) -> None:
         """
-        Replace all of the unknown tiles in the line with empty ones.
+        Raise `NonogramNoSolutionError` if `occupied` doesn't match `hints`.
+
+        This is used for lines that are full or that have all of their
+        occupied tiles, because those can have only one arrangement.
         """
-        line[:] = [
-            cls.TILE_EMPTY if tile == cls.TILE_UNKNOWN else tile
-            for tile in line
-        ]
+        if cls._mask2hint(occupied) != [hint for hint in hints if hint]:
+            raise NonogramNoSolutionError("the line contradicts its hints")
+
+    @staticmethod
+    def _get_slack(width: int, hints: T_hints) -> int:
+        """
+        Return by how many tiles the blocks of a line can move.
+        """
+        blocks = [hint for hint in hints if hint]
+        if not blocks:
+            return 0
+        return width - sum(blocks) - len(blocks) + 1
 
-    def _try_horizontal_lines(self, board: T_board, done_h: set[int]) -> bool:
+    @staticmethod
+    def _new_stats() -> dict[str, Any]:
         """
-        Try solving all horizontal lines (each of them once).
+        Return empty statistics (see `solve`).
         """
-        result = False
-        for idx, (line, hints) in enumerate(zip(board, self.horizontal)):
-            if idx in done_h:
-                continue
-            line_try = self._solve_line(line, hints)
-            if line_try is not None:
-                line[:] = line_try
-                result = True
-                if self._line_is_solved(line, hints):
-                    self._fill_done_line(line)
-                    done_h.add(idx)
-        return result
+        return {
+            "line_solves": 0,
+            "row_solves": list(),
+            "column_solves": list(),
+            "phases": {
+                "line_solve": 0.0,
+                "check": 0.0,
+                "update": 0.0,
+                "probe": 0.0,
+                "branch": 0.0,
+            },
+        }
 
-    def _fill_finished_vertical_lines(
-        self, board: T_board, done_v: set[int],
-    ) -> None:
+    def _solve_line_instrumented(
+        self,
+        grid: NonogramBitBoard,
+        orientation: int,
+        idx: int,
+        width: int,
+        occupied: int,
+        empty: int,
+        hints: T_hints,
+    ) -> tuple[int, int] | None:
         """
-        Replace unknown tiles with empty ones in all finished vertical lines.
+        Call `_solve_line_bits`, recording the statistics and the progress.
         """
-        for idx, hints in enumerate(self.vertical):
-            if idx in done_v:
-                continue
-            column = [line[idx] for line in board]
-            if self._line_is_solved(column, hints):
-                self._fill_done_line(column)
-                for line, c_tile in zip(board, column):
-                    line[idx] = c_tile
-                done_v.add(idx)
+        if self._profile:
+            stats = self.stats
+            stats[("row_solves", "column_solves")[orientation]][idx] += 1
+            start_time = time.perf_counter()
+            try:
+                line_try = self._solve_line_bits(width, occupied, empty, hints)
+            finally:
+                stats["phases"]["line_solve"] += (
+                    time.perf_counter() - start_time
+                )
+        else:
+            line_try = self._solve_line_bits(width, occupied, empty, hints)
+        self._count_solves(grid)
+        return line_try
+
+    def _count_solves(self, grid: NonogramBitBoard) -> None:
+        """
+        Update the number of line solves in the statistics and report progress.
 
-    def _try_vertical_lines(self, board: T_board, done_v: set[int]) -> bool:
+        If the progress callback returns `False`, `NonogramCancelledError` is
+        raised.
         """
-        Try solving all vertical lines (each of them once).
+        stats = self.stats
+        stats["line_solves"] = self.iterations
+        if (
+            self._on_progress is not None
+            and stats["line_solves"] >= self._next_progress
+        ):
+            self._next_progress = (
+                stats["line_solves"] + self._progress_interval
+            )
+            board = grid.to_board(
+                self.TILE_EMPTY, self.TILE_UNKNOWN, self.TILE_OCCUPIED,
+            )
+            if self._on_progress(board, stats) is False:
+                raise NonogramCancelledError(
+                    "solving was cancelled by the progress callback",
+                )
+
+    def _propagate(
+        self,
+        grid: NonogramBitBoard,
+        rows: Iterable[int],
+        columns: Iterable[int],
+    ) -> None:
+        """
+        Solve the lines of `grid` as much as possible.
+
+        The given `rows` and `columns` are queued first. After that, whenever
+        a line gets new tiles, the lines crossing it in those tiles are queued
+        again, so that no line is solved again unless something has changed in
+        it. The queue is ordered by a cheap estimate of how likely a line is
+        to yield something new: its slack (the lower, the better) minus the
+        number of tiles that changed in it since it was queued.
+
+        The line solves are counted in `iterations`. If a contradiction is
+        found, `NonogramNoSolutionError` is raised and `grid` is left in a
+        partially updated state.
         """
-        result = False
-        for idx, hints in enumerate(self.vertical):
-            if idx in done_v:
+        hints_all = self._line_hints
+        widths = (self.width, self.height)
+        slacks = self._slacks
+        profile = self._profile
+        instrumented = profile or self._on_progress is not None
+        phases = self.stats["phases"]
+        occupied_all = (grid.rows_occupied, grid.cols_occupied)
+        empty_all = (grid.rows_empty, grid.cols_empty)
+        updates = (grid.update_row, grid.update_column)
+        # Orientation (0 for rows, 1 for columns) -> line index -> the number
+        # of changes since the line was queued.
+        pending: tuple[dict[int, int], dict[int, int]] = (dict(), dict())
+        # The same, but for the last time the line was pushed to the queue. A
+        # queue entry is valid only if its count matches the one here.
+        pushed: tuple[dict[int, int], dict[int, int]] = (dict(), dict())
+        queue: list[tuple[int, int, int, int]] = list()
+
+        def push(orientation: int, idx: int, changes: int) -> None:
+            cnt = pending[orientation].get(idx, 0) + changes
+            pending[orientation][idx] = cnt
+            # Re-prioritising on every change would make the queue itself the
+            # bottleneck, so it is only done when the count reaches a power of
+            # two.
+            if not cnt & (cnt - 1):
+                pushed[orientation][idx] = cnt
+                heapq.heappush(
+                    queue,
+                    (slacks[orientation][idx] - cnt, orientation, idx, cnt),
+                )
+
+        for orientation, indices in enumerate((rows, columns)):
+            for idx in indices:
+                push(orientation, idx, 0)
+
+        while queue:
+            _, orientation, idx, cnt = heapq.heappop(queue)
+            if pushed[orientation].get(idx) != cnt:
                 continue
-            column = [line[idx] for line in board]
-            line_try = self._solve_line(column, hints)
-            if line_try is not None:
-                if self._line_is_solved(line_try, hints):
-                    self._fill_done_line(line_try)
-                    done_v.add(idx)
-                for line, lt_tile in zip(board, line_try):
-                    line[idx] = lt_tile
-                result = True
-        return result
+            del pending[orientation][idx]
+            del pushed[orientation][idx]
+            width = widths[orientation]
+            occupied = occupied_all[orientation][idx]
+            empty = empty_all[orientation][idx]
+            hints = hints_all[orientation][idx]
+            is_full = occupied | empty == (1 << width) - 1
+            if is_full or self._line_is_solved(occupied, hints):
+                if profile:
+                    start_time = time.perf_counter()
+                self._check_line(occupied, hints)
+                if profile:
+                    phases["check"] += time.perf_counter() - start_time
+                if is_full:
+                    continue
+            else:
+                self.iterations += 1
+                if instrumented:
+                    line_try = self._solve_line_instrumented(
+                        grid, orientation, idx, width, occupied, empty, hints,
+                    )
+                else:
+                    line_try = self._solve_line_bits(
+                        width, occupied, empty, hints,
+                    )
+                if line_try is None:
+                    continue
+                occupied, empty = line_try
+            if profile:
+                start_time = time.perf_counter()
+            if self._line_is_solved(occupied, hints):
+                empty = self._fill_done_line(width, occupied)
+            changed = updates[orientation](idx, occupied, empty)
+            while changed:
+                low = changed & -changed
+                push(1 - orientation, low.bit_length() - 1, 1)
+                changed ^= low
+            if profile:
+                phases["update"] += time.perf_counter() - start_time
 
-    def _fill_finished_horizontal_lines(
-        self, board: T_board, done_h: set[int],
+    def _propagate_parallel(
+        self,
+        grid: NonogramBitBoard,
+        rows: Iterable[int],
+        columns: Iterable[int],
+        executor: concurrent.futures.Executor,
+        workers: int,
     ) -> None:
         """
-        Replace unknown tiles with empty ones in all finished horizontal lines.
+        Solve the lines of `grid` as much as possible, using `executor`.
+
+        This works like `_propagate`, but instead of taking the lines one by
+        one, it takes all the queued rows at once, then all the queued
+        columns, and so on. The lines in such a sweep are independent, so they
+        are solved by `executor`'s workers, and the results are applied in the
+        order of the lines' indices. Sweeps with fewer than
+        `PARALLEL_MIN_LINES` lines to solve are solved in this process.
+
+        Line solving always ends in the same fixed point, so the final grid is
+        the same as the one from `_propagate`.
+
+        The line solves are counted in `iterations`.
         """
-        for idx, (line, hints) in enumerate(zip(board, self.horizontal)):
-            if self._line_is_solved(line, hints):
-                self._fill_done_line(line)
-                done_h.add(idx)
+        hints_all = self._line_hints
+        widths = (self.width, self.height)
+        occupied_all = (grid.rows_occupied, grid.cols_occupied)
+        empty_all = (grid.rows_empty, grid.cols_empty)
+        updates = (grid.update_row, grid.update_column)
+        dirty: tuple[set[int], set[int]] = (set(rows), set(columns))
+        orientation = 0 if dirty[0] else 1
+        while dirty[0] or dirty[1]:
+            if not dirty[orientation]:
+                orientation = 1 - orientation
+            width = widths[orientation]
+            line_tries: dict[int, tuple[int, int] | None] = dict()
+            tasks: list[_LineTask] = list()
+            for idx in sorted(dirty[orientation]):
+                occupied = occupied_all[orientation][idx]
+                empty = empty_all[orientation][idx]
+                hints = hints_all[orientation][idx]
+                is_full = occupied | empty == (1 << width) - 1
+                if is_full or self._line_is_solved(occupied, hints):
+                    self._check_line(occupied, hints)
+                    if not is_full:
+                        line_tries[idx] = (occupied, empty)
+                else:
+                    tasks.append(
+                        _LineTask(idx, width, occupied, empty, hints),
+                    )
+            dirty[orientation].clear()
+
+            self.iterations += len(tasks)
+            if self._profile:
+                start_time = time.perf_counter()
+            if len(tasks) < self.PARALLEL_MIN_LINES:
+                for task in tasks:
+                    line_tries[task.idx] = self._solve_line_bits(
+                        task.width, task.occupied, task.empty, task.hints,
+                    )
+            else:
+                chunksize = -(-len(tasks) // (4 * workers))
+                chunks = [
+                    tasks[start:start + chunksize]
+                    for start in range(0, len(tasks), chunksize)
+                ]
+                results = executor.map(
+                    _solve_lines_chunk,
+                    itertools.repeat(type(self)),
+                    itertools.repeat(self.LINE_SOLVER),
+                    chunks,
+                )
+                for chunk, chunk_results in zip(chunks, results):
+                    for task, line_try in zip(chunk, chunk_results):
+                        if isinstance(line_try, _LineContradiction):
+                            raise NonogramNoSolutionError(
+                                "the line contradicts its hints",
+                            )
+                        line_tries[task.idx] = line_try
+            if self._profile:
+                phases = self.stats["phases"]
+                phases["line_solve"] += time.perf_counter() - start_time
+                line_solves = self.stats[
+                    ("row_solves", "column_solves")[orientation]
+                ]
+                for task in tasks:
+                    line_solves[task.idx] += 1
+
+            for idx, line_try in sorted(line_tries.items()):
+                if line_try is None:
+                    continue
+                occupied, empty = line_try
+                hints = hints_all[orientation][idx]
+                if self._line_is_solved(occupied, hints):
+                    empty = self._fill_done_line(width, occupied)
+                changed = updates[orientation](idx, occupied, empty)
+                while changed:
+                    low = changed & -changed
+                    dirty[1 - orientation].add(low.bit_length() - 1)
+                    changed ^= low
+            if self._profile or self._on_progress is not None:
+                self._count_solves(grid)
+            orientation = 1 - orientation
 
-    def solve(self) -> None:
+    def _probe(self, grid: NonogramBitBoard) -> NonogramBitBoard:
+        """
+        Solve `grid` as much as possible by probing its unknown tiles.
+
+        Each unknown tile is tried both as occupied and as empty, and each of
+        these choices is propagated. If one of them leads to a contradiction,
+        the tile must have the other value. If both of them succeed, all the
+        tiles that got the same value in both cases are known as well.
+
+        Return the new grid. If both choices fail for some tile,
+        `NonogramNoSolutionError` is raised.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for y in range(self.height):
+                for x in range(self.width):
+                    occupied, empty = grid.row(y)
+                    if (occupied | empty) >> x & 1:
+                        continue
+                    tries: list[NonogramBitBoard] = list()
+                    for tile_occupied, tile_empty in (
+                        (1 << x, 0), (0, 1 << x),
+                    ):
+                        grid_try = grid.copy()
+                        grid_try.update_row(y, tile_occupied, tile_empty)
+                        try:
+                            self._propagate(grid_try, [y], [x])
+                        except NonogramNoSolutionError:
+                            pass
+                        else:
+                            tries.append(grid_try)
+                    if not tries:
+                        raise NonogramNoSolutionError(
+                            f"tile ({x}, {y}) can be neither occupied nor"
+                            " empty",
+                        )
+                    elif len(tries) == 1:
+                        grid = tries[0]
+                        changed = True
+                    else:
+                        grid_o, grid_e = tries
+                        rows = [
+                            idx
+                            for idx in range(self.height)
+                            if grid.update_row(
+                                idx,
+                                grid_o.rows_occupied[idx]
+                                & grid_e.rows_occupied[idx],
+                                grid_o.rows_empty[idx]
+                                & grid_e.rows_empty[idx],
+                            )
+                        ]
+                        if rows:
+                            self._propagate(grid, rows, range(self.width))
+                            changed = True
+        return grid
+
+    @staticmethod
+    def _pick_tile(grid: NonogramBitBoard) -> tuple[int, int] | None:
+        """
+        Return the unknown tile to branch on, or `None` if there is none.
+
+        The tile is taken from the row with the fewest unknown tiles.
+        """
+        full = (1 << grid.width) - 1
+        best: tuple[int, int] | None = None
+        best_cnt = grid.width + 1
+        for y, (occupied, empty) in enumerate(
+            zip(grid.rows_occupied, grid.rows_empty),
+        ):
+            unknown = full & ~(occupied | empty)
+            cnt = unknown.bit_count()
+            if unknown and cnt < best_cnt:
+                best = ((unknown & -unknown).bit_length() - 1, y)
+                best_cnt = cnt
+        return best
+
+    def _search(
+        self, grid: NonogramBitBoard, max_solutions: int,
+    ) -> list[NonogramBitBoard]:
+        """
+        Return up to `max_solutions` solutions found by depth-first search.
+
+        Every node of the search is first solved as much as possible by
+        probing. Then one unknown tile is picked and both of its values are
+        tried, unless they immediately lead to a contradiction.
+
+        Return the list of solutions.
+        """
+        solutions: list[NonogramBitBoard] = list()
+        stack = [grid]
+        while stack and len(solutions) < max_solutions:
+            grid = stack.pop()
+            if self._profile:
+                start_time = time.perf_counter()
+            try:
+                grid = self._probe(grid)
+            except NonogramNoSolutionError:
+                continue
+            finally:
+                if self._profile:
+                    self.stats["phases"]["probe"] += (
+                        time.perf_counter() - start_time
+                    )
+            tile = self._pick_tile(grid)
+            if tile is None:
+                solutions.append(grid)
+                continue
+            if self._profile:
+                start_time = time.perf_counter()
+            x, y = tile
+            children: list[NonogramBitBoard] = list()
+            for tile_occupied, tile_empty in ((1 << x, 0), (0, 1 << x)):
+                child = grid.copy()
+                child.update_row(y, tile_occupied, tile_empty)
+                try:
+                    self._propagate(child, [y], [x])
+                except NonogramNoSolutionError:
+                    pass
+                else:
+                    children.append(child)
+            # Try the occupied tile first.
+            stack.extend(reversed(children))
+            if self._profile:
+                self.stats["phases"]["branch"] += (
+                    time.perf_counter() - start_time
+                )
+        return solutions
+
+    def solve(
+        self,
+        search: bool = False,
+        max_solutions: int = 1,
+        workers: int | None = 0,
+        profile: bool = False,
+        on_progress: T_progress_callback | None = None,
+        progress_interval: int = 1000,
+    ) -> None:
         """
         Solve the current board as much as possible.
+
+        :param search: If `False` (the default), only line logic is used,
+            which may leave some tiles unknown. If `True`, probing and
+            depth-first search are used as well, so the board gets completely
+            solved and all the solutions found are stored in `solutions`, with
+            the first one also put to the board.
+        :param max_solutions: The maximum number of solutions to look for in
+            search mode. Use `2` to check if the solution is unique.
+        :param workers: The number of worker processes used to solve the
+            lines of the initial line logic in parallel. `0` (the default)
+            means no parallelism and `None` means one process per CPU. Boards
+            with fewer than `PARALLEL_MIN_TILES` tiles are always solved
+            serially, because there the overhead would dominate.
+        :param profile: If `True`, the time spent in each phase of solving and
+            the number of solves of each line are collected in `stats`.
+        :param on_progress: A function called as `on_progress(board, stats)`
+            after every `progress_interval` line solves, with the current
+            state of the board being solved (in search mode, that is the
+            current search node). If it returns `False`, solving stops with
+            `NonogramCancelledError`.
+        :param progress_interval: See `on_progress`.
+
+        The statistics in `stats` are a dictionary with these items:
+        * `line_solves`: the total number of line solves so far (the same as
+          `iterations` after solving),
+        * `row_solves` and `column_solves`: the number of solves of each line,
+        * `phases`: the cumulative times of solving lines (`line_solve`),
+          checking finished lines (`check`), and applying the new tiles to the
+          board (`update`), plus the total times of probing (`probe`) and of
+          branching (`branch`) in search mode, which include the time of the
+          previous phases that happen within them.
+        If neither profiling nor `on_progress` is used, this costs nothing.
+
+        After this, `iterations` holds the number of line solves performed.
+        If the puzzle has no solution, `NonogramNoSolutionError` is raised.
         """
-        board = self.board
-        done_h: set[int] = set()
-        done_v: set[int] = set()
         start_time = time.time()
-        for iteration in range(self.width * self.height):
-            got_something_horz = self._try_horizontal_lines(board, done_h)
-            if got_something_horz:
-                self._fill_finished_vertical_lines(board, done_v)
+        self.solutions = list()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.iterations = 0
+        self.stats = self._new_stats()
+        if profile:
+            self.stats["row_solves"] = [0] * self.height
+            self.stats["column_solves"] = [0] * self.width
+        self._profile = profile
+        self._on_progress = on_progress
+        self._progress_interval = progress_interval
+        self._next_progress = progress_interval
+        try:
+            if workers > 1 and self.width * self.height >= (
+                self.PARALLEL_MIN_TILES
+            ):
+                with concurrent.futures.ProcessPoolExecutor(
+                    workers,
+                ) as executor:
+                    self._propagate_parallel(
+                        self.grid,
+                        range(self.height),
+                        range(self.width),
+                        executor,
+                        workers,
+                    )
+            else:
+                self._propagate(
+                    self.grid, range(self.height), range(self.width),
+                )
+            if search:
+                solutions = self._search(self.grid, max_solutions)
+                if not solutions:
+                    raise NonogramNoSolutionError("the puzzle has no solution")
+                self.grid = solutions[0]
+                self.solutions = [
+                    grid.to_board(
+                        self.TILE_EMPTY, self.TILE_UNKNOWN, self.TILE_OCCUPIED,
+                    )
+                    for grid in solutions
+                ]
+        finally:
+            self.stats["line_solves"] = self.iterations
+            self._profile = False
+            self._on_progress = None
+            end_time = time.time()
+            self.time = end_time - start_time
+
+
+def _solve_lines_chunk(
+    solver_cls: type[NonogramSolver],
+    engine: str,
+    tasks: list[_LineTask],
+) -> list[T_line_result]:
+    """
+    Solve a chunk of lines and return the results (as returned by
+    `NonogramSolver._solve_line_engine`).
+
+    This runs in the worker processes of `NonogramSolver._propagate_parallel`,
+    using their own line solutions caches.
+    """
+    return [
+        NonogramSolver._line_cache(
+            solver_cls,
+            engine,
+            task.width,
+            task.occupied,
+            task.empty,
+            task.hints,
+        )
+        for task in tasks
+    ]
+
 
-            got_something_vert = self._try_vertical_lines(board, done_v)
-            if got_something_vert:
-                self._fill_finished_horizontal_lines(board, done_h)
+# A line with the width and the height of a puzzle.
+_HEADER_RE = re.compile(r"\s*\d+\s+\d+\s*$")
+# The start of a file in the packed format (see `iter_puzzles`).
+PACKED_MAGIC = b"NGRM\x01"
+_READ_SIZE = 64 * 1024
 
-            if not (got_something_horz or got_something_vert):
+
+def iter_definitions(lines: Iterable[str]) -> Iterator[list[str]]:
+    """
+    Yield the definitions of all the puzzles in a stream of lines.
+
+    The puzzles are written one after another in the usual format (see the
+    module's docstring), optionally separated by empty lines. A puzzle's
+    starting board is recognised by its first line being neither empty nor a
+    header, so an unknown first row of the board has to be written as spaces.
+    """
+    lines_iter = iter(lines)
+    line = next(lines_iter, None)
+    while line is not None:
+        if not line.strip("\r\n"):
+            line = next(lines_iter, None)
+            continue
+        if not _HEADER_RE.match(line):
+            raise ValueError(f"invalid puzzle header: {line!r}")
+        width, height = NonogramSolver._line2list(line)
+        definition = [line]
+        for _ in range(width + height):
+            line = next(lines_iter, None)
+            if line is None:
+                raise ValueError("unexpected end of the puzzle's hints")
+            definition.append(line)
+        line = next(lines_iter, None)
+        if (
+            line is not None
+            and line.strip("\r\n")
+            and not _HEADER_RE.match(line)
+        ):
+            definition.append(line)
+            for _ in range(height - 1):
+                line = next(lines_iter, None)
+                if line is None:
+                    raise ValueError("unexpected end of the puzzle's board")
+                definition.append(line)
+            line = next(lines_iter, None)
+        yield definition
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    """
+    Append a non-negative `int` to `out` as an unsigned LEB128 varint.
+    """
+    if value < 0:
+        raise ValueError(f"cannot pack a negative number: {value}")
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+class _PackedReader:
+    """
+    Buffered reader of the packed puzzle format from a binary stream.
+
+    Only a small chunk of the stream is kept in memory at a time.
+    """
+
+    __slots__ = ("_f", "_buffer", "_pos")
+
+    def __init__(self, f: BinaryIO, buffer: bytes = b"") -> None:
+        self._f = f
+        self._buffer = buffer
+        self._pos = 0
+
+    def _fill(self, size: int) -> bool:
+        """
+        Make sure that `size` bytes are buffered and return `False` if the
+        stream ends before that.
+        """
+        missing = size - (len(self._buffer) - self._pos)
+        if missing <= 0:
+            return True
+        chunks = [self._buffer[self._pos:]]
+        while missing > 0:
+            chunk = self._f.read(max(missing, _READ_SIZE))
+            if not chunk:
                 break
-        end_time = time.time()
-        self.time = end_time - start_time
-        self.iterations = iteration + 1
+            chunks.append(chunk)
+            missing -= len(chunk)
+        self._buffer = b"".join(chunks)
+        self._pos = 0
+        return missing <= 0
+
+    def at_eof(self) -> bool:
+        """
+        Return `True` if there is nothing left to read.
+        """
+        return not self._fill(1)
+
+    def read_bytes(self, size: int) -> bytes:
+        """
+        Return the next `size` bytes.
+        """
+        if not self._fill(size):
+            raise ValueError("unexpected end of the packed puzzle")
+        result = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return result
+
+    def read_varint(self) -> int:
+        """
+        Return the next unsigned LEB128 varint.
+        """
+        result = shift = 0
+        while True:
+            if self._pos >= len(self._buffer) and not self._fill(1):
+                raise ValueError("unexpected end of the packed puzzle")
+            byte = self._buffer[self._pos]
+            self._pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read_puzzle(self) -> T_packed_puzzle:
+        """
+        Return the next puzzle as `(vertical, horizontal, masks)`.
+
+        `masks` are the whole-board masks of the starting board (see
+        `NonogramBitBoard.to_masks`), or `None` if there is no board.
+        """
+        width = self.read_varint()
+        height = self.read_varint()
+        hints = [
+            [self.read_varint() for _ in range(self.read_varint())]
+            for _ in range(width + height)
+        ]
+        flags = self.read_bytes(1)[0]
+        masks: tuple[int, int] | None = None
+        if flags == 1:
+            size = (width * height + 7) // 8
+            masks = (
+                int.from_bytes(self.read_bytes(size), "little"),
+                int.from_bytes(self.read_bytes(size), "little"),
+            )
+        elif flags:
+            raise ValueError(f"invalid packed puzzle flags: {flags}")
+        return hints[:width], hints[width:], masks
+
+
+def _solver_from_packed(puzzle: T_packed_puzzle) -> "NonogramSolver":
+    """
+    Return a new solver for a puzzle read by `_PackedReader.read_puzzle`.
+    """
+    return NonogramSolver._from_packed(puzzle)
+
+
+def _solver_from_raw(
+    puzzle: list[str] | T_packed_puzzle,
+) -> "NonogramSolver":
+    """
+    Return a new solver for a puzzle yielded by `_iter_raw_puzzles`.
+    """
+    if isinstance(puzzle, list):
+        return NonogramSolver(puzzle)
+    return _solver_from_packed(puzzle)
+
+
+def _iter_binary_lines(f: BinaryIO, data: bytes = b"") -> Iterator[str]:
+    """
+    Yield the lines of a UTF-8 encoded binary stream, starting with `data`.
+    """
+    while True:
+        chunk = f.read(_READ_SIZE)
+        if not chunk:
+            break
+        lines = (data + chunk).split(b"\n")
+        data = lines.pop()
+        for line in lines:
+            yield line.decode() + "\n"
+    if data:
+        yield data.decode()
+
+
+def _iter_raw_puzzles(
+    f: BinaryIO | TextIO,
+) -> Iterator[list[str] | T_packed_puzzle]:
+    """
+    Yield the puzzles in `f`, without creating solvers for them.
+
+    The text puzzles are yielded as definitions (lists of lines), and the
+    packed ones as returned by `_PackedReader.read_puzzle`.
+    """
+    if isinstance(f, io.TextIOBase):
+        yield from iter_definitions(f)
+        return
+    binary = cast(BinaryIO, f)
+    head = binary.read(len(PACKED_MAGIC))
+    if head != PACKED_MAGIC:
+        yield from iter_definitions(_iter_binary_lines(binary, head))
+        return
+    reader = _PackedReader(binary)
+    while not reader.at_eof():
+        yield reader.read_puzzle()
+
+
+def iter_puzzles(f: BinaryIO | TextIO) -> Iterator["NonogramSolver"]:
+    """
+    Yield a solver for each puzzle in `f`, reading it lazily.
+
+    The format is detected from the start of the stream: either the text
+    format (any number of puzzles, see `iter_definitions`), or the packed
+    format, which is `PACKED_MAGIC` followed by the puzzles, each of them as:
+    * width and height,
+    * for each column and then each row, the number of hints and the hints,
+    * one byte of flags: `0` for no starting board, or `1` for a starting
+      board, which then follows as two bit-packed masks of occupied and empty
+      tiles (see `NonogramBitBoard.to_masks`), each of them as
+      `ceil(width * height / 8)` bytes in the little-endian order.
+    All the numbers, except in the masks, are unsigned LEB128 varints.
+
+    `f` can also be a text stream, in which case only the text format is
+    accepted.
+    """
+    for puzzle in _iter_raw_puzzles(f):
+        yield _solver_from_raw(puzzle)
+
+
+def write_packed(f: BinaryIO, puzzles: Iterable["NonogramSolver"]) -> int:
+    """
+    Write `puzzles` to `f` in the packed format and return their number.
+    """
+    f.write(PACKED_MAGIC)
+    count = 0
+    for solver in puzzles:
+        f.write(solver.to_packed())
+        count += 1
+    return count
+
+
+def _iter_batch_paths(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the names of the files given as files, directories or globs.
+
+    Directories are not searched recursively. `-` stands for standard input.
+    The paths that match nothing are yielded as they are, so that the error
+    is reported when they are opened.
+    """
+    for path in paths:
+        if path == "-" or os.path.isfile(path):
+            yield path
+        elif os.path.isdir(path):
+            for fname in sorted(os.listdir(path)):
+                fname = os.path.join(path, fname)
+                if os.path.isfile(fname):
+                    yield fname
+        else:
+            fnames = sorted(glob.glob(path))
+            if not fnames:
+                yield path
+            yield from (fname for fname in fnames if os.path.isfile(fname))
+
+
+def _iter_source_items(source: str, f: BinaryIO) -> Iterator[T_batch_item]:
+    """
+    Yield `(source, index, puzzle)` for each puzzle in `f`.
+
+    If `f` turns out to be malformed, the error is yielded in place of the
+    next puzzle, and the rest of `f` is skipped.
+    """
+    idx = 0
+    try:
+        for puzzle in _iter_raw_puzzles(f):
+            yield source, idx, puzzle
+            idx += 1
+    except ValueError as e:
+        yield source, idx, e
+
+
+def _iter_batch_items(paths: Iterable[str]) -> Iterator[T_batch_item]:
+    """
+    Yield `(source, index, puzzle)` for each puzzle in `paths`.
+
+    The puzzles are yielded as by `_iter_raw_puzzles`, so that they are
+    validated and turned into solvers in the worker processes. The files that
+    cannot be read or parsed give their errors instead (see
+    `_iter_source_items`), so that they don't stop the rest of the batch.
+    """
+    for fname in _iter_batch_paths(paths):
+        if fname == "-":
+            yield from _iter_source_items("-", sys.stdin.buffer)
+            continue
+        try:
+            f = open(fname, "rb")
+        except OSError as e:
+            yield fname, 0, e
+            continue
+        with f:
+            yield from _iter_source_items(fname, f)
+
+
+def _solve_batch_chunk(
+    items: list[T_batch_item],
+    search: bool,
+    max_solutions: int,
+) -> list[dict[str, Any]]:
+    """
+    Solve a chunk of puzzles and return their results.
+
+    This runs in the worker processes of `solve_batch`.
+    """
+    results = list()
+    for source, index, puzzle in items:
+        result: dict[str, Any] = {"source": source, "index": index}
+        if isinstance(puzzle, Exception):
+            result["error"] = str(puzzle)
+            results.append(result)
+            continue
+        try:
+            solver = _solver_from_raw(puzzle)
+        except ValueError as e:
+            result["error"] = str(e)
+            results.append(result)
+            continue
+        result["width"] = solver.width
+        result["height"] = solver.height
+        try:
+            solver.solve(search=search, max_solutions=max_solutions)
+        except NonogramNoSolutionError as e:
+            result["error"] = f"no solution: {e}"
+        else:
+            board = solver.board
+            result["solved"] = not any(
+                NonogramSolver.TILE_UNKNOWN in line for line in board
+            )
+            if search:
+                result["solutions"] = len(solver.solutions)
+            result["board"] = ["".join(line) for line in board]
+        result["time"] = solver.time
+        result["iterations"] = solver.iterations
+        results.append(result)
+    return results
+
+
+def solve_batch(
+    paths: Iterable[str],
+    workers: int | None = None,
+    chunksize: int = 8,
+    search: bool = False,
+    max_solutions: int = 1,
+) -> Iterator[dict[str, Any]]:
+    """
+    Solve all the puzzles in `paths` and yield the results as they come.
+
+    :param paths: Files (possibly with many puzzles each, in the text or the
+        packed format, see `iter_puzzles`), directories, or glob patterns.
+        `-` stands for standard input.
+    :param workers: The number of worker processes. `None` (the default)
+        means one per CPU, and `0` means solving in this process.
+    :param chunksize: The number of puzzles sent to a worker at once.
+    :param search: Passed to `NonogramSolver.solve`.
+    :param max_solutions: Passed to `NonogramSolver.solve`.
+    :return: An iterator of dictionaries, one per puzzle, in the order of
+        completion. Each of them contains the puzzle's `source` and `index`
+        (in that source), and either `error` or the solving results: `width`,
+        `height`, `solved`, `board`, `time`, `iterations`, and `solutions`
+        (in search mode only). A file that cannot be read or parsed gives an
+        `error` at the index where it failed, and the batch goes on with the
+        next file.
+    """
+    items = _iter_batch_items(paths)
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    if workers == 0:
+        for chunk in chunks:
+            yield from _solve_batch_chunk(chunk, search, max_solutions)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # Keep only a few chunks per worker in flight, so that huge batches
+        # are not read into memory all at once.
+        max_pending = 4 * workers
+        pending: set[concurrent.futures.Future] = set()
+        for chunk in chunks:
+            pending.add(executor.submit(
+                _solve_batch_chunk, chunk, search, max_solutions,
+            ))
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    yield from future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield from future.result()
+
+
+def run_batch(paths: Iterable[str], out: TextIO, **kwargs: Any) -> None:
+    """
+    Solve puzzles with `solve_batch` and write the results as JSON lines.
+
+    The last line is a summary with the totals and the throughput.
+    """
+    summary = {
+        "puzzles": 0, "solved": 0, "errors": 0, "time": 0.0, "iterations": 0,
+    }
+    start_time = time.time()
+    for result in solve_batch(paths, **kwargs):
+        summary["puzzles"] += 1
+        summary["solved"] += bool(result.get("solved"))
+        summary["errors"] += "error" in result
+        summary["time"] += result.get("time", 0.0)
+        summary["iterations"] += result.get("iterations", 0)
+        out.write(json.dumps(result) + "\n")
+    wall_time = time.time() - start_time
+    summary["wall_time"] = wall_time
+    summary["puzzles_per_second"] = (
+        summary["puzzles"] / wall_time if wall_time else 0.0
+    )
+    out.write(json.dumps({"summary": summary}) + "\n")
+
+
+def pack_puzzles(paths: Iterable[str], f: BinaryIO) -> int:
+    """
+    Write the puzzles in `paths` to `f` in the packed format.
+
+    :param paths: As in `solve_batch`.
+    :return: The number of the written puzzles.
+    """
+    def solvers() -> Iterator[NonogramSolver]:
+        for _, _, puzzle in _iter_batch_items(paths):
+            if isinstance(puzzle, Exception):
+                raise puzzle
+            yield _solver_from_raw(puzzle)
+
+    return write_packed(f, solvers())
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nonogram solver.")
+    parser.add_argument(
+        "paths", nargs="+", metavar="path",
+        help="the file with the puzzle or, in batch mode, files, directories"
+        " or globs with any number of puzzles (use - for standard input)",
+    )
+    parser.add_argument(
+        "-s", "--search", action="store_true",
+        help="use probing and search when line logic is not enough",
+    )
+    parser.add_argument(
+        "-n", "--max-solutions", type=int, default=1, metavar="N",
+        help="look for up to N solutions in search mode (default: 1)",
+    )
+    parser.add_argument(
+        "-p", "--profile", action="store_true",
+        help="print the time spent in each phase of solving",
+    )
+    parser.add_argument(
+        "-b", "--batch", action="store_true",
+        help="solve many puzzles and print the results as JSON lines",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, metavar="N",
+        help="the number of worker processes (in batch mode, the default is"
+        " one per CPU and 0 means no worker processes; otherwise, they are"
+        " used to solve the lines of large boards and the default is 0)",
+    )
+    parser.add_argument(
+        "-c", "--chunksize", type=int, default=8, metavar="N",
+        help="the number of puzzles sent to a worker at once (default: 8)",
+    )
+    parser.add_argument(
+        "--pack", metavar="FILE",
+        help="instead of solving, write the puzzles to FILE in the packed"
+        " format (use - for standard output)",
+    )
+    args = parser.parse_args()
+    if args.pack:
+        if args.pack == "-":
+            pack_puzzles(args.paths, sys.stdout.buffer)
+        else:
+            with open(args.pack, "wb") as f:
+                pack_puzzles(args.paths, f)
+        sys.exit(0)
+    if args.batch:
+        run_batch(
+            args.paths,
+            sys.stdout,
+            workers=args.workers,
+            chunksize=args.chunksize,
+            search=args.search,
+            max_solutions=args.max_solutions,
+        )
+        sys.exit(0)
+    if len(args.paths) != 1:
+        parser.error("exactly one file is expected outside of batch mode")
+    solver = NonogramSolver.from_file(args.paths[0])
     try:
-        solver = NonogramSolver.from_file(sys.argv[1])
-    except IndexError:
-        print(f"Syntax: {sys.argv[0]} filename")
+        solver.solve(
+            search=args.search,
+            max_solutions=args.max_solutions,
+            workers=args.workers or 0,
+            profile=args.profile,
+        )
+    except NonogramNoSolutionError as e:
+        print(f"No solution: {e}")
         sys.exit(1)
-    solver.solve()
-    solver.print_board()
+    if len(solver.solutions) > 1:
+        for solution_idx, solution in enumerate(solver.solutions):
+            if solution_idx:
+                print()
+            solver.board = solution
+            solver.print_board()
+        print(f"Found {len(solver.solutions)} solutions.")
+    else:
+        solver.print_board()
     print(
-        f"Solved in {solver.time:.3f}s, using {solver.iterations} iterations.",
+        f"Solved in {solver.time:.3f}s, using {solver.iterations} line"
+        f" solves.",
     )
+    if args.profile:
+        for phase, phase_time in solver.stats["phases"].items():
+            print(f"  {phase}: {phase_time:.3f}s")
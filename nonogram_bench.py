@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for `nonogram.py`.
+
+The benchmark solves randomly generated puzzles (seeded, generated from
+a random solution bitmap, so they always have a solution) of increasing
+sizes and densities, plus the bundled `nonogram.in`, with several variants of
+the solver's engine. For each of them, it reports the wall time, the number
+of line solves, the line cache statistics, and the peak memory (except for
+the engines that solve in worker processes, which `tracemalloc` can't see).
+
+The output is written as JSON lines: the first one describes the environment,
+and each of the following ones describes one run. This makes it easy to
+compare the results across versions.
+
+Usage: `./nonogram_bench.py [options]` (see `--help` for the options).
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Iterator, NamedTuple, TextIO
+
+from nonogram import NonogramNoSolutionError, NonogramSolver
+
+
+class Engine(NamedTuple):
+    """
+    A variant of the solver to benchmark.
+    """
+
+    # The keyword arguments for `NonogramSolver.solve`.
+    solve_kwargs: dict[str, Any]
+    # The line solver engine (`NonogramSolver.LINE_SOLVER`).
+    line_solver: str = "dp"
+    # The size limit of the line cache (`NonogramSolver.LINE_CACHE_SIZE`).
+    cache_size: int | None = NonogramSolver.LINE_CACHE_SIZE
+    # The biggest width or height that this engine gets (`None` for no
+    # limit), to avoid the runs that would take forever.
+    max_size: int | None = None
+
+
+ENGINES = {
+    "dp": Engine({}),
+    "dp-nocache": Engine({}, cache_size=0),
+    "enumerate": Engine({}, line_solver="enumerate", max_size=15),
+    "search": Engine({"search": True}, max_size=50),
+    "parallel": Engine({"workers": None}),
+}
+DEFAULT_ENGINES = ("dp", "dp-nocache", "enumerate", "search")
+DEFAULT_SIZES = (10, 25, 50, 100, 200, 300)
+DEFAULT_DENSITIES = (0.55, 0.65, 0.75)
+BUNDLED_PUZZLE = os.path.join(os.path.dirname(__file__), "nonogram.in")
+
+
+def generate_puzzle(
+    width: int, height: int, density: float, seed: int,
+) -> list[str]:
+    """
+    Return a definition of a random puzzle.
+
+    The puzzle is made from a random solution in which each tile is occupied
+    with the probability `density`, so it always has a solution (but not
+    necessarily a unique one, nor one that line logic alone can find).
+    """
+    rnd = random.Random(f"{width}x{height}:{density}:{seed}")
+    solution = [
+        [
+            NonogramSolver.TILE_OCCUPIED
+            if rnd.random() < density else
+            NonogramSolver.TILE_EMPTY
+            for _ in range(width)
+        ]
+        for _ in range(height)
+    ]
+    columns = [[line[x] for line in solution] for x in range(width)]
+    return [f"{width} {height}"] + [
+        " ".join(str(hint) for hint in NonogramSolver._get_hint(line))
+        for line in columns + solution
+    ]
+
+
+def iter_puzzles(
+    sizes: list[int], densities: list[float], seeds: int, bundled: bool,
+) -> Iterator[tuple[dict[str, Any], list[str]]]:
+    """
+    Yield `(description, definition)` for all the puzzles to benchmark.
+    """
+    if bundled:
+        with open(BUNDLED_PUZZLE) as f:
+            definition = list(f)
+        width, height = NonogramSolver._line2list(definition[0])
+        yield (
+            {"puzzle": "nonogram.in", "width": width, "height": height},
+            definition,
+        )
+    for size in sizes:
+        for density in densities:
+            for seed in range(seeds):
+                yield (
+                    {
+                        "puzzle": "random",
+                        "width": size,
+                        "height": size,
+                        "density": density,
+                        "seed": seed,
+                    },
+                    generate_puzzle(size, size, density, seed),
+                )
+
+
+def run_one(
+    definition: list[str], engine: Engine, trace_memory: bool,
+) -> dict[str, Any]:
+    """
+    Solve one puzzle with `engine` and return the measurements.
+
+    The line cache is cleared before the run, so that all the runs start
+    with a cold cache.
+    """
+    old_line_solver = NonogramSolver.LINE_SOLVER
+    old_cache_size = NonogramSolver.LINE_CACHE_SIZE
+    NonogramSolver.LINE_SOLVER = engine.line_solver
+    NonogramSolver.set_line_cache_size(engine.cache_size)
+    result: dict[str, Any] = dict()
+    try:
+        solver = NonogramSolver(definition)
+        if trace_memory:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        try:
+            solver.solve(**engine.solve_kwargs)
+        except NonogramNoSolutionError:
+            result["status"] = "no solution"
+        else:
+            result["status"] = "ok"
+        result["time"] = time.perf_counter() - start_time
+        if trace_memory:
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        cache_info = NonogramSolver.line_cache_info()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        NonogramSolver.LINE_SOLVER = old_line_solver
+        NonogramSolver.set_line_cache_size(old_cache_size)
+    result["line_solves"] = solver.iterations
+    result["cache_hits"] = cache_info.hits
+    result["cache_misses"] = cache_info.misses
+    result["unknown"] = sum(
+        line.count(NonogramSolver.TILE_UNKNOWN) for line in solver.board
+    )
+    return result
+
+
+def run_benchmark(
+    out: TextIO,
+    engines: list[str],
+    sizes: list[int],
+    densities: list[float],
+    seeds: int,
+    repeat: int = 1,
+    bundled: bool = True,
+    trace_memory: bool = True,
+) -> None:
+    """
+    Run all the benchmarks and write the results to `out` as JSON lines.
+
+    The reported time is the best one of `repeat` runs. If `trace_memory` is
+    set, one more run is made with `tracemalloc` enabled to get the peak
+    memory, since tracing slows the solver down considerably. That run is
+    skipped for the engines with `workers`, as `tracemalloc` only traces this
+    process (and the children's `ru_maxrss` is the maximum over all of them
+    so far, not per run); their `peak_memory` is `null`, with the reason in
+    `peak_memory_skipped`.
+    """
+    meta = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    out.write(json.dumps({"meta": meta}) + "\n")
+    for description, definition in iter_puzzles(
+        sizes, densities, seeds, bundled,
+    ):
+        size = max(description["width"], description["height"])
+        for engine_name in engines:
+            engine = ENGINES[engine_name]
+            record = dict(description, engine=engine_name)
+            if engine.max_size is not None and size > engine.max_size:
+                record["status"] = "skipped"
+            else:
+                runs = [
+                    run_one(definition, engine, False) for _ in range(repeat)
+                ]
+                record.update(min(runs, key=lambda run: run["time"]))
+                if trace_memory and "workers" in engine.solve_kwargs:
+                    record["peak_memory"] = None
+                    record["peak_memory_skipped"] = (
+                        "tracemalloc doesn't see the worker processes"
+                    )
+                elif trace_memory:
+                    record["peak_memory"] = run_one(
+                        definition, engine, True,
+                    )["peak_memory"]
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+
+def _list_of(item_type: type) -> Any:
+    """
+    Return a function that parses a comma-separated list for `argparse`.
+    """
+    def parse(value: str) -> list[Any]:
+        return [item_type(item) for item in value.split(",") if item]
+    return parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nonogram solver benchmark.")
+    parser.add_argument(
+        "-e", "--engines", type=_list_of(str),
+        default=list(DEFAULT_ENGINES),
+        help=f"comma-separated engines to benchmark, out of"
+        f" {', '.join(ENGINES)} (default: {','.join(DEFAULT_ENGINES)})",
+    )
+    parser.add_argument(
+        "-s", "--sizes", type=_list_of(int), default=list(DEFAULT_SIZES),
+        help=f"comma-separated sizes of the random puzzles (default:"
+        f" {','.join(str(size) for size in DEFAULT_SIZES)})",
+    )
+    parser.add_argument(
+        "-d", "--densities", type=_list_of(float),
+        default=list(DEFAULT_DENSITIES),
+        help=f"comma-separated densities of the random puzzles (default:"
+        f" {','.join(str(density) for density in DEFAULT_DENSITIES)})",
+    )
+    parser.add_argument(
+        "-n", "--seeds", type=int, default=3,
+        help="the number of random puzzles per size and density (default: 3)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=1,
+        help="the number of timed runs per puzzle and engine (default: 1)",
+    )
+    parser.add_argument(
+        "--no-bundled", action="store_true",
+        help="don't include the bundled nonogram.in",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true",
+        help="don't measure the peak memory",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="the output file (default: standard output)",
+    )
+    args = parser.parse_args()
+    unknown_engines = set(args.engines) - set(ENGINES)
+    if unknown_engines:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown_engines))}")
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        run_benchmark(
+            out,
+            engines=args.engines,
+            sizes=args.sizes,
+            densities=args.densities,
+            seeds=args.seeds,
+            repeat=args.repeat,
+            bundled=not args.no_bundled,
+            trace_memory=not args.no_memory,
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -6,6 +6,14 @@ A native Python module to get pages' sizes from PDF.
 I needed this to get pages' sizes from huge PDFs (containing large images)
 without big memory consumption.
 
+When possible, only the objects of the pages' tree are read, found through the
+cross-reference data at the end of the file. Otherwise, the whole file is
+scanned.
+
+Besides the sizes of the pages' MediaBoxes (`pdf_pages_sizes`), the full
+geometry of the pages (boxes, rotation, user unit, displayed size) can be
+obtained with `pdf_pages_geometry`.
+
 Done by following [Portable Document Format – Part 1: PDF 1.7, First Edition]
 (https://wwwimages2.adobe.com/content/dam/acom/en/devnet/pdf/PDF32000_2008.pdf)
 found [here](https://www.adobe.com/devnet/pdf/pdf_reference.html).
@@ -14,30 +22,157 @@ found [here](https://www.adobe.com/devnet/pdf/pdf_reference.html).
 [here](https://stackoverflow.com/a/51559543/1667018).
 """
 
+import argparse
+import binascii
+from collections import namedtuple
+import csv
+import hashlib
+import json
 from math import log10
+import mmap
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import os
 import re
+import sqlite3
+import sys
 from sys import argv
+import warnings
+import zlib
+
+if sys.version_info[0] >= 3:
+    import queue
+else:
+    import Queue as queue
+
 
+# Geometry of a page, as returned by `pdf_pages_geometry`:
+# * `mediabox` and `cropbox`: the effective boxes, as `(x1, y1, x2, y2)` with
+#   `x1 <= x2` and `y1 <= y2`, in the default user space units (CropBox is
+#   clipped to MediaBox, and it is equal to it if the page doesn't have one),
+# * `rotate`: the rotation of the page, one of 0, 90, 180, 270,
+# * `userunit`: the size of the user space unit in 1/72 inch,
+# * `size`: the `(width, height)` of the page as displayed (i.e., of the
+#   CropBox, rotated), in the requested units.
+PageGeometry = namedtuple(
+    "PageGeometry", ("mediabox", "cropbox", "rotate", "userunit", "size"),
+)
 
-def _pages_tree_to_list(pages, root=None):
+# Attributes of the page tree's nodes that the pages inherit.
+_INHERITABLE = (b"MediaBox", b"CropBox", b"Rotate")
+# Attributes inherited by the pages from the root of the page tree.
+_ROOT_ATTRIBUTES = {b"UserUnit": 1}
+
+
+def _inherit(inherited, attributes):
     """
-    Return list of pages in the right order from PDF's tree.
+    Return the effective attributes of a node of the page tree.
+
+    :param inherited: The effective attributes of the node's parent (or
+        `_ROOT_ATTRIBUTES` for the root).
+    :param attributes: The node's own attributes, as a dictionary with the
+        names as keys (in bytes, without the leading slash).
+    :return: A dictionary of attributes (which is `inherited` itself if the
+        node doesn't change any of them, so it must not be modified).
     """
-    if root is None:
-        root = next(
-            ref
-            for ref in pages
-            if not any(ref in pgs for pgs in pages.values())
-        )
-    result = list()
-    for ref in pages[root]:
-        if ref in pages:
-            result.extend(_pages_tree_to_list(pages, ref))
-        else:
-            result.append(ref)
+    result = inherited
+    for key in _INHERITABLE:
+        if key in attributes:
+            if result is inherited:
+                result = dict(inherited)
+            result[key] = attributes[key]
+    if b"UserUnit" in attributes:
+        if result is inherited:
+            result = dict(inherited)
+        result[b"UserUnit"] = inherited[b"UserUnit"] * attributes[b"UserUnit"]
     return result
 
 
+def _normalize_box(box):
+    """
+    Return `box` as `(x1, y1, x2, y2)` with `x1 <= x2` and `y1 <= y2`, or
+    `None` if it's not a valid rectangle.
+    """
+    if (
+        not isinstance(box, (list, tuple))
+        or len(box) != 4
+        or not all(isinstance(value, (int, float)) for value in box)
+    ):
+        return None
+    x1, y1, x2, y2 = box
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def _page_geometry(attributes, units):
+    """
+    Return `PageGeometry` of a page with the effective `attributes` (as
+    returned by `_inherit`).
+    """
+    mediabox = _normalize_box(attributes.get(b"MediaBox"))
+    if mediabox is None:
+        raise PdfError("page without a valid MediaBox")
+    cropbox = _normalize_box(attributes.get(b"CropBox"))
+    if cropbox is None:
+        cropbox = mediabox
+    else:
+        cropbox = (
+            max(cropbox[0], mediabox[0]),
+            max(cropbox[1], mediabox[1]),
+            min(cropbox[2], mediabox[2]),
+            min(cropbox[3], mediabox[3]),
+        )
+        if cropbox[0] > cropbox[2] or cropbox[1] > cropbox[3]:
+            # Outside of the MediaBox, so not usable.
+            cropbox = mediabox
+    rotate = int(attributes.get(b"Rotate", 0)) % 360
+    userunit = attributes[b"UserUnit"]
+    unit_factor = _UNITS_FACTORS[units] * userunit
+    size = (
+        (cropbox[2] - cropbox[0]) * unit_factor,
+        (cropbox[3] - cropbox[1]) * unit_factor,
+    )
+    if rotate in (90, 270):
+        size = size[::-1]
+    return PageGeometry(mediabox, cropbox, rotate, userunit, size)
+
+
+def _mediabox_size(geometry, units):
+    """
+    Return the size of the MediaBox from `geometry`, in `units`.
+    """
+    unit_factor = _UNITS_FACTORS[units] * geometry.userunit
+    x1, y1, x2, y2 = geometry.mediabox
+    return (x2 - x1) * unit_factor, (y2 - y1) * unit_factor
+
+
+def _pages_tree_root(pages, parents):
+    """
+    Return the root of PDF's pages tree, or `None` if there isn't one.
+
+    :param pages: Dictionary of the tree's inner nodes and their kids.
+    :param parents: Dictionary of the nodes and their parents.
+    """
+    if not pages:
+        return None
+    # Follow the parents up from any node.
+    ref = next(iter(pages))
+    seen = set()
+    while ref in parents and ref not in seen:
+        seen.add(ref)
+        ref = parents[ref]
+    if ref in pages and ref not in seen:
+        return ref
+    # The parents are broken, so take the node that is nobody's kid (the one
+    # without a parent, if there are more of them).
+    kids = set()
+    for node_kids in pages.values():
+        kids.update(node_kids)
+    candidates = [ref for ref in pages if ref not in kids]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda ref: (ref in parents, ref))
+
+
 def _str_to_num(s):
     """
     Return string converted to `int` or `float`.
@@ -48,16 +183,1392 @@ def _str_to_num(s):
         return float(s)
 
 
-def _ref_m_to_tuple(m):
+def _ref_m_to_tuple(m, prefix=""):
     """
     Return reference tuple from RegEx `Match`.
+
+    The numbers are taken from the groups `prefix + "m"` and `prefix + "n"`.
+    """
+    return int(m.group(prefix + "m")), int(m.group(prefix + "n"))
+
+
+# Regex strings (subexpressions to use):
+_RS_ONE_TO_LIST = r"{fmt}(?:\s+{fmt})*"
+_RS_REF = r"\d+\s+\d+\s+R"
+_RS_REFS = _RS_ONE_TO_LIST.format(fmt=_RS_REF)
+_RS_NREF = r"(?P<parent_m>\d+)\s+(?P<parent_n>\d+)\s+R"  # TODO \b
+_RS_FLOAT = r"(?:\b\d+(?:\.\d*)?|\.\d+\b)"
+_RS_SIGNED_FLOATS = _RS_ONE_TO_LIST.format(fmt=r"[+-]?" + _RS_FLOAT)
+
+# All the elements to search for, in one pattern. Each of them is a named group
+# with the name of the `_PdfScanner` method that handles it (without "_on_").
+# The pattern is compiled as bytes, so that it can be used directly on the
+# data read from a file, as well as on a memory map of the file. The lookahead
+# lets most positions fail on their first character, instead of trying all the
+# alternatives on them.
+_RE_TOKENS = re.compile(r"(?=[\d/<>se])(?:{})".format("|".join(
+    "(?P<{}>{})".format(name, restr)
+    for name, restr in (
+        (
+            "integer_obj",
+            r"(?P<integer_m>\d+)\s+(?P<integer_n>\d+)\s+obj\s+"
+            r"(?P<integer_value>\d+)\s+endobj\b",
+        ),
+        ("obj", r"(?P<obj_m>\d+)\s+(?P<obj_n>\d+)\s+obj\b"),
+        ("start", r"<<"),
+        ("object_type", r"/Type\s*/(?P<type>\w+)"),
+        (
+            "box",
+            r"/(?P<box_name>MediaBox|CropBox)\s*\[\s*"
+            r"(?P<box_values>" + _RS_SIGNED_FLOATS + r")\s*\]",
+        ),
+        ("rotate", r"/Rotate\s+(?P<rotate_value>[+-]?\d+)\b"),
+        ("end", r">>"),
+        ("stream", r"\bstream(?:\r\n|\n|\b)"),
+        ("endstream", r"\bendstream\b"),
+        ("kids", r"/Kids\s*\[\s*(?P<kids_refs>" + _RS_REFS + r")\s*\]"),
+        ("parent", r"/Parent\s+" + _RS_NREF),
+        ("userunit", r"/UserUnit\s*(?P<unit>" + _RS_FLOAT + r")"),
+        ("pages", r"/Pages\s+(?P<pages_m>\d+)\s+(?P<pages_n>\d+)\s+R\b"),
+        ("root", r"/Root\s+(?P<root_m>\d+)\s+(?P<root_n>\d+)\s+R\b"),
+        ("linearized", r"/Linearized\b"),
+        (
+            "length",
+            r"/Length\s+(?:(?P<length_m>\d+)\s+(?P<length_n>\d+)\s+R"
+            r"|(?P<length_value>\d+))\b",
+        ),
+    )
+)).encode("ascii"))
+# Inside streams, only their end is searched for.
+_RE_ENDSTREAM = re.compile(br"(?P<endstream>\bendstream\b)")
+# The end of a stream, where its `/Length` says it should be.
+_RE_STREAM_END = re.compile(br"[\s\x00]*endstream\b")
+# How much data is needed to check for `_RE_STREAM_END`.
+_STREAM_END_SIZE = 32
+_RE_SPACES = re.compile(br"\s+")
+_RE_KIDS = re.compile(br"/Kids")
+
+_UNITS_FACTORS = {"px": 1, "in": 1.0 / 72, "mm": 25.4 / 72, "cm": 2.54 / 72}
+
+
+class _PdfScanner(object):
     """
-    return int(m.group("m")), int(m.group("n"))
+    Linear scanner of PDF's objects, collecting the data on the pages.
 
+    The text is given to `scan` as `bytes` or any object supporting the buffer
+    protocol (a memory map of the file, for example), which is searched as it
+    is, without any decoding or copying.
 
-def pdf_pages_sizes(fp, chunk_size=1024**2, units="px"):
+    The data of the streams is skipped using their `/Length` when it is known.
+    Indirect lengths are taken from the integer objects found so far or, if
+    not there, from `resolve(ref)` (if given), which should return the value
+    of the object referenced by `ref` (or `None` if that's not possible).
+
+    The objects inside object streams cannot be seen by the scanner, but the
+    offsets of the object streams are collected in `object_streams`, and the
+    objects taken from them can be added with `add_object`.
     """
-    Return list of sizes for PDF in stream `fp` (open file, `StringIO`, etc).
+
+    def __init__(self, resolve=None):
+        # Page tree's node -> its own attributes (see `_inherit`).
+        self.attributes = dict()
+        self.depth = 0
+        self.in_stream = False
+        self.integers = dict()
+        self.kids = list()
+        self.catalog = None
+        self.length = None
+        # Set if the file starts with the linearization dictionary.
+        self.linearized = False
+        # The attributes of the current object.
+        self.node = dict()
+        self.object_streams = dict()
+        self.obj_offset = None
+        # How many objects were found.
+        self.objects_count = 0
+        self.pages = dict()
+        self.pages_ref = None
+        self.parents = dict()
+        self.ref = None
+        self.resolve = resolve
+        self.root = None
+        # If set, the offset at which the current stream should end, if its
+        # length is right.
+        self.skip_to = None
+        self.type = None
+        # The stack of the walk through the page tree (see `geometry`).
+        self.walk = None
+        # The nodes of the page tree that were walked through.
+        self.walked = set()
+
+    # Methods to handle recognised PDF entities
+    def _on_integer_obj(self, m):
+        if self.depth == 0:
+            self.objects_count += 1
+            self.integers[_ref_m_to_tuple(m, "integer_")] = int(
+                m.group("integer_value"),
+            )
+
+    def _on_obj(self, m):
+        if self.depth == 0:
+            self.objects_count += 1
+            self.ref = _ref_m_to_tuple(m, "obj_")
+            self.obj_offset = self.base + m.start()
+            self.length = None
+
+    def _on_start(self, m):
+        self.depth += 1
+
+    def _on_object_type(self, m):
+        if self.depth == 1:
+            self.type = m.group("type")
+
+    def _on_box(self, m):
+        if self.depth == 1:
+            self.node[m.group("box_name")] = tuple(
+                _str_to_num(d) for d in _RE_SPACES.split(m.group("box_values"))
+            )
+
+    def _on_rotate(self, m):
+        if self.depth == 1:
+            self.node[b"Rotate"] = int(m.group("rotate_value"))
+
+    def _on_end(self, m):
+        if self.depth == 0:
+            # Unbalanced `>>` (in the data of a stream that wasn't skipped).
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            if self.ref:
+                if self.type in (b"Page", b"Pages"):
+                    self.attributes[self.ref] = self.node
+                    if self.type == b"Pages":
+                        self.pages[self.ref] = self.kids
+                        self.parents.update(
+                            {kid: self.ref for kid in self.kids},
+                        )
+                elif self.type == b"Catalog" and self.pages_ref:
+                    self.root = self.pages_ref
+                elif self.type == b"ObjStm":
+                    self.object_streams[self.ref[0]] = self.obj_offset
+            self.ref = None
+            self.pages_ref = None
+            self.type = None
+            self.node = dict()
+            self.kids = list()
+
+    def _on_stream(self, m):
+        self.in_stream = True
+        length, self.length = self.length, None
+        if isinstance(length, tuple):
+            ref = length
+            length = self.integers.get(ref)
+            if length is None and self.resolve is not None:
+                length = self.resolve(ref)
+        if isinstance(length, int) and length >= 0:
+            self.skip_to = m.end() + length
+
+    def _on_endstream(self, m):
+        self.in_stream = False
+
+    def _on_kids(self, m):
+        if self.depth != 1 or self.ref is None:
+            return
+        kids_list = _RE_SPACES.split(m.group("kids_refs"))
+        self.kids = [
+            (int(m), int(n)) for m, n in zip(kids_list[0::3], kids_list[1::3])
+        ]
+
+    def _on_parent(self, m):
+        if self.depth == 1 and self.ref is not None:
+            self.parents[self.ref] = _ref_m_to_tuple(m, "parent_")
+
+    def _on_userunit(self, m):
+        if self.depth == 1 and self.ref:
+            self.node[b"UserUnit"] = _str_to_num(m.group("unit"))
+
+    def _on_pages(self, m):
+        if self.depth == 1:
+            self.pages_ref = _ref_m_to_tuple(m, "pages_")
+
+    def _on_root(self, m):
+        if self.depth == 1:
+            self.catalog = _ref_m_to_tuple(m, "root_")
+
+    def _on_linearized(self, m):
+        if self.depth == 1 and self.objects_count == 1:
+            self.linearized = True
+
+    def _on_length(self, m):
+        if self.depth == 1:
+            if m.group("length_value"):
+                self.length = int(m.group("length_value"))
+            else:
+                self.length = _ref_m_to_tuple(m, "length_")
+
+    def end_stream_at(self, text, pos, end):
+        """
+        End the current stream if `endstream` is at `text[pos:end]`.
+
+        :return: The offset after `endstream` or, if it's not there, `None`.
+        """
+        match = _RE_STREAM_END.match(text, pos, end)
+        if match is None:
+            return None
+        self.in_stream = False
+        return match.end()
+
+    def scan(self, text, offset=0, end=None, final=True, base=0):
+        """
+        Process all the recognised elements in `text[offset:end]`.
+
+        `base` is the offset of `text` in the file.
+
+        If `final` is not set, more text is expected to follow, so the
+        elements that reach `end` are left unprocessed (they might continue in
+        the text that follows, e.g., `/Type /Pa` + `ges`).
+
+        If a stream with a known length ends after `end`, the scanning stops
+        at its start and `skip_to` is left set, so that the caller can skip
+        the stream's data (using `end_stream_at` to check where it ends).
+
+        :return: The offset of the end of the last processed element.
+        """
+        if end is None:
+            end = len(text)
+        self.base = base
+        # Process the elements one by one, until none are left.
+        while True:
+            regex = _RE_ENDSTREAM if self.in_stream else _RE_TOKENS
+            match = regex.search(text, offset, end)
+            if match is None or (not final and match.end() >= end):
+                break
+            getattr(self, "_on_" + match.lastgroup)(match)
+            # Move the offset (to ignore the processed part of the text).
+            offset = match.end()
+            if self.skip_to is not None:
+                if not final and self.skip_to + _STREAM_END_SIZE > end:
+                    break
+                stream_end = self.end_stream_at(text, self.skip_to, end)
+                self.skip_to = None
+                # If the length is wrong, `endstream` is searched for.
+                if stream_end is not None:
+                    offset = stream_end
+        return offset
+
+    def add_object(self, ref, value):
+        """
+        Add an object found outside of the scanned text (e.g., in an object
+        stream), with `value` as returned by `_Parser.value`.
+        """
+        if not isinstance(value, dict):
+            return
+        ref = tuple(ref)
+        kind = value.get(b"Type")
+        if isinstance(value.get(b"Parent"), _Ref):
+            self.parents[ref] = tuple(value[b"Parent"])
+        if kind in (b"Page", b"Pages"):
+            self.attributes[ref] = {
+                key: value[key]
+                for key in _INHERITABLE + (b"UserUnit",)
+                if key in value
+                and not isinstance(value[key], (_Ref, dict, bytes))
+            }
+            if kind == b"Pages":
+                kids = [
+                    tuple(kid) for kid in value.get(b"Kids", list())
+                    if isinstance(kid, _Ref)
+                ]
+                self.pages[ref] = kids
+                self.parents.update({kid: ref for kid in kids})
+        elif kind == b"Catalog" and isinstance(value.get(b"Pages"), _Ref):
+            self.root = tuple(value[b"Pages"])
+
+    def missing_objects(self):
+        """
+        Return the references to the page tree's objects that weren't found.
+        """
+        wanted = set(self.parents.values())
+        for kids in self.pages.values():
+            wanted.update(kids)
+        if self.root is not None:
+            wanted.add(self.root)
+        elif self.catalog is not None and not self.pages:
+            wanted.add(self.catalog)
+        return wanted - set(self.attributes)
+
+    def geometry(self, units, final=True):
+        """
+        Return list of `PageGeometry` of the pages, in the right order,
+        continuing after those returned by the previous calls.
+
+        If `final` is not set, more text is expected to be scanned, so only
+        the pages that are known to follow the previously returned ones are
+        returned. This is done only for linearized files (in others, the
+        objects found so far can be replaced by the incremental updates), and
+        it requires the root of the page tree to be known from the catalog. It
+        stops at the first node of the page tree that wasn't found yet.
+
+        The problems with the page tree (cycles, pages that are not in it) are
+        reported as `PdfWarning`, and the affected nodes are skipped. If there
+        is no page tree at all (neither the catalog's `/Pages` nor any
+        `/Type /Pages` object was found), `PdfError` is raised.
+        """
+        if not (final or self.linearized):
+            return list()
+        if self.walk is None:
+            root = self.root
+            if root not in self.attributes:
+                if not final:
+                    return list()
+                root = _pages_tree_root(self.pages, self.parents)
+                if root is None:
+                    if not self.pages:
+                        raise PdfError("no page tree found")
+                    _warn("the page tree has no root")
+                    return list()
+            # The tree is walked in order, top-down, with an explicit stack
+            # of `(ref, the effective attributes of its parent)`, so that each
+            # node's attributes are resolved only once.
+            self.walk = [(root, _ROOT_ATTRIBUTES)]
+        result = list()
+        while self.walk:
+            ref, inherited = self.walk[-1]
+            if ref not in self.attributes:
+                if not final:
+                    break
+                raise PdfError("page tree's object {} not found".format(ref))
+            self.walk.pop()
+            if ref in self.walked:
+                _warn("cycle in the page tree at object {}".format(ref))
+                continue
+            self.walked.add(ref)
+            attributes = _inherit(inherited, self.attributes[ref])
+            if ref in self.pages:
+                self.walk.extend(
+                    (kid, attributes) for kid in reversed(self.pages[ref])
+                )
+            else:
+                result.append(_page_geometry(attributes, units))
+        if final:
+            orphans = len(set(self.attributes) - self.walked)
+            if orphans:
+                _warn(
+                    "{} object(s) of the page tree are not in it".format(
+                        orphans,
+                    ),
+                )
+        return result
+
+
+class PdfError(ValueError):
+    """
+    Raised when a PDF (or a part of it that is needed) cannot be parsed.
+    """
+
+
+class PdfWarning(UserWarning):
+    """
+    Issued for the problems in a PDF that don't prevent getting the pages.
+    """
+
+
+def _warn(message):
+    """
+    Issue `PdfWarning` with `message`, attributed to the first caller outside
+    of this module (which can be any number of frames up, depending on where
+    in the generators run by `_drive` the problem was found).
+    """
+    frame = sys._getframe(1)
+    stacklevel = 2
+    while frame.f_back is not None and frame.f_globals is globals():
+        frame = frame.f_back
+        stacklevel += 1
+    warnings.warn(message, PdfWarning, stacklevel=stacklevel)
+
+
+class _NeedMore(Exception):
+    """
+    Raised by `_Parser` when the data ends before the parsed value does.
+    """
+
+
+# Reference to an indirect object. It is equal to a `(num, gen)` tuple, which
+# is how references are represented by `_PdfScanner`.
+_Ref = namedtuple("_Ref", ("num", "gen"))
+
+_RS_WHITESPACE = r"[\s\x00]"
+_RS_REGULAR = r"[^\s\x00()<>\[\]{}/%]"
+_RE_WHITESPACE = re.compile(
+    (r"(?:" + _RS_WHITESPACE + r"|%[^\r\n]*)*").encode("ascii"),
+)
+_RE_VALUE = re.compile((
+    r"(?P<ref>(?P<num>\d+)\s+(?P<gen>\d+)\s+R(?!" + _RS_REGULAR + r"))"
+    r"|(?P<number>[+-]?(?:\d+(?:\.\d*)?|\.\d+))"
+    r"|/(?P<name>" + _RS_REGULAR + r"*)"
+    r"|(?P<dict><<)"
+    r"|(?P<dict_end>>>)"
+    r"|(?P<array>\[)"
+    r"|(?P<array_end>\])"
+    r"|(?P<string>\()"
+    r"|<(?P<hex>[0-9A-Fa-f\s]*)>"
+    r"|(?P<keyword>" + _RS_REGULAR + r"+)"
+).encode("ascii"))
+_RE_STRING_SPECIAL = re.compile(br"[()\\]")
+_RE_NAME_ESCAPE = re.compile(br"#([0-9A-Fa-f]{2})")
+_RE_OBJ_HEADER = re.compile(br"[\s\x00]*(\d+)\s+(\d+)\s+obj\b")
+_RE_STREAM = re.compile(br"[\s\x00]*stream(?:\r\n|\n|\r)?")
+_KEYWORDS = {b"true": True, b"false": False, b"null": None}
+# How close to the end of incomplete data the parser can get before it asks
+# for more (so that, e.g., `12 0` is not taken for two numbers in `12 0 R`).
+_PARSER_MARGIN = 32
+
+
+class _Parser(object):
+    """
+    Parser of PDF's objects from `bytes`.
+
+    Names are returned as `bytes` (without the leading slash), as are the
+    strings (which are not decoded), and references as `_Ref`.
+    """
+
+    def __init__(self, data, pos=0, final=True):
+        self.data = data
+        self.pos = pos
+        self.final = final
+
+    def _token(self):
+        """
+        Return the `Match` of the next token and move past it.
+        """
+        data = self.data
+        self.pos = _RE_WHITESPACE.match(data, self.pos).end()
+        m = _RE_VALUE.match(data, self.pos)
+        if not self.final and len(data) - (
+            self.pos if m is None else m.end()
+        ) < _PARSER_MARGIN:
+            raise _NeedMore()
+        if m is None:
+            if self.pos >= len(data):
+                raise PdfError("unexpected end of data")
+            raise PdfError("invalid syntax: {!r}".format(
+                data[self.pos:self.pos + 16],
+            ))
+        self.pos = m.end()
+        return m
+
+    def value(self):
+        """
+        Return the next value.
+        """
+        m = self._token()
+        kind = m.lastgroup
+        if kind == "ref":
+            return _Ref(int(m.group("num")), int(m.group("gen")))
+        elif kind == "number":
+            return _str_to_num(m.group("number"))
+        elif kind == "name":
+            return _RE_NAME_ESCAPE.sub(
+                lambda e: binascii.unhexlify(e.group(1)), m.group("name"),
+            )
+        elif kind == "dict":
+            result = dict()
+            while True:
+                m = self._token()
+                if m.lastgroup == "dict_end":
+                    return result
+                if m.lastgroup != "name":
+                    raise PdfError("a dictionary key must be a name")
+                result[m.group("name")] = self.value()
+        elif kind == "array":
+            result = list()
+            while True:
+                pos = self.pos
+                if self._token().lastgroup == "array_end":
+                    return result
+                self.pos = pos
+                result.append(self.value())
+        elif kind == "string":
+            return self._string()
+        elif kind == "hex":
+            digits = b"".join(m.group("hex").split())
+            return binascii.unhexlify(digits + b"0" * (len(digits) % 2))
+        elif kind == "keyword" and m.group("keyword") in _KEYWORDS:
+            return _KEYWORDS[m.group("keyword")]
+        raise PdfError("unexpected {!r}".format(m.group()))
+
+    def _string(self):
+        """
+        Return the raw content of a literal string (after its opening bracket).
+        """
+        start = pos = self.pos
+        depth = 1
+        while depth:
+            m = _RE_STRING_SPECIAL.search(self.data, pos)
+            if m is None:
+                if not self.final:
+                    raise _NeedMore()
+                raise PdfError("unterminated string")
+            pos = m.end()
+            char = m.group()
+            if char == b"\\":
+                pos += 1
+            elif char == b"(":
+                depth += 1
+            else:
+                depth -= 1
+        self.pos = pos
+        return self.data[start:pos - 1]
+
+
+def _parse_indirect(data, final):
+    """
+    Return `(num, gen, value, stream)` for the indirect object in `data`.
+
+    `stream` is the offset of the stream's data in `data`, or `None` if the
+    object is not a stream.
+    """
+    m = _RE_OBJ_HEADER.match(data)
+    if m is None:
+        if not final and len(data) < _PARSER_MARGIN:
+            raise _NeedMore()
+        raise PdfError("no object where one was expected")
+    parser = _Parser(data, m.end(), final)
+    value = parser.value()
+    if not final and len(data) - parser.pos < _PARSER_MARGIN:
+        raise _NeedMore()
+    stream = _RE_STREAM.match(data, parser.pos)
+    return (
+        int(m.group(1)), int(m.group(2)), value,
+        stream.end() if stream else None,
+    )
+
+
+def _decode_stream(data, dictionary):
+    """
+    Return the decoded data of a stream with `dictionary`.
+
+    Only FlateDecode (with or without PNG predictors) is supported.
+    """
+    filters = dictionary.get(b"Filter", list())
+    params = dictionary.get(b"DecodeParms") or dict()
+    if not isinstance(filters, list):
+        filters = [filters]
+    if isinstance(params, list):
+        params = params[0] if len(params) == 1 and params[0] else dict()
+    if not filters:
+        return data
+    if filters != [b"FlateDecode"]:
+        raise PdfError("unsupported stream filters: {!r}".format(filters))
+    data = zlib.decompress(data)
+    predictor = params.get(b"Predictor", 1)
+    if predictor >= 10:
+        data = _png_unpredict(
+            data,
+            params.get(b"Columns", 1),
+            params.get(b"Colors", 1) * params.get(b"BitsPerComponent", 8)
+            // 8 or 1,
+        )
+    elif predictor != 1:
+        raise PdfError("unsupported predictor: {}".format(predictor))
+    return data
+
+
+def _png_unpredict(data, columns, bpp=1):
+    """
+    Return `data` with PNG predictors (one filter byte per row) undone.
+    """
+    data = bytearray(data)
+    row_size = columns * bpp
+    prev = bytearray(row_size)
+    result = bytearray()
+    for start in range(0, len(data) - row_size, row_size + 1):
+        kind = data[start]
+        row = data[start + 1:start + 1 + row_size]
+        if kind == 1:
+            for i in range(bpp, row_size):
+                row[i] = (row[i] + row[i - bpp]) & 0xff
+        elif kind == 2:
+            for i in range(row_size):
+                row[i] = (row[i] + prev[i]) & 0xff
+        elif kind == 3:
+            for i in range(row_size):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + (left + prev[i]) // 2) & 0xff
+        elif kind == 4:
+            for i in range(row_size):
+                left = row[i - bpp] if i >= bpp else 0
+                up_left = prev[i - bpp] if i >= bpp else 0
+                estimate = left + prev[i] - up_left
+                d_left = abs(estimate - left)
+                d_up = abs(estimate - prev[i])
+                d_up_left = abs(estimate - up_left)
+                if d_left <= d_up and d_left <= d_up_left:
+                    row[i] = (row[i] + left) & 0xff
+                elif d_up <= d_up_left:
+                    row[i] = (row[i] + prev[i]) & 0xff
+                else:
+                    row[i] = (row[i] + up_left) & 0xff
+        elif kind:
+            raise PdfError("invalid PNG predictor: {}".format(kind))
+        result += row
+        prev = row
+    return bytes(result)
+
+
+class _Read(object):
+    """
+    Request to read (up to) `size` bytes from `offset` of the file.
+    """
+
+    __slots__ = ("offset", "size")
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+
+
+class _Size(object):
+    """
+    Request for the size of the file.
+    """
+
+    __slots__ = ()
+
+
+class _Return(object):
+    """
+    The result of a generator run by `_iter_run`.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Yield(object):
+    """
+    Request to give `value` to the consumer of `_iter_run` (and continue).
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _drive(gen):
+    """
+    Run generator `gen` that reads a file, without doing any I/O itself.
+
+    The generator (and all the others that it runs) can yield:
+    * `_Read`, to get back the data read from the file (`offset` can be
+      `None` for reading sequentially, without seeking),
+    * `_Size`, to get back the size of the file,
+    * `_Yield`, to give out a value and continue,
+    * another such generator, to get back its result,
+    * `_Return`, to finish and give the result.
+    Exceptions are propagated from the generators to the ones that run them.
+    This way, the file handling is kept separate from the parsing, and it is
+    compatible with Python 2 (which doesn't allow `return` with a value in
+    generators).
+
+    This generator yields the `_Read`, `_Size`, and `_Yield` requests to its
+    own consumer, which has to send back the requested data (or throw in the
+    error that reading it caused, or send `None` after `_Yield`). The last
+    request is the `_Return` with the result of `gen`.
+    """
+    stack = [gen]
+    value = error = None
+    while True:
+        try:
+            if error is None:
+                request = stack[-1].send(value)
+            else:
+                request, error = stack[-1].throw(error), None
+        except StopIteration:
+            request = _Return(None)
+        except Exception as e:
+            stack.pop()
+            if not stack:
+                raise
+            error = e
+            continue
+        value = None
+        if isinstance(request, _Return):
+            stack.pop()
+            if not stack:
+                yield request
+                return
+            value = request.value
+        elif isinstance(request, (_Read, _Size, _Yield)):
+            try:
+                value = yield request
+            except Exception as e:
+                error = e
+        else:
+            stack.append(request)
+
+
+def _iter_run(gen, read, get_size):
+    """
+    Run generator `gen` (see `_drive`), yielding what it gives out.
+
+    The file is read with `read(offset, size)`, and its size is taken from
+    `get_size()`. The result of `gen` is yielded last, as `_Return` (see
+    `_result`).
+    """
+    requests = _drive(gen)
+    value = error = None
+    while True:
+        if error is None:
+            request = requests.send(value)
+        else:
+            request, error = requests.throw(error), None
+        value = None
+        if isinstance(request, _Return):
+            yield request
+            return
+        elif isinstance(request, _Yield):
+            yield request.value
+        else:
+            try:
+                if isinstance(request, _Read):
+                    value = read(request.offset, request.size)
+                else:
+                    value = get_size()
+            except Exception as e:
+                error = e
+
+
+def _iter_run_file(gen, fp):
+    """
+    Run generator `gen` (see `_iter_run`) on a seekable file `fp`.
+
+    The position in `fp` is restored afterwards.
+    """
+    def read(offset, size):
+        fp.seek(offset)
+        return fp.read(size)
+
+    def get_size():
+        fp.seek(0, 2)
+        return fp.tell()
+
+    start = fp.tell()
+    try:
+        for value in _iter_run(gen, read, get_size):
+            yield value
+    finally:
+        fp.seek(start)
+
+
+def _iter_run_buffer(gen, buf):
+    """
+    Run generator `gen` (see `_iter_run`) on an object supporting buffer
+    protocol.
+    """
+    return _iter_run(
+        gen,
+        lambda offset, size: bytes(buf[offset:offset + size]),
+        lambda: len(buf),
+    )
+
+
+def _result(steps):
+    """
+    Return the result from `steps` (as yielded by `_iter_run`), ignoring the
+    yielded values.
+    """
+    result = None
+    for value in steps:
+        if isinstance(value, _Return):
+            result = value.value
+    return result
+
+
+def _yielded(steps):
+    """
+    Return list of the values yielded in `steps` (see `_iter_run`).
+    """
+    return [value for value in steps if not isinstance(value, _Return)]
+
+
+def _run_file(gen, fp):
+    """
+    Run generator `gen` (see `_iter_run_file`) and return its result.
+    """
+    return _result(_iter_run_file(gen, fp))
+
+
+def _run_buffer(gen, buf):
+    """
+    Run generator `gen` (see `_iter_run_buffer`) and return its result.
+    """
+    return _result(_iter_run_buffer(gen, buf))
+
+
+# How much compressed data of an object stream is read at once.
+_OBJECT_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _ObjectStream(object):
+    """
+    Object stream (`/Type /ObjStm`), decompressed lazily.
+
+    Only the data up to the end of the requested objects is decompressed, and
+    only as much of the compressed data as needed for that is read.
+
+    The methods that read the file are generators, as in `_PdfDocument`.
+    """
+
+    def __init__(self, dictionary, length, offset):
+        """
+        :param dictionary: The stream's dictionary.
+        :param length: The (resolved) length of the stream's data.
+        :param offset: The offset of the stream's data in the file.
+        """
+        filters = dictionary.get(b"Filter", list())
+        if not isinstance(filters, list):
+            filters = [filters]
+        if filters == [b"FlateDecode"] and not dictionary.get(b"DecodeParms"):
+            self.decompressor = zlib.decompressobj()
+        elif not filters:
+            self.decompressor = None
+        else:
+            raise PdfError(
+                "unsupported object stream filters: {!r}".format(filters),
+            )
+        self.first = dictionary[b"First"]
+        self.count = dictionary[b"N"]
+        self.length = length
+        self.offset = offset
+        # How much of the compressed data was read.
+        self.read_size = 0
+        self.data = b""
+        self.finished = False
+        # Object number -> (start, end) of the object's data, relative to
+        # `first`.
+        self.index = None
+
+    def _inflate(self, size):
+        """
+        Make sure that (at least) `size` bytes are decompressed, if there are
+        that many.
+        """
+        while len(self.data) < size and not self.finished:
+            if self.decompressor is not None and (
+                self.decompressor.unconsumed_tail
+            ):
+                chunk = self.decompressor.unconsumed_tail
+            elif self.read_size < self.length:
+                chunk = yield _Read(
+                    self.offset + self.read_size,
+                    min(
+                        _OBJECT_STREAM_CHUNK_SIZE,
+                        self.length - self.read_size,
+                    ),
+                )
+                if not chunk:
+                    raise PdfError("unexpected end of an object stream")
+                self.read_size += len(chunk)
+            else:
+                self.finished = True
+                break
+            if self.decompressor is None:
+                self.data += chunk
+            else:
+                self.data += self.decompressor.decompress(
+                    chunk, size - len(self.data),
+                )
+                if self.decompressor.unused_data:
+                    self.finished = True
+        yield _Return(None)
+
+    def load_index(self):
+        """
+        Return the dictionary of the object numbers and their positions.
+        """
+        if self.index is None:
+            yield self._inflate(self.first)
+            numbers = self.data[:self.first].split()
+            if len(numbers) < 2 * self.count:
+                raise PdfError("damaged object stream")
+            entries = sorted(
+                (int(offset), int(num))
+                for num, offset in zip(
+                    numbers[0:2 * self.count:2], numbers[1:2 * self.count:2],
+                )
+            )
+            ends = [offset for offset, _ in entries[1:]] + [None]
+            self.index = {
+                num: (offset, end)
+                for (offset, num), end in zip(entries, ends)
+            }
+        yield _Return(self.index)
+
+    def load(self, num):
+        """
+        Return the value of the object with the number `num`.
+        """
+        index = yield self.load_index()
+        if num not in index:
+            raise PdfError(
+                "object {} is not in the object stream".format(num),
+            )
+        start, end = index[num]
+        if end is None:
+            yield self._inflate(self.first + _MAX_OBJECT_SIZE)
+            end = len(self.data) - self.first
+        else:
+            yield self._inflate(self.first + end)
+        data = self.data[:self.first + end]
+        yield _Return(_Parser(data, self.first + start).value())
+
+
+# How many bytes from the end of the file to search for `startxref`.
+_TAIL_SIZE = 1024
+_MAX_OBJECT_SIZE = 64 * 1024**2
+_RE_STARTXREF = re.compile(br"startxref\s+(\d+)")
+_RE_XREF = re.compile(br"[\s\x00]*xref\b")
+_RE_XREF_SUBSECTION = re.compile(br"\s*(\d+)[ \t]+(\d+)[ \t]*\r?\n?")
+_RE_XREF_ENTRY = re.compile(br"(\d{10}) (\d{5}) ([nf])")
+_RE_TRAILER = re.compile(br"\s*trailer\b")
+
+
+class _PdfDocument(object):
+    """
+    Random-access reader of PDF's objects through its cross-reference data.
+
+    All the methods that need to read the file are generators to be run by
+    `_iter_run` (or one of its wrappers).
+    """
+
+    def __init__(self):
+        # Object number -> offset of the object (`None` for free objects), or
+        # `(object stream's number, index)` for the compressed objects.
+        self.xref = dict()
+        self.trailer = dict()
+        self.objects = dict()
+        self.object_streams = dict()
+
+    def _parse_at(self, offset, parse):
+        """
+        Return `parse(data, final)` for the data at `offset`.
+
+        More and more data is read while `parse` raises `_NeedMore`.
+        """
+        size = 1024
+        while True:
+            data = yield _Read(offset, size)
+            final = len(data) < size
+            try:
+                result = parse(data, final)
+            except _NeedMore:
+                if final or size >= _MAX_OBJECT_SIZE:
+                    raise PdfError("object at {} is too big".format(offset))
+                size *= 4
+            else:
+                yield _Return(result)
+                return
+
+    def load_xref(self):
+        """
+        Load the cross-reference data (tables and/or streams).
+        """
+        size = yield _Size()
+        tail_offset = max(0, size - _TAIL_SIZE)
+        tail = yield _Read(tail_offset, _TAIL_SIZE)
+        starts = _RE_STARTXREF.findall(tail)
+        if not starts:
+            raise PdfError("no startxref")
+        offsets = [int(starts[-1])]
+        seen = set()
+        while offsets:
+            offset = offsets.pop()
+            if offset in seen:
+                raise PdfError("a loop in the cross-reference sections")
+            seen.add(offset)
+            trailer = yield self._load_xref_section(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            # The newer sections take precedence, so `/Prev` goes after
+            # `/XRefStm` (which belongs to this section).
+            if b"Prev" in trailer:
+                offsets.append(trailer[b"Prev"])
+            if b"XRefStm" in trailer:
+                offsets.append(trailer[b"XRefStm"])
+        if b"Root" not in self.trailer:
+            raise PdfError("no /Root in the trailer")
+        yield _Return(None)
+
+    def _load_xref_section(self, offset):
+        """
+        Load one cross-reference table or stream and return its trailer.
+        """
+        data = yield _Read(offset, 1024)
+        m = _RE_XREF.match(data)
+        if m is None:
+            result = yield self._load_xref_stream(offset)
+            yield _Return(result)
+            return
+        pos = m.end()
+        while True:
+            m = _RE_XREF_SUBSECTION.match(data, pos)
+            if m is None:
+                break
+            start, count = int(m.group(1)), int(m.group(2))
+            pos = m.end()
+            # Each entry is exactly 20 bytes long. Read them all at once,
+            # along with a bit more for whatever comes after them.
+            entries_size = 20 * count
+            if len(data) - pos < entries_size + _TAIL_SIZE:
+                offset += pos
+                data = yield _Read(offset, entries_size + _TAIL_SIZE)
+                pos = 0
+            entries = _RE_XREF_ENTRY.findall(data, pos, pos + entries_size)
+            if len(entries) != count:
+                raise PdfError("damaged cross-reference table")
+            for num, (entry_offset, _, kind) in enumerate(entries, start):
+                if num not in self.xref:
+                    self.xref[num] = (
+                        int(entry_offset) if kind == b"n" else None
+                    )
+            pos += entries_size
+        m = _RE_TRAILER.match(data, pos)
+        if m is None:
+            raise PdfError("no trailer after the cross-reference table")
+        trailer = yield self._parse_at(
+            offset + m.end(),
+            lambda data, final: _Parser(data, 0, final).value(),
+        )
+        if not isinstance(trailer, dict):
+            raise PdfError("the trailer is not a dictionary")
+        yield _Return(trailer)
+
+    def _load_xref_stream(self, offset):
+        """
+        Load a cross-reference stream and return its dictionary.
+        """
+        num, _, dictionary, stream = yield self._parse_at(
+            offset, _parse_indirect,
+        )
+        if (
+            not isinstance(dictionary, dict)
+            or dictionary.get(b"Type") != b"XRef"
+            or stream is None
+        ):
+            raise PdfError("no cross-reference at {}".format(offset))
+        length = dictionary.get(b"Length")
+        if not isinstance(length, int):
+            raise PdfError("invalid length of the cross-reference stream")
+        data = yield _Read(offset + stream, length)
+        data = bytearray(_decode_stream(data, dictionary))
+        widths = dictionary[b"W"]
+        index = dictionary.get(b"Index", [0, dictionary[b"Size"]])
+        row_size = sum(widths)
+        pos = 0
+        for start, count in zip(index[0::2], index[1::2]):
+            for num in range(start, start + count):
+                if pos + row_size > len(data):
+                    raise PdfError("damaged cross-reference stream")
+                fields = list()
+                for width in widths:
+                    value = 0
+                    for byte in data[pos:pos + width]:
+                        value = value << 8 | byte
+                    fields.append(value)
+                    pos += width
+                kind = fields[0] if widths[0] else 1
+                if num not in self.xref:
+                    if kind == 1:
+                        self.xref[num] = fields[1]
+                    elif kind == 2:
+                        # Compressed object: `(stream's number, index)`.
+                        self.xref[num] = (fields[1], fields[2])
+                    else:
+                        self.xref[num] = None
+        yield _Return(dictionary)
+
+    def load(self, ref):
+        """
+        Return the value of the object referenced by `ref`.
+        """
+        if ref in self.objects:
+            yield _Return(self.objects[ref])
+            return
+        offset = self.xref.get(ref.num)
+        if offset is None:
+            raise PdfError("object {} is not in the file".format(ref.num))
+        if isinstance(offset, tuple):
+            object_stream = yield self.object_stream(offset[0])
+            value = yield object_stream.load(ref.num)
+        else:
+            num, _, value, _ = yield self._parse_at(offset, _parse_indirect)
+            if num != ref.num:
+                raise PdfError(
+                    "object {} is not where it should be".format(ref.num),
+                )
+        self.objects[ref] = value
+        yield _Return(value)
+
+    def object_stream(self, num, offset=None):
+        """
+        Return `_ObjectStream` for the object stream with the number `num`.
+
+        :param offset: The offset of the object stream in the file, if it is
+            not in the cross-reference data.
+        """
+        if num not in self.object_streams:
+            if offset is None:
+                offset = self.xref.get(num)
+            if not isinstance(offset, int):
+                raise PdfError("object stream {} not found".format(num))
+            found_num, _, dictionary, stream = yield self._parse_at(
+                offset, _parse_indirect,
+            )
+            if (
+                found_num != num
+                or not isinstance(dictionary, dict)
+                or dictionary.get(b"Type") != b"ObjStm"
+                or stream is None
+            ):
+                raise PdfError("object stream {} not found".format(num))
+            length = yield self.resolve(dictionary.get(b"Length"))
+            if not isinstance(length, int):
+                raise PdfError("invalid length of an object stream")
+            self.object_streams[num] = _ObjectStream(
+                dictionary, length, offset + stream,
+            )
+        yield _Return(self.object_streams[num])
+
+    def complete_page_tree(self, scanner):
+        """
+        Add the page tree's objects that `scanner` didn't find to it, taking
+        them from the object streams.
+
+        The object streams that contain them are found through the
+        cross-reference data or, if that's not available, through the headers
+        of the object streams found by `scanner` (which are only decompressed
+        as far as their headers go, unless they have the wanted objects).
+        """
+        tried = set()
+        located = None
+        while True:
+            wanted = scanner.missing_objects() - tried
+            if not wanted:
+                break
+            for ref in sorted(wanted):
+                tried.add(ref)
+                entry = self.xref.get(ref[0])
+                if isinstance(entry, tuple):
+                    stream_num = entry[0]
+                else:
+                    if located is None:
+                        located = dict()
+                        for num, offset in sorted(
+                            scanner.object_streams.items(),
+                        ):
+                            object_stream = yield self.object_stream(
+                                num, offset,
+                            )
+                            index = yield object_stream.load_index()
+                            for obj_num in index:
+                                located.setdefault(obj_num, num)
+                    stream_num = located.get(ref[0])
+                    if stream_num is None:
+                        continue
+                object_stream = yield self.object_stream(
+                    stream_num, scanner.object_streams.get(stream_num),
+                )
+                value = yield object_stream.load(ref[0])
+                scanner.add_object(ref, value)
+        yield _Return(None)
+
+    def resolve(self, value):
+        """
+        Return `value`, loaded first if it is a reference.
+        """
+        if isinstance(value, _Ref):
+            value = yield self.load(value)
+        yield _Return(value)
+
+    def load_node(self, ref):
+        """
+        Return the page tree's node referenced by `ref`.
+        """
+        if not isinstance(ref, _Ref):
+            raise PdfError("invalid page tree")
+        node = yield self.load(ref)
+        if not isinstance(node, dict):
+            raise PdfError("invalid page tree")
+        yield _Return(node)
+
+    def node_attributes(self, node, inherited):
+        """
+        Return the effective attributes of the page tree's `node` (see
+        `_inherit`).
+        """
+        own = dict()
+        for key in _INHERITABLE + (b"UserUnit",):
+            if key in node:
+                own[key] = yield self.resolve(node[key])
+        yield _Return(_inherit(inherited, own))
+
+    def load_root(self):
+        """
+        Return the reference to the root of the page tree and its node.
+        """
+        yield self.load_xref()
+        catalog = yield self.resolve(self.trailer[b"Root"])
+        ref = catalog[b"Pages"]
+        node = yield self.load_node(ref)
+        yield _Return((ref, node))
+
+    def pages_geometry(self, units):
+        """
+        Give out `PageGeometry` of each page with `_Yield`, as soon as it is
+        read (see `pdf_pages_geometry`).
+        """
+        root, node = yield self.load_root()
+        seen = set()
+        # The tree is walked in order, top-down, with an explicit stack of
+        # `(ref, the effective attributes of its parent)`.
+        stack = [(root, _ROOT_ATTRIBUTES)]
+        while stack:
+            ref, inherited = stack.pop()
+            if ref in seen:
+                _warn("cycle in the page tree at object {}".format(tuple(ref)))
+                continue
+            seen.add(ref)
+            if ref != root:
+                node = yield self.load_node(ref)
+            attributes = yield self.node_attributes(node, inherited)
+            if _is_pages_node(node):
+                kids = yield self.resolve(node[b"Kids"])
+                stack.extend(
+                    (kid, attributes) for kid in reversed(kids)
+                )
+            else:
+                yield _Yield(_page_geometry(attributes, units))
+        yield _Return(None)
+
+    def page_geometry(self, index, units):
+        """
+        Return `PageGeometry` of the page with the (zero-based) `index`.
+
+        Only the nodes on the path to the page and their kids are read, as the
+        subtrees before the page are skipped using their `/Count`.
+        """
+        ref, node = yield self.load_root()
+        if index < 0:
+            index += yield self.resolve(node[b"Count"])
+            if index < 0:
+                raise IndexError("page index out of range")
+        seen = set()
+        attributes = _ROOT_ATTRIBUTES
+        while True:
+            if ref in seen:
+                raise PdfError("invalid page tree")
+            seen.add(ref)
+            attributes = yield self.node_attributes(node, attributes)
+            if not _is_pages_node(node):
+                if index:
+                    raise PdfError("invalid page tree")
+                yield _Return(_page_geometry(attributes, units))
+            kids = yield self.resolve(node[b"Kids"])
+            for ref in kids:
+                node = yield self.load_node(ref)
+                if _is_pages_node(node):
+                    count = yield self.resolve(node[b"Count"])
+                else:
+                    count = 1
+                if index < count:
+                    break
+                index -= count
+            else:
+                raise IndexError("page index out of range")
+
+
+def _is_pages_node(node):
+    """
+    Return `True` if `node` is an inner node of the page tree (i.e., not a
+    page).
+    """
+    return node.get(b"Type") == b"Pages" or b"Kids" in node
+
+
+# Errors on which the scanning falls back from the cross-reference data to the
+# linear scan.
+_XREF_ERRORS = (ValueError, LookupError, TypeError, zlib.error)
+
+
+def _xref_resolver(doc, run, source):
+    """
+    Return a function that loads objects through `doc`'s cross-references.
+
+    The function takes a reference and returns the object's value, or `None`
+    if it cannot be loaded. `run` is `_run_file` or `_run_buffer` to run the
+    loading on `source`.
+
+    If `doc` has no cross-reference data, `None` is returned instead.
+    """
+    if doc is None or not doc.xref:
+        return None
+
+    def resolve(ref):
+        try:
+            return run(doc.load(_Ref(*ref)), source)
+        except _XREF_ERRORS:
+            return None
+
+    return resolve
+
+
+def _complete_page_tree(scanner, doc, run, source):
+    """
+    Add the page tree's objects that are in object streams to `scanner`.
+
+    `doc` is `_PdfDocument` with the cross-reference data (or `None`), and
+    `run` is `_run_file` or `_run_buffer` to run the loading on `source`.
+    """
+    if not scanner.missing_objects():
+        return
+    if doc is None:
+        doc = _PdfDocument()
+    try:
+        run(doc.complete_page_tree(scanner), source)
+    except _XREF_ERRORS:
+        pass
+
+
+def _is_seekable(fp):
+    """
+    Return `True` if `fp` supports random access.
+    """
+    try:
+        return fp.seekable()
+    except AttributeError:
+        # Python 2 files don't have `seekable`.
+        try:
+            fp.seek(fp.tell())
+        except (AttributeError, IOError, OSError):
+            return False
+        return True
+
+
+def pdf_pages_sizes(fp, chunk_size=1024**2, units="px", use_xref=True):
+    """
+    Return list of sizes for PDF in stream `fp` (open file, `BytesIO`, etc).
+
+    The sizes are those of the pages' MediaBoxes, ignoring their rotation. For
+    the sizes of the pages as displayed, see `pdf_pages_geometry`.
+
+    If `fp` is seekable, only the objects needed for the page tree are read,
+    using the file's cross-reference data. If that fails (for example,
+    because the cross-reference data is damaged), or if `use_xref` is not set,
+    the whole file is scanned.
 
     :param chunk_size: The size of the chunks to be read from the file.
         Shouldn't be too small (at least 10 or so). Smaller will usually mean
@@ -66,217 +1577,714 @@ def pdf_pages_sizes(fp, chunk_size=1024**2, units="px"):
     :param units: A string describing in which units should the result be
         returned. Possible values: `"px"` (the default), `"in"`, `"mm"`,
         `"cm"`.
+    :param use_xref: If set (the default), the cross-reference data is used
+        when possible, instead of scanning the whole file.
     :return: List of `(width, height)` tuples, each corresponding to one page.
         The values are given in the unit corresponding with the `units`
         parameter.
     """
-    # Debug print
-    def print_data():
-        print({k: v for k, v in data.items() if k != "text"})
-    # Get page size for a given reference
-    def get_mediabox(ref):
-        supported_units = {
-            "px": 1, "in": 1.0 / 72, "mm": 25.4 / 72, "cm": 2.54 / 72,
-        }
-        mediabox = data["mediaboxes"][ref]
-        unit_factor = supported_units[units]
-        while ref:
-            unit_factor *= data["units"].get(ref, 1)
-            ref = data["parents"].get(ref)
-        return tuple(value * unit_factor for value in mediabox[2:])
-    # Functions to handle recognised PDF entities
-    def obj(m):
-        if data["depth"] == 0:
-            data["ref"] = _ref_m_to_tuple(m)
-    def start(m):
-        data["depth"] += 1
-    def object_type(m):
-        if data["depth"] == 1:
-            data["type"] = m.group("type")
-    def mediabox(m):
-        data["mediabox"] = tuple(
-            _str_to_num(d) for d in re.split(r"\s+", m.group("size"))
-        )
-    def end(m):
-        data["depth"] -= 1
-        assert data["depth"] >= 0
-        if data["depth"] == 0:
-            if data["ref"]:
-                if data["type"] == "Page" and data["mediabox"]:
-                    data["mediaboxes"][data["ref"]] = data["mediabox"]
-                elif data["type"] == "Pages" and data["kids"]:
-                    data["pages"][data["ref"]] = data["kids"]
-            data["ref"] = None
-            data["type"] = None
-            data["mediabox"] = None
-            data["kids"] = list()
-    def stream(m):
-        data["in_stream"] = True
-    def endstream(m):
-        data["in_stream"] = False
-        data["needs_fresh_pos"] = True
-    def kids(m):
-        assert not data["kids"]
-        kids_list = re.split(r"\s+", m.group("kids"))
-        new_kids = [
-            (int(m), int(n)) for m, n in zip(kids_list[0::3], kids_list[1::3])
-        ]
-        data["kids"].extend(new_kids)
-        if data["ref"] is not None:
-            data["parents"].update({kid: data["ref"] for kid in new_kids})
-    def parent(m):
-        assert data["ref"] is not None
-        data["parents"][data["ref"]] = _ref_m_to_tuple(m)
-    def userunit(m):
-        if data["depth"] == 1 and data["ref"]:
-            data["units"][data["ref"]] = _str_to_num(m.group("unit"))
-
-    # Regx Strings (subexpressions to use):
-    rs_one_to_list = r"{fmt}(?:\s+{fmt})*"
-    rs_ref = r"\d+\s+\d+\s+R"
-    rs_refs = rs_one_to_list.format(fmt=rs_ref)
-    rs_nref = r"(?P<m>\d+)\s+(?P<n>\d+)\s+R"  # TODO \b
-    rs_float = r"(?:\b\d+(?:\.\d*)?|\.\d+\b)"
-    rs_floats = rs_one_to_list.format(fmt=rs_float)
-
-    # What to search for -> the function to handle it.
-    searches = {
-        r"(?P<m>\d+)\s+(?P<n>\d+)\s+obj\b": obj,
-        r"<<": start,
-        r"/Type\s*/(?P<type>\w+)": object_type,
-        r"/MediaBox\s*\[\s*(?P<size>" + rs_floats + r")\s*\]": mediabox,
-        r">>": end,
-        r"\bstream\b": stream,
-        r"\bendstream\b": endstream,
-        r"/Kids\s*\[\s*(?P<kids>" + rs_refs + r")\s*\]": kids,
-        r"/Parent\s+" + rs_nref: parent,
-        r"/UserUnit\s*(?P<unit>" + rs_float + r")": userunit,
-    }
-    # re has caching, but this allows us to use `pos` argument with `search`,
-    # which gives a nice speed improvement over cropping the text all the time.
-    compiled_searches = {restr: re.compile(restr) for restr in searches}
-
-    # Initial data; we could use normal variables and `nonlocal` instead,
-    # but this seemed neater and it is compatible with Python 2, which is
-    # where I need this module (a legacy project).
-    data = {
-        "depth": 0,
-        "in_stream": False,
-        "kids": list(),
-        "mediabox": None,
-        "mediaboxes": dict(),
-        "needs_fresh_pos": True,
-        "pages": dict(),
-        "parents": dict(),
-        "ref": None,
-        "text": "",
-        "type": None,
-        "units": dict(),
-    }
+    return list(iter_pdf_pages_sizes(fp, chunk_size, units, use_xref))
+
+
+def iter_pdf_pages_sizes(fp, chunk_size=1024**2, units="px", use_xref=True):
+    """
+    Yield sizes for PDF in stream `fp`, as soon as they are known.
+
+    The arguments and the sizes are as in `pdf_pages_sizes`. See
+    `iter_pdf_pages_geometry` for when the sizes become known.
+    """
+    for geometry in iter_pdf_pages_geometry(fp, chunk_size, units, use_xref):
+        yield _mediabox_size(geometry, units)
+
+
+def pdf_pages_geometry(fp, chunk_size=1024**2, units="px", use_xref=True):
+    """
+    Return list of `PageGeometry` for PDF in stream `fp`.
+
+    The inherited attributes (MediaBox, CropBox, Rotate) are resolved in a
+    single pass through the pages tree.
+
+    :param chunk_size: As in `pdf_pages_sizes`.
+    :param units: As in `pdf_pages_sizes` (used for `PageGeometry.size`).
+    :param use_xref: As in `pdf_pages_sizes`.
+    :return: List of `PageGeometry`, each corresponding to one page.
+    """
+    return list(iter_pdf_pages_geometry(fp, chunk_size, units, use_xref))
+
+
+def iter_pdf_pages_geometry(
+    fp, chunk_size=1024**2, units="px", use_xref=True,
+):
+    """
+    Yield `PageGeometry` for PDF in stream `fp`, as soon as it is known.
+
+    With the cross-reference data, each page is yielded as soon as its object
+    is read. When the whole file is scanned, the pages of linearized files are
+    yielded as soon as they and all the nodes of the page tree before them
+    are found (so the first page comes right at the start of the file); for
+    other files, they are all yielded at the end.
+
+    The arguments and the values are as in `pdf_pages_geometry`.
+    """
+    _UNITS_FACTORS[units]
+    seekable = _is_seekable(fp)
+    doc = None
+    # How many pages were yielded before falling back to the linear scan.
+    done = 0
+    if use_xref and seekable:
+        doc = _PdfDocument()
+        steps = _iter_run_file(doc.pages_geometry(units), fp)
+        while True:
+            try:
+                geometry = next(steps)
+            except _XREF_ERRORS:
+                break
+            if isinstance(geometry, _Return):
+                return
+            yield geometry
+            done += 1
+
+    for geometry in _iter_scan(fp, chunk_size, units, doc, seekable):
+        if done:
+            done -= 1
+        else:
+            yield geometry
+
+
+def page_size(fp, index, chunk_size=1024**2, units="px", use_xref=True):
+    """
+    Return the size of the page with the (zero-based) `index` in PDF in
+    stream `fp`.
+
+    The size is as in `pdf_pages_sizes`. See `page_geometry` for the
+    arguments.
+    """
+    return _mediabox_size(
+        page_geometry(fp, index, chunk_size, units, use_xref), units,
+    )
+
+
+def page_geometry(fp, index, chunk_size=1024**2, units="px", use_xref=True):
+    """
+    Return `PageGeometry` of the page with the (zero-based) `index` in PDF in
+    stream `fp`.
+
+    If `fp` is seekable, only the objects on the way to the page in the page
+    tree are read, using the file's cross-reference data. Otherwise, the file
+    is scanned only as far as needed to get the page (to the end, for the
+    negative indices).
+
+    :param index: The index of the page. Negative values count from the end.
+    :param chunk_size: As in `pdf_pages_sizes`.
+    :param units: As in `pdf_pages_sizes`.
+    :param use_xref: As in `pdf_pages_sizes`.
+    :raise IndexError: If there is no page with the `index`.
+    """
+    _UNITS_FACTORS[units]
+    seekable = _is_seekable(fp)
+    doc = None
+    if use_xref and seekable:
+        doc = _PdfDocument()
+        try:
+            return _run_file(doc.page_geometry(index, units), fp)
+        except _XREF_ERRORS:
+            pass
+    pages = _iter_scan(fp, chunk_size, units, doc, seekable)
+    if index < 0:
+        pages = list(pages)
+        if index < -len(pages):
+            raise IndexError("page index out of range")
+        return pages[index]
+    for geometry in pages:
+        if not index:
+            return geometry
+        index -= 1
+    raise IndexError("page index out of range")
+
+
+def _iter_scan(fp, chunk_size, units, doc, seekable):
+    """
+    Yield `PageGeometry` for PDF in stream `fp`, scanned linearly.
+
+    :param doc: `_PdfDocument` with the cross-reference data (if any),
+        used to resolve the indirect lengths of streams.
+    :param seekable: `True` if `fp` supports random access.
+    """
+    def read(offset, size):
+        if offset is not None:
+            fp.seek(offset)
+        return fp.read(size)
+
+    def get_size():
+        fp.seek(0, 2)
+        return fp.tell()
+
+    steps = _scan_steps(
+        chunk_size, units, doc, seekable, fp.tell() if seekable else 0,
+        _xref_resolver(doc, _run_file, fp),
+    )
+    for value in _iter_run(steps, read, get_size):
+        if not isinstance(value, _Return):
+            yield value
+
+
+def _scan_steps(chunk_size, units, doc, seekable, start=0, resolve=None):
+    """
+    Scan PDF linearly, giving out `PageGeometry` of its pages with `_Yield`.
+
+    This is a generator to be run by `_drive`. The file is read in chunks,
+    from `start` on. If it's not `seekable`, it is read sequentially (with the
+    offsets of `_Read` set to `None`), the data of the streams cannot be
+    skipped, and `PdfError` is raised if the page tree isn't all found (as
+    its objects in the object streams cannot be read).
+
+    :param doc: `_PdfDocument` with the cross-reference data (if any), used
+        to get the page tree's objects from the object streams.
+    :param resolve: As in `_PdfScanner`.
+    """
+    scanner = _PdfScanner(resolve)
 
     # Read and analyze the PDF.
-    old_chunk = ""
+    # `pos` is the position in the file of the end of `text`.
+    pos = start
+    text = old_chunk = b""
     while True:
         # Read the next chunk and add it to the current text.
-        chunk = fp.read(chunk_size)
+        chunk = yield _Read(pos if seekable else None, chunk_size)
         if not chunk:
             break
-        chunk = chunk.decode("latin-1")
-        data["text"] = old_chunk + chunk
-
-        # Chip those elements away, until none are left.
-        pos = dict()
-        offset = 0
-        data["needs_fresh_pos"] = True
-        while data["needs_fresh_pos"] or pos:
-            # Find all the elements that we recognise.
-            if data["needs_fresh_pos"]:
-                pos = {
-                    restr: match
-                    for restr, match in (
-                        (
-                            restr,
-                            compiled_searches[restr].search(
-                                data["text"], pos=offset,
-                            ),
-                        )
-                        for restr in searches.keys()
-                        if (
-                            not data["in_stream"]
-                            or searches[restr].__name__ == "endstream"
-                        )
-                    )
-                    if match
-                }
-                if not pos:
-                    break
-                data["needs_fresh_pos"] = False
-
-            # Get the leftmost matched element.
-            restr, match = min(pos.items(), key=lambda it: it[1].start())
+        pos += len(chunk)
+        text = old_chunk + chunk
+        offset = scanner.scan(text, final=False, base=pos - len(text))
+        for geometry in scanner.geometry(units, final=False):
+            yield _Yield(geometry)
 
-            # Process it...
-            func = searches[restr]
-            if not data["in_stream"] or func.__name__ == "endstream":
-                # ...but only if not in stream or is a keyword that ends
-                # streams.
-                func(match)
-
-            # Reset the offset (to ignore the processed part of the text).
-            offset = match.end()
-
-            # Find the next `restr` element and update the dictionary of
-            # found elements.
-            if not data["needs_fresh_pos"]:
-                match = compiled_searches[restr].search(
-                    data["text"], pos=offset,
+        # Skip the data of a stream, if we know where it ends.
+        if scanner.skip_to is not None:
+            target = pos - len(text) + scanner.skip_to
+            scanner.skip_to = None
+            if seekable:
+                stream_end = scanner.end_stream_at(
+                    (yield _Read(target, _STREAM_END_SIZE)),
+                    0,
+                    _STREAM_END_SIZE,
                 )
-                if match:
-                    pos[restr] = match
-                else:
-                    pos.pop(restr)
+                if stream_end is not None:
+                    pos = target + stream_end
+                    text = old_chunk = b""
+                    continue
+            else:
+                # The data of the stream has to be read, but it isn't
+                # searched (it might contain anything, even `endstream`).
+                text = (
+                    text[len(text) - (pos - target):] if target < pos else b""
+                )
+                while pos < target + _STREAM_END_SIZE:
+                    chunk = yield _Read(None, chunk_size)
+                    if not chunk:
+                        break
+                    pos += len(chunk)
+                    if pos > target:
+                        text += chunk[max(len(chunk) - (pos - target), 0):]
+                # If the length is wrong, `endstream` is searched for in the
+                # rest of the file.
+                stream_end = scanner.end_stream_at(text, 0, _STREAM_END_SIZE)
+                text = old_chunk = text[stream_end or 0:]
+                continue
 
         # Remove unneeded text.
         # This is the reason why chunk_size shouldn't be too small. Basically,
         # it must be bigger than the length of anything (except the `/Kids`
         # element) that we can find.
         if offset:
-            data["text"] = data["text"][offset:]
+            text = text[offset:]
         old_chunk = (
-            data["text"]
-            if "/Kids" in data["text"] else
-            data["text"] if len(data["text"]) < len(chunk) else chunk
+            text
+            if b"/Kids" in text else
+            text if len(text) < len(chunk) else chunk
+        )
+    # Process whatever was left for the text that might have followed.
+    scanner.scan(text, base=pos - len(text))
+
+    missing = scanner.missing_objects()
+    if missing and not seekable:
+        # They might be in object streams, but those can only be read by
+        # seeking back to them.
+        raise PdfError(
+            "{} object(s) of the page tree not found (they might be in object"
+            " streams, which need a seekable input)".format(len(missing)),
+        )
+    if missing:
+        try:
+            yield (doc or _PdfDocument()).complete_page_tree(scanner)
+        except _XREF_ERRORS:
+            pass
+    for geometry in scanner.geometry(units):
+        yield _Yield(geometry)
+    yield _Return(None)
+
+
+def pdf_pages_sizes_mmap(
+    source, chunk_size=1024**2, units="px", use_xref=True,
+):
+    """
+    Return list of sizes for PDF in `source`, scanned without copying.
+
+    This is the fastest way to handle huge files. Instead of reading them in
+    chunks, the whole file is memory mapped and searched directly, so there is
+    no decoding and no joining of the chunks, and the memory consumption
+    doesn't depend on the size of the file (the mapped pages are managed by
+    the operating system).
+
+    :param source: A file name, an open file (with a real file descriptor), or
+        any other object supporting the buffer protocol (`bytes`, `mmap`,
+        etc). Note that, in Python 2, `str` is always taken as a file name.
+    :param chunk_size: The size of the windows of the data in which the
+        elements are searched for. These are not copied, so this only limits
+        how far each search can go.
+    :param units: As in `pdf_pages_sizes`.
+    :param use_xref: As in `pdf_pages_sizes`.
+    :return: As in `pdf_pages_sizes`.
+    """
+    return [
+        _mediabox_size(geometry, units)
+        for geometry in pdf_pages_geometry_mmap(
+            source, chunk_size, units, use_xref,
+        )
+    ]
+
+
+def pdf_pages_geometry_mmap(
+    source, chunk_size=1024**2, units="px", use_xref=True,
+):
+    """
+    Return list of `PageGeometry` for PDF in `source`, scanned without copying.
+
+    The arguments are as in `pdf_pages_sizes_mmap`, and the result as in
+    `pdf_pages_geometry`.
+    """
+    if isinstance(source, (str, type(u""))):
+        with open(source, "rb") as f:
+            return pdf_pages_geometry_mmap(f, chunk_size, units, use_xref)
+    _UNITS_FACTORS[units]
+    doc = None
+    if use_xref:
+        # For files, the cross-reference data needs only a few small reads,
+        # for which the file itself is better than a memory map (touching a
+        # mapped file can make the system map much more than what is used).
+        doc = _PdfDocument()
+        try:
+            if hasattr(source, "fileno"):
+                return _yielded(
+                    _iter_run_file(doc.pages_geometry(units), source),
+                )
+            return _yielded(
+                _iter_run_buffer(doc.pages_geometry(units), source),
+            )
+        except _XREF_ERRORS:
+            pass
+    if hasattr(source, "fileno"):
+        try:
+            buf = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            buf = b""
+        try:
+            return _scan_buffer(buf, chunk_size, units, doc)
+        finally:
+            if buf:
+                buf.close()
+    return _scan_buffer(source, chunk_size, units, doc)
+
+
+def _scan_buffer(buf, chunk_size, units, doc):
+    """
+    Return list of `PageGeometry` for PDF in `buf`, scanned linearly.
+
+    :param doc: `_PdfDocument` with the cross-reference data (if any),
+        used to resolve the indirect lengths of streams.
+    """
+    # Memory maps can tell the system that the pages we're done with can be
+    # dropped from the memory (Python 3.8+).
+    madvise = getattr(buf, "madvise", None)
+    if madvise is not None:
+        madvise(mmap.MADV_SEQUENTIAL)
+    released = 0
+    scanner = _PdfScanner(_xref_resolver(doc, _run_buffer, buf))
+    size = len(buf)
+    offset = end = 0
+    while end < size:
+        end = min(end + chunk_size, size)
+        offset = scanner.scan(buf, offset, end, final=end == size)
+        # Skip the data of a stream, if we know where it ends.
+        if scanner.skip_to is not None:
+            target = scanner.skip_to
+            scanner.skip_to = None
+            stream_end = scanner.end_stream_at(
+                buf, target, min(size, target + _STREAM_END_SIZE),
+            )
+            if stream_end is not None:
+                offset = end = stream_end
+        # Like in `pdf_pages_sizes`, don't search through more than the last
+        # window again, unless it might be needed for a long `/Kids` list.
+        if end - offset > chunk_size and not _RE_KIDS.search(
+            buf, offset, end,
+        ):
+            offset = end - chunk_size
+        if madvise is not None:
+            release_to = offset - offset % mmap.PAGESIZE
+            if release_to > released:
+                madvise(mmap.MADV_DONTNEED, released, release_to - released)
+                released = release_to
+    _complete_page_tree(scanner, doc, _run_buffer, buf)
+    return scanner.geometry(units)
+
+
+# The result of scanning one file in `scan_pdf_files`:
+# * `path`: the absolute path of the file,
+# * `sizes`: the list of the pages' sizes (as in `pdf_pages_sizes`), or `None`
+#   if the file couldn't be scanned,
+# * `error`: the description of the error if the file couldn't be scanned, or
+#   `None`,
+# * `cached`: `True` if the result was taken from the cache.
+BatchResult = namedtuple("BatchResult", ("path", "sizes", "error", "cached"))
+
+# What identifies the scanned contents of a file in `PdfSizesCache`. The hash
+# is `None` if it's not used.
+_FileKey = namedtuple("_FileKey", ("path", "size", "mtime", "hash"))
+
+# How many results are written to the cache between the commits.
+_CACHE_COMMIT_EVERY = 100
+# The version of the cached results, increased whenever the scanning changes
+# in a way that makes the old results wrong (e.g., the files that are not
+# PDFs used to give no pages, and now they give errors).
+_CACHE_VERSION = 2
+
+
+class PdfSizesCache(object):
+    """
+    Persistent cache of the pages' sizes of the scanned files, in SQLite.
+
+    The results are stored in pixels, per file, and they are valid as long as
+    the file's size, modification time, and (if used) contents' hash are the
+    same as when it was scanned (and the cache was written by the same
+    version of the scanner; the older results are dropped).
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != _CACHE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS pdf_sizes")
+            self.connection.execute(
+                "PRAGMA user_version = {}".format(_CACHE_VERSION),
+            )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_sizes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime NUMERIC NOT NULL,"
+            " hash TEXT,"
+            " sizes TEXT,"
+            " error TEXT"
+            ")",
+        )
+        self.uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, key):
+        """
+        Return `(sizes, error)` cached for the `_FileKey` `key`, or `None`.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime, hash, sizes, error FROM pdf_sizes"
+            " WHERE path = ?",
+            (key.path,),
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (key.size, key.mtime, key.hash):
+            return None
+        sizes = None if row[3] is None else [
+            tuple(size) for size in json.loads(row[3])
+        ]
+        return sizes, row[4]
+
+    def put(self, key, sizes, error):
+        """
+        Store the result of scanning the file identified by `_FileKey` `key`.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pdf_sizes"
+            " (path, size, mtime, hash, sizes, error)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key.path, key.size, key.mtime, key.hash,
+                None if sizes is None else json.dumps(sizes),
+                error,
+            ),
         )
+        self.uncommitted += 1
+        if self.uncommitted >= _CACHE_COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """
+        Write the stored results to the disk.
+        """
+        self.connection.commit()
+        self.uncommitted = 0
 
-    # Order the pages, get their sizes and return those as a list.
-    pages = _pages_tree_to_list(data["pages"])
-    assert len(pages) == len(data["mediaboxes"])
-    return [get_mediabox(ref) for ref in pages]
+    def close(self):
+        """
+        Commit the stored results and close the cache.
+        """
+        self.commit()
+        self.connection.close()
 
 
-if __name__ == "__main__":
+def _iter_pdf_paths(paths):
+    """
+    Yield the absolute paths of the files in `paths`, with the directories
+    replaced by the PDFs in them (recursively).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith(".pdf"):
+                        yield os.path.abspath(
+                            os.path.join(dir_path, file_name),
+                        )
+        else:
+            yield os.path.abspath(path)
+
+
+def _file_key(args):
+    """
+    Return `(path, _FileKey or None, error or None)` for `args` given as
+    `(path, use_hash)`.
+
+    This is run in threads, as it's mostly waiting for the disk.
+    """
+    path, use_hash = args
+    try:
+        stat = os.stat(path)
+        content_hash = None
+        if use_hash:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024**2), b""):
+                    digest.update(chunk)
+            content_hash = digest.hexdigest()
+    except (IOError, OSError) as e:
+        return path, None, str(e)
+    mtime = getattr(stat, "st_mtime_ns", stat.st_mtime)
+    return path, _FileKey(path, stat.st_size, mtime, content_hash), None
+
+
+def _scan_file(path):
+    """
+    Return `(sizes in pixels or None, error or None)` for PDF file `path`.
+
+    This is run in the worker processes.
+    """
+    try:
+        return [list(size) for size in pdf_pages_sizes_mmap(path)], None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def scan_pdf_files(
+    paths, units="px", cache=None, use_hash=False, processes=None, threads=4,
+):
+    """
+    Yield `BatchResult` for each PDF in `paths`, in the order of completion.
+
+    The files are checked (and, if `use_hash` is set, hashed) in a pool of
+    `threads` threads, as that is mostly waiting for the disk, while the
+    scanning itself is done in a pool of `processes` processes (by default,
+    as many as there are CPUs). Only a few files per process are given to the
+    pool at a time, so that the files that are not scanned yet don't pile up
+    in it.
+
+    :param paths: The paths of the files and directories (which are searched
+        recursively for the `*.pdf` files).
+    :param units: As in `pdf_pages_sizes`.
+    :param cache: `PdfSizesCache` to take the results from (for the files
+        that didn't change since they were scanned) and to store them in.
+    :param use_hash: If set, the files' contents' hashes are also used to
+        check if the files changed.
+    """
+    unit_factor = _UNITS_FACTORS[units]
+
+    def batch_result(key, sizes, error, cached):
+        if sizes is not None:
+            sizes = [
+                (width * unit_factor, height * unit_factor)
+                for width, height in sizes
+            ]
+        return BatchResult(key.path, sizes, error, cached)
+
+    def scan(path, key):
+        def put(result):
+            done.put((key, result))
+
+        kwargs = {"callback": put}
+        if sys.version_info[0] >= 3:
+            # Failures of the pool itself (e.g., when a worker dies) are only
+            # reported this way in Python 3; without it, they'd leave us
+            # waiting for the file forever.
+            kwargs["error_callback"] = put
+        process_pool.apply_async(_scan_file, (path,), **kwargs)
+
+    def scanned(item):
+        key, result = item
+        if isinstance(result, BaseException):
+            raise result
+        sizes, error = result
+        if cache is not None:
+            cache.put(key, sizes, error)
+        return batch_result(key, sizes, error, False)
+
+    # The processes are started first, so that they are not forked from a
+    # process with running threads.
+    process_pool = Pool(processes)
+    thread_pool = ThreadPool(threads)
+    # The number of the files being scanned, and the limit for it.
+    scanning = 0
+    max_scanning = 4 * (processes or cpu_count())
+    # `(key, (sizes, error))` of the scanned files (or `(key, exception)` if
+    # the pool failed to scan them), put there by the pool as they are done.
+    done = queue.Queue()
+    try:
+        keys = thread_pool.imap_unordered(
+            _file_key, ((path, use_hash) for path in _iter_pdf_paths(paths)),
+        )
+        for path, key, error in keys:
+            if key is None:
+                yield BatchResult(path, None, error, False)
+                continue
+            cached = None if cache is None else cache.get(key)
+            if cached is not None:
+                yield batch_result(key, cached[0], cached[1], True)
+            else:
+                while scanning >= max_scanning:
+                    scanning -= 1
+                    yield scanned(done.get())
+                scan(path, key)
+                scanning += 1
+            while True:
+                try:
+                    item = done.get_nowait()
+                except queue.Empty:
+                    break
+                scanning -= 1
+                yield scanned(item)
+        while scanning:
+            scanning -= 1
+            yield scanned(done.get())
+    finally:
+        thread_pool.terminate()
+        process_pool.terminate()
+        thread_pool.join()
+        process_pool.join()
+
+
+def _batch_main(args):
+    """
+    Run the batch mode of the command line interface with arguments `args`.
+    """
+    parser = argparse.ArgumentParser(
+        prog="{} --batch".format(argv[0]),
+        description="Scan many PDFs concurrently.",
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="PDF files and directories to scan.",
+    )
+    parser.add_argument(
+        "--units", "-u", choices=sorted(_UNITS_FACTORS), default="px",
+        help="Units of the sizes.",
+    )
+    parser.add_argument(
+        "--format", "-f", choices=("json", "csv"), default="json",
+        help=(
+            "Output format: JSON lines (one object per file) or CSV (one row"
+            " per page)."
+        ),
+    )
+    parser.add_argument(
+        "--cache", "-c", metavar="FILE",
+        help="SQLite file to cache the results in.",
+    )
+    parser.add_argument(
+        "--hash", action="store_true",
+        help="Also use the files' contents' hashes to detect the changes.",
+    )
+    parser.add_argument(
+        "--processes", "-p", type=int,
+        help="Number of the scanning processes (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--threads", "-t", type=int, default=4,
+        help="Number of the threads checking the files.",
+    )
+    args = parser.parse_args(args)
+    cache = None if args.cache is None else PdfSizesCache(args.cache)
+    if args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("path", "page", "width", "height", "error"))
+    try:
+        for result in scan_pdf_files(
+            args.paths, args.units, cache, args.hash, args.processes,
+            args.threads,
+        ):
+            if args.format == "json":
+                sys.stdout.write(json.dumps(result._asdict()) + "\n")
+            elif result.sizes is None:
+                writer.writerow((result.path, "", "", "", result.error))
+            else:
+                writer.writerows(
+                    (result.path, num, width, height, "")
+                    for num, (width, height) in enumerate(
+                        result.sizes, start=1,
+                    )
+                )
+            sys.stdout.flush()
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__" and argv[1:2] == ["--batch"]:
+    _batch_main(argv[2:])
+elif __name__ == "__main__":
     try:
         fname = argv[1]
     except IndexError:
         print("Usage: {cmd} file_name.pdf [units]".format(cmd=argv[0]))
+        print("       {cmd} --batch [options] path...".format(cmd=argv[0]))
     else:
         try:
             units = argv[2]
         except IndexError:
             units = "px"
-        with open(fname, "rb") as f:
-            sizes = pdf_pages_sizes(f, units=units)
-            if sizes:
-                fmt = "  {{num:{max_len}d}}. {{size}}".format(
-                    max_len=int(log10(len(sizes)) + 1),
-                )
-                print("Pages' sizes:")
-                for num, size in enumerate(sizes, start=1):
-                    print(fmt.format(
-                        num=num,
-                        size="{w:.2f} x {h:.2f} {units}".format(
-                            w=size[0], h=size[1], units=units,
-                        ),
-                    ))
-            else:
-                print("Not a single page in this PDF?!?")
+        sizes = pdf_pages_sizes_mmap(fname, units=units)
+        if sizes:
+            fmt = "  {{num:{max_len}d}}. {{size}}".format(
+                max_len=int(log10(len(sizes)) + 1),
+            )
+            print("Pages' sizes:")
+            for num, size in enumerate(sizes, start=1):
+                print(fmt.format(
+                    num=num,
+                    size="{w:.2f} x {h:.2f} {units}".format(
+                        w=size[0], h=size[1], units=units,
+                    ),
+                ))
+        else:
+            print("Not a single page in this PDF?!?")
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+
+"""
+Asynchronous (`asyncio`) interface to `pdf-pages.py`.
+
+The PDFs are read from asynchronous readers, which makes it possible to get
+the pages' sizes of many documents from remote storage (HTTP range requests,
+object stores, etc) concurrently, in one event loop.
+
+A reader needs an async `read(size)` method. It supports random access if
+it also has an async `read_range(offset, size)` method and a `size` (an
+integer or a method, sync or async), or a `seek(offset, whence=0)` method
+(sync or async, with the size found by seeking to the end if there is no
+`size`). Then only the cross-reference data and the page tree's objects are
+read, in small reads (about one per object of the page tree that isn't close
+to the previous one, see `_AsyncSource`), so usually just a small part of
+the file. Otherwise, the whole file is scanned.
+
+The parsing is all done by `pdf-pages.py`, whose readers are generators that
+only request the data, so this module just fetches it asynchronously.
+
+Usage: `./pdf_pages_async.py file_name.pdf... [--units UNITS] [--check]`.
+
+With `--check`, each file is read from memory with `AsyncBytesReader` (with
+and without random access), the results are compared to those of
+`pdf-pages.py`, and the number of the reads (and of the bytes read) that
+each took is printed.
+"""
+
+import argparse
+import asyncio
+from collections import OrderedDict
+import importlib.util
+import inspect
+import io
+import os
+import sys
+from typing import (
+    TYPE_CHECKING, Any, AsyncGenerator, Generator, TypeAlias,
+)
+
+_spec = importlib.util.spec_from_file_location(
+    "pdf_pages", os.path.join(os.path.dirname(__file__), "pdf-pages.py"),
+)
+if _spec is None or _spec.loader is None:
+    raise ImportError("pdf-pages.py not found next to pdf_pages_async.py")
+pdf_pages = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(pdf_pages)
+
+if TYPE_CHECKING:
+    # `pdf-pages.py` is loaded from its path, so its types are not known to
+    # the type checkers.
+    PageGeometry: TypeAlias = Any
+else:
+    PageGeometry = pdf_pages.PageGeometry
+PdfError = pdf_pages.PdfError
+
+# The size of the blocks in which the small random reads are done (and
+# cached), so that the objects close to each other are fetched together.
+BLOCK_SIZE = 4 * 1024
+# The most blocks that are read at once when reading ahead.
+MAX_READ_AHEAD = 16
+# How many blocks are kept in the cache of each reader.
+CACHED_BLOCKS = 256
+
+
+async def _maybe_await(value: Any) -> Any:
+    """
+    Return `value`, awaited first if it is awaitable.
+    """
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+class _AsyncSource:
+    """
+    Access to the data of an asynchronous reader.
+
+    The random reads smaller than `BLOCK_SIZE` are done in whole blocks, which
+    are cached, as the objects that are read through the cross-reference data
+    are often close to each other (and each read from a remote storage has a
+    latency, regardless of its size). When the blocks are read one after
+    another, the reader reads ahead, four times as many blocks each time (up
+    to `MAX_READ_AHEAD`), so that a page tree stored in one place takes just
+    a few reads, while the scattered objects only cost a block each.
+    """
+
+    def __init__(self, reader: Any) -> None:
+        self.reader = reader
+        self.random_access = hasattr(reader, "seek") or (
+            hasattr(reader, "read_range") and hasattr(reader, "size")
+        )
+        # Block's index -> its data.
+        self.blocks: OrderedDict[int, bytes] = OrderedDict()
+        # The index of the block after the last ones read, and how many of
+        # them were read.
+        self.next_block = -1
+        self.read_ahead = 0
+
+    async def _read(self, offset: int | None, size: int) -> bytes:
+        """
+        Return (up to) `size` bytes from `offset` (or, if `None`, from where
+        the previous read stopped), read directly from the reader.
+        """
+        if offset is not None:
+            if hasattr(self.reader, "read_range"):
+                return await self.reader.read_range(offset, size)
+            await _maybe_await(self.reader.seek(offset))
+        return await self.reader.read(size)
+
+    async def _block(self, index: int, count: int) -> bytes:
+        """
+        Return the block with the `index`, from the cache if it's there, and
+        otherwise read with (at least) `count - 1` blocks after it.
+        """
+        try:
+            self.blocks.move_to_end(index)
+        except KeyError:
+            pass
+        else:
+            return self.blocks[index]
+        if index == self.next_block:
+            count = max(count, min(4 * self.read_ahead, MAX_READ_AHEAD))
+        data = await self._read(index * BLOCK_SIZE, count * BLOCK_SIZE)
+        for i in range(count):
+            self.blocks[index + i] = data[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+            self.blocks.move_to_end(index + i)
+        while len(self.blocks) > CACHED_BLOCKS:
+            self.blocks.popitem(last=False)
+        self.next_block = index + count
+        self.read_ahead = count
+        return self.blocks[index]
+
+    async def read(self, offset: int | None, size: int) -> bytes:
+        """
+        Return (up to) `size` bytes from `offset` (or, if `None`, from where
+        the previous read stopped).
+        """
+        if offset is None or size >= BLOCK_SIZE:
+            return await self._read(offset, size)
+        first = offset // BLOCK_SIZE
+        last = (offset + size - 1) // BLOCK_SIZE
+        data = b"".join([
+            await self._block(index, last - index + 1)
+            for index in range(first, last + 1)
+        ])
+        start = offset - first * BLOCK_SIZE
+        return data[start:start + size]
+
+    async def size(self) -> int:
+        """
+        Return the size of the file.
+        """
+        size = getattr(self.reader, "size", None)
+        if size is not None:
+            return await _maybe_await(size() if callable(size) else size)
+        size = await _maybe_await(self.reader.seek(0, 2))
+        if size is None:
+            size = await _maybe_await(self.reader.tell())
+        return size
+
+
+async def _iter_run(
+    gen: Generator, source: _AsyncSource,
+) -> AsyncGenerator[Any, None]:
+    """
+    Run `pdf-pages.py`'s generator `gen` on `source`, yielding what it gives
+    out (and, last, its result, as in `pdf-pages.py`'s `_iter_run`).
+    """
+    requests = pdf_pages._drive(gen)
+    value: Any = None
+    error: Exception | None = None
+    while True:
+        if error is None:
+            request = requests.send(value)
+        else:
+            request, error = requests.throw(error), None
+        value = None
+        if isinstance(request, pdf_pages._Return):
+            yield request
+            return
+        elif isinstance(request, pdf_pages._Yield):
+            yield request.value
+        else:
+            try:
+                if isinstance(request, pdf_pages._Read):
+                    value = await source.read(request.offset, request.size)
+                else:
+                    value = await source.size()
+            except Exception as e:
+                error = e
+
+
+async def _result(gen: Generator, source: _AsyncSource) -> Any:
+    """
+    Return the result of `pdf-pages.py`'s generator `gen` run on `source`.
+    """
+    result = None
+    async for value in _iter_run(gen, source):
+        if isinstance(value, pdf_pages._Return):
+            result = value.value
+    return result
+
+
+async def iter_pdf_pages_geometry(
+    reader: Any,
+    chunk_size: int = 1024**2,
+    units: str = "px",
+    use_xref: bool = True,
+) -> AsyncGenerator[PageGeometry, None]:
+    """
+    Yield `PageGeometry` for PDF in `reader`, as soon as it is known.
+
+    This is the asynchronous variant of `iter_pdf_pages_geometry` from
+    `pdf-pages.py`, with the same arguments, except that the PDF is read from
+    the start of `reader`. The indirect lengths of the streams are not
+    resolved in the linear scan, so it might be slower for the files with
+    such streams.
+    """
+    pdf_pages._UNITS_FACTORS[units]
+    source = _AsyncSource(reader)
+    doc = None
+    # How many pages were yielded before falling back to the linear scan.
+    done = 0
+    if use_xref and source.random_access:
+        doc = pdf_pages._PdfDocument()
+        steps = _iter_run(doc.pages_geometry(units), source)
+        while True:
+            try:
+                geometry = await anext(steps)
+            except pdf_pages._XREF_ERRORS:
+                break
+            if isinstance(geometry, pdf_pages._Return):
+                return
+            yield geometry
+            done += 1
+
+    steps = pdf_pages._scan_steps(
+        chunk_size, units, doc, source.random_access,
+    )
+    async for geometry in _iter_run(steps, source):
+        if isinstance(geometry, pdf_pages._Return):
+            break
+        if done:
+            done -= 1
+        else:
+            yield geometry
+
+
+async def pdf_pages_geometry(
+    reader: Any,
+    chunk_size: int = 1024**2,
+    units: str = "px",
+    use_xref: bool = True,
+) -> list[PageGeometry]:
+    """
+    Return list of `PageGeometry` for PDF in `reader`.
+
+    See `iter_pdf_pages_geometry` for the arguments.
+    """
+    return [
+        geometry
+        async for geometry in iter_pdf_pages_geometry(
+            reader, chunk_size, units, use_xref,
+        )
+    ]
+
+
+async def pdf_pages_sizes(
+    reader: Any,
+    chunk_size: int = 1024**2,
+    units: str = "px",
+    use_xref: bool = True,
+) -> list[tuple[float, float]]:
+    """
+    Return list of sizes for PDF in `reader`, as in `pdf-pages.py`'s
+    `pdf_pages_sizes`.
+
+    See `iter_pdf_pages_geometry` for the arguments.
+    """
+    return [
+        pdf_pages._mediabox_size(geometry, units)
+        for geometry in await pdf_pages_geometry(
+            reader, chunk_size, units, use_xref,
+        )
+    ]
+
+
+async def page_geometry(
+    reader: Any,
+    index: int,
+    chunk_size: int = 1024**2,
+    units: str = "px",
+    use_xref: bool = True,
+) -> PageGeometry:
+    """
+    Return `PageGeometry` of the page with the (zero-based) `index` in PDF in
+    `reader`, as in `pdf-pages.py`'s `page_geometry`.
+
+    See `iter_pdf_pages_geometry` for the other arguments.
+    """
+    source = _AsyncSource(reader)
+    if use_xref and source.random_access:
+        doc = pdf_pages._PdfDocument()
+        try:
+            return await _result(doc.page_geometry(index, units), source)
+        except pdf_pages._XREF_ERRORS:
+            pass
+    pages = iter_pdf_pages_geometry(reader, chunk_size, units, False)
+    if index < 0:
+        all_pages = [geometry async for geometry in pages]
+        if index < -len(all_pages):
+            raise IndexError("page index out of range")
+        return all_pages[index]
+    async for geometry in pages:
+        if not index:
+            await pages.aclose()
+            return geometry
+        index -= 1
+    raise IndexError("page index out of range")
+
+
+async def page_size(
+    reader: Any,
+    index: int,
+    chunk_size: int = 1024**2,
+    units: str = "px",
+    use_xref: bool = True,
+) -> tuple[float, float]:
+    """
+    Return the size of the page with the (zero-based) `index` in PDF in
+    `reader`, as in `pdf-pages.py`'s `page_size`.
+    """
+    return pdf_pages._mediabox_size(
+        await page_geometry(reader, index, chunk_size, units, use_xref),
+        units,
+    )
+
+
+class AsyncBytesReader:
+    """
+    Asynchronous in-memory reader, a stand-in for the remote ones in tests.
+
+    :param data: The contents of the file.
+    :param random_access: If set, the reader has `seek`, `tell`, and `size`.
+        Otherwise, it can only be read sequentially.
+    :param delay: The time (in seconds) that each read takes, to simulate
+        the network latency.
+    """
+
+    def __init__(
+        self, data: bytes, random_access: bool = True, delay: float = 0,
+    ) -> None:
+        self.data = data
+        self.delay = delay
+        self.position = 0
+        # The number of reads and the number of bytes read, for statistics.
+        self.reads = 0
+        self.bytes_read = 0
+        if random_access:
+            self.seek = self._seek
+            self.tell = self._tell
+            self.size = len(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Return (up to) `size` bytes from the current position, and move it.
+        """
+        await asyncio.sleep(self.delay)
+        end = len(self.data) if size < 0 else self.position + size
+        result = self.data[self.position:end]
+        self.position += len(result)
+        self.reads += 1
+        self.bytes_read += len(result)
+        return result
+
+    async def _seek(self, offset: int, whence: int = 0) -> int:
+        """
+        Move the current position (as `io.IOBase.seek`) and return it.
+        """
+        base = (0, self.position, len(self.data))[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    async def _tell(self) -> int:
+        """
+        Return the current position.
+        """
+        return self.position
+
+
+class AsyncFileReader:
+    """
+    Asynchronous reader of a local file, read in threads (with `os.pread`,
+    so only on Unix).
+
+    :param f: The file, open in binary mode.
+    """
+
+    def __init__(self, f: Any) -> None:
+        self.fd = f.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.position = 0
+
+    async def read_range(self, offset: int, size: int) -> bytes:
+        """
+        Return (up to) `size` bytes from `offset`.
+        """
+        return await asyncio.to_thread(os.pread, self.fd, size, offset)
+
+    async def read(self, size: int) -> bytes:
+        """
+        Return (up to) `size` bytes from the current position, and move it.
+        """
+        result = await self.read_range(self.position, size)
+        self.position += len(result)
+        return result
+
+
+async def _main(paths: list[str], units: str) -> None:
+    """
+    Print the sizes of the pages of PDF files `paths`, read concurrently.
+    """
+    async def sizes(path: str) -> list[tuple[float, float]]:
+        with open(path, "rb") as f:
+            return await pdf_pages_sizes(AsyncFileReader(f), units=units)
+
+    results = await asyncio.gather(
+        *(sizes(path) for path in paths), return_exceptions=True,
+    )
+    for path, result in zip(paths, results):
+        if isinstance(result, BaseException):
+            print(f"{path}: {type(result).__name__}: {result}")
+            continue
+        print(f"{path}:")
+        for num, (width, height) in enumerate(result, start=1):
+            print(f"  {num}. {width:.2f} x {height:.2f} {units}")
+
+
+async def _check(paths: list[str], units: str) -> bool:
+    """
+    Compare the sizes of the pages of PDF files `paths`, read through
+    `AsyncBytesReader`, to those from `pdf-pages.py`, printing the number of
+    reads that each way of reading took. Return `True` if they all match.
+    """
+    ok = True
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            expected = pdf_pages.pdf_pages_sizes(io.BytesIO(data), units=units)
+        except PdfError as e:
+            print(f"{path}: {type(e).__name__}: {e}")
+            continue
+        print(f"{path}: {len(data)} bytes, {len(expected)} page(s)")
+        for name, random_access, use_xref in (
+            ("xref", True, True),
+            ("scan", True, False),
+            ("sequential", False, True),
+        ):
+            reader = AsyncBytesReader(data, random_access)
+            failed = False
+            try:
+                sizes = await pdf_pages_sizes(
+                    reader, units=units, use_xref=use_xref,
+                )
+            except PdfError as e:
+                result = f"{type(e).__name__}: {e}"
+                failed = True
+            else:
+                result = "ok" if sizes == expected else "MISMATCH"
+            # Without random access, the page tree can't be read from the
+            # object streams, so `PdfError` is expected there (but a wrong
+            # result never is).
+            ok = ok and (
+                result == "ok" or (failed and not random_access)
+            )
+            print(
+                f"  {name}: {result},"
+                f" {reader.reads} read(s), {reader.bytes_read} bytes",
+            )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=sys.modules[__name__].__doc__)
+    parser.add_argument("paths", nargs="+", help="PDF files.")
+    parser.add_argument(
+        "--units", "-u",
+        choices=sorted(pdf_pages._UNITS_FACTORS),
+        default="px",
+        help="Units of the sizes.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Check the results against pdf-pages.py and count the reads.",
+    )
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if asyncio.run(_check(args.paths, args.units)) else 1)
+    asyncio.run(_main(args.paths, args.units))
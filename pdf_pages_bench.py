@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks and a test corpus generator for `pdf-pages.py`.
+
+The benchmark synthesizes PDFs (seeded, so they are reproducible) with
+configurable numbers of pages, page tree fan-outs (and thus depths), sizes of
+the pages' binary content streams, and kinds of the cross-reference data
+(tables, streams, or streams with the page tree's objects packed in object
+streams). The sizes of the pages are random, and some pages inherit them from
+the root of the page tree. The content streams contain decoys (fake objects
+and `endstream` keywords), so the scanners have to skip them properly.
+
+Each file is scanned in several modes (see `MODES`) and with several chunk
+sizes, and the results are compared with the known sizes of the pages. For
+each run, the benchmark reports the wall time, the throughput (in MB/s and
+pages/s), and the peak RSS.
+
+The files are scanned right after being written, so they are read from the
+operating system's cache, which is what the benchmark measures. The peak RSS
+is measured in a fresh process for each run, which includes the interpreter
+itself (reported as `base_rss`). Note that the memory mapped pages of the
+files count into RSS.
+
+The output is written as JSON lines: the first one describes the environment,
+and each of the following ones describes one run. The exit status is 1 if any
+of the runs gave wrong sizes or failed, so this can be used to catch
+regressions.
+
+Usage: `./pdf_pages_bench.py [options]` (see `--help` for the options).
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, BinaryIO, Callable, Iterator, NamedTuple, TextIO
+import zlib
+
+_spec = importlib.util.spec_from_file_location(
+    "pdf_pages", os.path.join(os.path.dirname(__file__), "pdf-pages.py"),
+)
+if _spec is None or _spec.loader is None:
+    raise ImportError("pdf-pages.py not found next to pdf_pages_bench.py")
+pdf_pages = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(pdf_pages)
+
+
+class Mode(NamedTuple):
+    """
+    A way of scanning PDF to benchmark.
+    """
+
+    # A function that returns the sizes of the pages of PDF file, given its
+    # path and the chunk size.
+    scan: Callable[[str, int], list[tuple[float, float]]]
+    # If set, the mode is run with each of the chunk sizes. Otherwise, it's
+    # run once (as the chunk size only matters when falling back to the
+    # linear scan).
+    chunked: bool = True
+    # If not set, the mode doesn't support the files with object streams.
+    object_streams: bool = True
+
+
+class _SequentialReader:
+    """
+    A reader without random access, like a pipe or a network stream.
+    """
+
+    def __init__(self, f: BinaryIO) -> None:
+        self.read = f.read
+
+
+def _scan_file(
+    path: str, chunk_size: int, use_xref: bool,
+) -> list[tuple[float, float]]:
+    """
+    Return the sizes of the pages of PDF in file `path`, read in chunks.
+    """
+    with open(path, "rb") as f:
+        return pdf_pages.pdf_pages_sizes(f, chunk_size, use_xref=use_xref)
+
+
+def _scan_sequential(path: str, chunk_size: int) -> list[tuple[float, float]]:
+    """
+    Return the sizes of the pages of PDF in file `path`, read sequentially.
+    """
+    with open(path, "rb") as f:
+        return pdf_pages.pdf_pages_sizes(_SequentialReader(f), chunk_size)
+
+
+MODES = {
+    "xref": Mode(
+        lambda path, chunk_size: _scan_file(path, chunk_size, True),
+        chunked=False,
+    ),
+    "linear": Mode(
+        lambda path, chunk_size: _scan_file(path, chunk_size, False),
+    ),
+    "sequential": Mode(_scan_sequential, object_streams=False),
+    "mmap": Mode(pdf_pages.pdf_pages_sizes_mmap, chunked=False),
+    "mmap-linear": Mode(
+        lambda path, chunk_size: pdf_pages.pdf_pages_sizes_mmap(
+            path, chunk_size, use_xref=False,
+        ),
+    ),
+}
+XREF_KINDS = ("table", "stream", "objstm")
+DEFAULT_MODES = tuple(MODES)
+DEFAULT_PAGES = (10, 100, 1000)
+DEFAULT_FANOUTS = (2, 32)
+DEFAULT_STREAM_SIZES = (1024, 1024**2)
+DEFAULT_CHUNK_SIZES = (4 * 1024, 64 * 1024, 1024**2)
+DEFAULT_MAX_FILE_SIZE = 128 * 1024**2
+
+# The MediaBox of the root of the page tree, inherited by the pages without
+# their own.
+ROOT_MEDIABOX: tuple[float, float, float, float] = (0, 0, 612, 792)
+# The possible widths and heights of the pages (exactly representable as
+# floats, so that the expected sizes can be compared exactly).
+PAGE_DIMENSIONS = (72, 297.5, 419.25, 595, 612, 792, 842, 1190.5)
+# The number of objects packed in each object stream.
+OBJECTS_PER_STREAM = 100
+# Text put in the content streams to trip the scanners that don't skip them.
+STREAM_DECOY = b"\n1 0 obj << /Type /Page /MediaBox [0 0 1 1] >> endobj\n"
+STREAM_END_DECOY = b"\nendstream\nendobj\n"
+
+
+class CorpusFile(NamedTuple):
+    """
+    A description of a synthesized PDF.
+    """
+
+    # The number of pages.
+    pages: int
+    # The maximum number of kids of the page tree's nodes.
+    fanout: int
+    # The size of each page's content stream (random binary data).
+    stream_size: int
+    # The kind of the cross-reference data, one of `XREF_KINDS`.
+    xref: str
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the file for this description.
+        """
+        return (
+            f"p{self.pages}-f{self.fanout}-s{self.stream_size}-{self.xref}"
+            f"-{self.seed}.pdf"
+        )
+
+    def estimated_size(self) -> int:
+        """
+        Return the approximate size of the file, without generating it.
+        """
+        return self.pages * (self.stream_size + 200)
+
+
+class GeneratedPdf(NamedTuple):
+    """
+    A synthesized PDF and what is known about it.
+    """
+
+    data: bytes
+    # The sizes of the pages' MediaBoxes, in px.
+    sizes: list[tuple[float, float]]
+    # The depth of the page tree (1 if all the pages are the root's kids).
+    depth: int
+
+
+def _pdf_number(value: float) -> bytes:
+    """
+    Return `value` as PDF number.
+    """
+    return str(value).encode()
+
+
+def _pdf_box(box: tuple[float, ...]) -> bytes:
+    """
+    Return `box` as PDF array.
+    """
+    return b"[" + b" ".join(_pdf_number(value) for value in box) + b"]"
+
+
+def _content_stream(rnd: random.Random, size: int, direct: bool) -> bytes:
+    """
+    Return the data of a content stream of `size` random bytes, with decoys.
+
+    The `endstream` decoys are only included if the stream's length is
+    `direct`, as the end of a stream with an unresolved indirect length can
+    only be guessed.
+    """
+    data = bytearray(rnd.randbytes(size))
+    decoys = [STREAM_DECOY, STREAM_END_DECOY] if direct else [STREAM_DECOY]
+    for decoy in decoys:
+        if len(decoy) < size:
+            position = rnd.randrange(size - len(decoy) + 1)
+            data[position:position + len(decoy)] = decoy
+    return bytes(data)
+
+
+def generate_pdf(spec: CorpusFile) -> GeneratedPdf:
+    """
+    Return a synthesized PDF described by `spec`.
+
+    Every fourth page inherits its MediaBox from the root of the page tree,
+    the others have their own, with random sizes and origins. Every fifth
+    content stream has an indirect length.
+    """
+    rnd = random.Random(
+        f"{spec.pages}:{spec.fanout}:{spec.stream_size}:{spec.xref}"
+        f":{spec.seed}",
+    )
+    # Object's number -> its contents. The content streams are kept apart,
+    # as they can't go into the object streams.
+    objects: dict[int, bytes] = dict()
+    streams: dict[int, bytes] = dict()
+    sizes: list[tuple[float, float]] = list()
+    next_num = 3
+
+    def new_num() -> int:
+        nonlocal next_num
+        next_num += 1
+        return next_num - 1
+
+    def add_page(parent: int) -> int:
+        num = new_num()
+        content = new_num()
+        direct = len(sizes) % 5 != 4
+        data = _content_stream(rnd, spec.stream_size, direct)
+        if direct:
+            length = _pdf_number(len(data))
+        else:
+            length_num = new_num()
+            objects[length_num] = _pdf_number(len(data))
+            length = b"%d 0 R" % length_num
+        streams[content] = (
+            b"<< /Length " + length + b" >>\nstream\n" + data + b"\nendstream"
+        )
+        if len(sizes) % 4 == 3:
+            mediabox = b""
+            x1, y1, x2, y2 = ROOT_MEDIABOX
+        else:
+            x1, y1 = rnd.randrange(100), rnd.randrange(100)
+            x2 = x1 + rnd.choice(PAGE_DIMENSIONS)
+            y2 = y1 + rnd.choice(PAGE_DIMENSIONS)
+            mediabox = b" /MediaBox " + _pdf_box((x1, y1, x2, y2))
+        sizes.append((x2 - x1, y2 - y1))
+        objects[num] = (
+            b"<< /Type /Page /Parent %d 0 R%s /Contents %d 0 R >>"
+            % (parent, mediabox, content)
+        )
+        return num
+
+    def add_kids(parent: int, count: int) -> tuple[list[int], int]:
+        """
+        Add the nodes for `count` pages under `parent`, returning the list of
+        their numbers and the depth of the subtree.
+        """
+        if count <= spec.fanout:
+            return [add_page(parent) for _ in range(count)], 1
+        kids = list()
+        depth = 0
+        per_kid = -(-count // spec.fanout)
+        for first in range(0, count, per_kid):
+            kid_count = min(per_kid, count - first)
+            num = new_num()
+            kids.append(num)
+            grandkids, kid_depth = add_kids(num, kid_count)
+            depth = max(depth, kid_depth + 1)
+            objects[num] = (
+                b"<< /Type /Pages /Parent %d 0 R /Kids [%s] /Count %d >>"
+                % (
+                    parent,
+                    b" ".join(b"%d 0 R" % grandkid for grandkid in grandkids),
+                    kid_count,
+                )
+            )
+        return kids, depth
+
+    kids, depth = add_kids(2, spec.pages)
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = b"<< /Type /Pages /MediaBox %s /Kids [%s] /Count %d >>" % (
+        _pdf_box(ROOT_MEDIABOX),
+        b" ".join(b"%d 0 R" % kid for kid in kids),
+        spec.pages,
+    )
+
+    out = bytearray(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    # Object's number -> its offset, or `(object stream, index)`.
+    entries: dict[int, int | tuple[int, int]] = dict()
+
+    def write_object(num: int, contents: bytes) -> None:
+        entries[num] = len(out)
+        out.extend(b"%d 0 obj\n%s\nendobj\n" % (num, contents))
+
+    packed = spec.xref == "objstm"
+    for num in sorted(streams if packed else {**objects, **streams}):
+        write_object(num, streams.get(num) or objects[num])
+    if packed:
+        nums = sorted(objects)
+        for first in range(0, len(nums), OBJECTS_PER_STREAM):
+            group = nums[first:first + OBJECTS_PER_STREAM]
+            stream_num = new_num()
+            header = bytearray()
+            body = bytearray()
+            for index, num in enumerate(group):
+                entries[num] = (stream_num, index)
+                header.extend(b"%d %d " % (num, len(body)))
+                body.extend(objects[num] + b"\n")
+            data = zlib.compress(bytes(header + body))
+            write_object(
+                stream_num,
+                b"<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode"
+                b" /Length %d >>\nstream\n%s\nendstream"
+                % (len(group), len(header), len(data), data),
+            )
+
+    xref_offset = len(out)
+    if spec.xref == "table":
+        size = next_num
+        out.extend(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for num in range(1, size):
+            offset = entries[num]
+            # Without the object streams, all the objects are at offsets.
+            assert isinstance(offset, int)
+            out.extend(b"%010d 00000 n \n" % offset)
+        out.extend(b"trailer\n<< /Size %d /Root 1 0 R >>\n" % size)
+    else:
+        xref_num = new_num()
+        entries[xref_num] = xref_offset
+        size = next_num
+        rows = bytearray(b"\x00\x00\x00\x00\x00\xff\xff")
+        for num in range(1, size):
+            entry = entries[num]
+            if isinstance(entry, tuple):
+                rows.extend(
+                    b"\x02" + entry[0].to_bytes(4, "big")
+                    + entry[1].to_bytes(2, "big")
+                )
+            else:
+                rows.extend(b"\x01" + entry.to_bytes(4, "big") + b"\x00\x00")
+        data = zlib.compress(bytes(rows))
+        out.extend(
+            b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R"
+            b" /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream\n"
+            b"endobj\n"
+            % (xref_num, size, len(data), data)
+        )
+    out.extend(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+    return GeneratedPdf(bytes(out), sizes, depth)
+
+
+def iter_corpus(
+    pages: list[int],
+    fanouts: list[int],
+    stream_sizes: list[int],
+    xrefs: list[str],
+    seeds: int,
+) -> Iterator[CorpusFile]:
+    """
+    Yield the descriptions of all the files to synthesize.
+    """
+    for page_count in pages:
+        for fanout in fanouts:
+            for stream_size in stream_sizes:
+                for xref in xrefs:
+                    for seed in range(seeds):
+                        yield CorpusFile(
+                            page_count, fanout, stream_size, xref, seed,
+                        )
+
+
+def _max_rss() -> int:
+    """
+    Return the peak RSS of this process, in bytes.
+
+    On Linux, it's taken from `/proc`, as `ru_maxrss` is inherited from the
+    parent process (and kept over `exec`).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It's in bytes on macOS and in KiB elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _measure_rss(mode_name: str, path: str, chunk_size: int) -> list[int]:
+    """
+    Scan `path` in the mode `mode_name` and return the peak RSS before and
+    after.
+
+    This is meant to be run in a fresh process.
+    """
+    base_rss = _max_rss()
+    MODES[mode_name].scan(path, chunk_size)
+    return [base_rss, _max_rss()]
+
+
+def run_one(
+    path: str,
+    mode: Mode,
+    chunk_size: int,
+    expected: list[tuple[float, float]],
+) -> dict[str, Any]:
+    """
+    Scan the file `path` in `mode` and return the measurements.
+    """
+    start_time = time.perf_counter()
+    try:
+        sizes = mode.scan(path, chunk_size)
+    except Exception as e:
+        return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    result: dict[str, Any] = {"time": time.perf_counter() - start_time}
+    if sizes == expected:
+        result["status"] = "ok"
+    else:
+        result["status"] = "wrong"
+        result["pages_found"] = len(sizes)
+        result["first_difference"] = next(
+            (
+                index
+                for index, (size, expected_size) in enumerate(
+                    zip(sizes, expected),
+                )
+                if size != expected_size
+            ),
+            min(len(sizes), len(expected)),
+        )
+    return result
+
+
+def run_benchmark(
+    out: TextIO,
+    corpus: Iterator[CorpusFile],
+    modes: list[str],
+    chunk_sizes: list[int],
+    repeat: int = 1,
+    max_file_size: int | None = DEFAULT_MAX_FILE_SIZE,
+    measure_memory: bool = True,
+    corpus_dir: str | None = None,
+) -> int:
+    """
+    Run all the benchmarks, write the results to `out` as JSON lines, and
+    return the number of runs that gave wrong results or failed.
+
+    The reported time is the best one of `repeat` runs. If `measure_memory`
+    is set, one more run is made in a fresh process to get the peak RSS.
+
+    The synthesized files are written to `corpus_dir`, along with JSON files
+    with the expected sizes of their pages, and kept there. If `corpus_dir`
+    is `None`, they are written to a temporary directory and removed after
+    use.
+    """
+    meta = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    out.write(json.dumps({"meta": meta}) + "\n")
+    failures = 0
+    keep_files = corpus_dir is not None
+    if corpus_dir is None:
+        corpus_dir = tempfile.mkdtemp(prefix="pdf_pages_bench-")
+    else:
+        os.makedirs(corpus_dir, exist_ok=True)
+    # A fresh process for each memory measurement, with nothing inherited.
+    mp_context = multiprocessing.get_context("spawn")
+    try:
+        for spec in corpus:
+            description: dict[str, Any] = spec._asdict()
+            if (
+                max_file_size is not None
+                and spec.estimated_size() > max_file_size
+            ):
+                out.write(json.dumps(dict(description, status="skipped")))
+                out.write("\n")
+                continue
+            pdf = generate_pdf(spec)
+            path = os.path.join(corpus_dir, spec.name)
+            with open(path, "wb") as f:
+                f.write(pdf.data)
+            if keep_files:
+                with open(f"{path[:-4]}.json", "w") as f:
+                    json.dump(pdf.sizes, f)
+            description.update(depth=pdf.depth, file_size=len(pdf.data))
+            for mode_name in modes:
+                mode = MODES[mode_name]
+                for chunk_size in chunk_sizes if mode.chunked else [None]:
+                    record = dict(
+                        description, mode=mode_name, chunk_size=chunk_size,
+                    )
+                    if spec.xref == "objstm" and not mode.object_streams:
+                        record["status"] = "unsupported"
+                        out.write(json.dumps(record) + "\n")
+                        continue
+                    chunk_size = chunk_size or max(chunk_sizes)
+                    runs = [
+                        run_one(path, mode, chunk_size, pdf.sizes)
+                        for _ in range(repeat)
+                    ]
+                    best_run = min(runs, key=lambda run: run.get("time", 0))
+                    record.update(best_run)
+                    if record["status"] == "ok":
+                        record["mb_per_s"] = (
+                            len(pdf.data) / 1e6 / record["time"]
+                        )
+                        record["pages_per_s"] = spec.pages / record["time"]
+                        if measure_memory:
+                            with mp_context.Pool(1) as pool:
+                                record["base_rss"], record["peak_rss"] = (
+                                    pool.apply(
+                                        _measure_rss,
+                                        (mode_name, path, chunk_size),
+                                    )
+                                )
+                    else:
+                        failures += 1
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+            if not keep_files:
+                os.remove(path)
+    finally:
+        if not keep_files:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    return failures
+
+
+def _list_of(item_type: type) -> Any:
+    """
+    Return a function that parses a comma-separated list for `argparse`.
+    """
+    def parse(value: str) -> list[Any]:
+        return [item_type(item) for item in value.split(",") if item]
+    return parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF pages' sizes benchmark.")
+    parser.add_argument(
+        "-m", "--modes", type=_list_of(str), default=list(DEFAULT_MODES),
+        help=f"comma-separated scanning modes to benchmark, out of"
+        f" {', '.join(MODES)} (default: all)",
+    )
+    parser.add_argument(
+        "-p", "--pages", type=_list_of(int), default=list(DEFAULT_PAGES),
+        help=f"comma-separated numbers of pages (default:"
+        f" {','.join(str(pages) for pages in DEFAULT_PAGES)})",
+    )
+    parser.add_argument(
+        "-f", "--fanouts", type=_list_of(int), default=list(DEFAULT_FANOUTS),
+        help=f"comma-separated maximum numbers of the page tree nodes' kids"
+        f" (default: {','.join(str(fanout) for fanout in DEFAULT_FANOUTS)})",
+    )
+    parser.add_argument(
+        "-s", "--stream-sizes", type=_list_of(int),
+        default=list(DEFAULT_STREAM_SIZES),
+        help=f"comma-separated sizes of the pages' content streams (default:"
+        f" {','.join(str(size) for size in DEFAULT_STREAM_SIZES)})",
+    )
+    parser.add_argument(
+        "-x", "--xrefs", type=_list_of(str), default=list(XREF_KINDS),
+        help=f"comma-separated kinds of the cross-reference data, out of"
+        f" {', '.join(XREF_KINDS)} (default: all)",
+    )
+    parser.add_argument(
+        "-c", "--chunk-sizes", type=_list_of(int),
+        default=list(DEFAULT_CHUNK_SIZES),
+        help=f"comma-separated chunk sizes (default:"
+        f" {','.join(str(size) for size in DEFAULT_CHUNK_SIZES)})",
+    )
+    parser.add_argument(
+        "-n", "--seeds", type=int, default=1,
+        help="the number of random files per combination (default: 1)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=1,
+        help="the number of timed runs per file, mode, and chunk size"
+        " (default: 1)",
+    )
+    parser.add_argument(
+        "--max-file-size", type=int, default=DEFAULT_MAX_FILE_SIZE,
+        help=f"skip the files bigger than this (default:"
+        f" {DEFAULT_MAX_FILE_SIZE})",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true",
+        help="don't measure the peak RSS",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        help="keep the synthesized files (and their expected sizes) in this"
+        " directory",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="the output file (default: standard output)",
+    )
+    args = parser.parse_args()
+    unknown_modes = set(args.modes) - set(MODES)
+    if unknown_modes:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown_modes))}")
+    unknown_xrefs = set(args.xrefs) - set(XREF_KINDS)
+    if unknown_xrefs:
+        parser.error(
+            f"unknown cross-reference kinds:"
+            f" {', '.join(sorted(unknown_xrefs))}",
+        )
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        failures = run_benchmark(
+            out,
+            iter_corpus(
+                args.pages, args.fanouts, args.stream_sizes, args.xrefs,
+                args.seeds,
+            ),
+            modes=args.modes,
+            chunk_sizes=args.chunk_sizes,
+            repeat=args.repeat,
+            max_file_size=args.max_file_size,
+            measure_memory=not args.no_memory,
+            corpus_dir=args.corpus_dir,
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    sys.exit(1 if failures else 0)